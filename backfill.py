@@ -0,0 +1,150 @@
+from utils.backfill_utils import CheckpointStore, run_backfill
+from utils.process__tx_txn_to_s3 import (
+    process_tx_txn, get_all_joinable, get_transaction_id_range, generate_transaction_id_windows, generate_date_strings,
+)
+from utils.s3_utils import S3
+from utils.metrics_utils import RunReport, timed_stage
+import argparse
+import functools
+import threading
+from concurrent.futures import Future
+import logging
+from collections import OrderedDict
+import pendulum
+
+#SENSITIVE ASSIGNMENT#!!!!!!!!!!!!!
+region_name = "ap-southeast-1"
+#SENSITIVE ASSIGNMENT ENDED#!!!!!!!!!!!!!
+
+_s3 = None
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        from utils.setting import AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY
+        _s3 = S3(AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY, region_name = region_name, staging=False, log_level=logging.WARNING)
+    return _s3
+
+def run_campaigns_date(date, batch, report=None):
+    #one unit per date: every active campaign of new_to_blink_s3.py in one scan, each uploaded to its own key.
+    #always the full-window query, incremental states only work when the dates run in order one at a time
+    import new_to_blink_s3
+    if report is not None:
+        report = report.bind(date=date)
+    winners = new_to_blink_s3.fetch_campaign_winners(date, report=report)
+    new_to_blink_s3.upload_campaign_frames(winners, date, report=report)
+    return sum(len(df) for df in winners.values())
+
+class TxTxnBackfill:
+    """
+    tx_txn issue pipeline of utils.process__tx_txn_to_s3 as backfill units, one per transaction_id window.
+
+    plan_batches splits a partition into windows of batch_size transaction ids and run_unit processes one window
+    and writes it to s3://bucket/prefix/year=/month=/day=/<reverse batch>.csv, the last window as 0.csv as the
+    earlier hand run uploads did. Units run concurrently, so 0.csv is not a completeness marker within a backfill,
+    the date's _DONE checkpoint is. The joinable tables are loaded once per date and kept for the last few dates.
+    """
+    def __init__(self, output=None, batch_size=500000, joinable_lag_days=0, cache=None, keep_dates=2, report=None):
+        self.output = output.rstrip("/") if output else None
+        self.report = report
+        self.batch_size = batch_size
+        self.joinable_lag_days = joinable_lag_days
+        self.cache = cache
+        self.keep_dates = keep_dates
+        self.windows = {}
+        self.joinables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def plan_batches(self, date):
+        transaction_id_min, transaction_id_max = get_transaction_id_range(date)
+        if transaction_id_min is None:
+            print(f"no transactions:: {date}")
+            return []
+        windows = generate_transaction_id_windows(transaction_id_min, transaction_id_max, self.batch_size)
+        self.windows[date] = {batch: (window_min, window_max) for batch, window_min, window_max in windows}
+        return [batch for batch, _, _ in windows]
+
+    def get_joinables(self, date):
+        #the first unit of a joinable date loads it, later units of that date wait on its future while units of
+        #dates already loaded go on, the lock only guards the dict
+        joinable_date = pendulum.parse(date).subtract(days=self.joinable_lag_days).to_date_string()
+        with self.lock:
+            future = self.joinables.get(joinable_date)
+            load = future is None
+            if load:
+                future = self.joinables[joinable_date] = Future()
+                while len(self.joinables) > self.keep_dates:
+                    self.joinables.popitem(last=False)
+            self.joinables.move_to_end(joinable_date)
+        if load:
+            try:
+                future.set_result(get_all_joinable(joinable_date, cache=self.cache))
+            except Exception as e:
+                #the units waiting now fail with it, the next unit of the date loads again
+                future.set_exception(e)
+                with self.lock:
+                    if self.joinables.get(joinable_date) is future:
+                        del self.joinables[joinable_date]
+        return future.result()
+
+    def run_unit(self, date, batch):
+        window_min, window_max = self.windows[date][batch]
+        report = self.report.bind(date=date) if self.report is not None else None
+        df = process_tx_txn(date, batch, window_min, window_max, *self.get_joinables(date), report=report)
+        if self.output and not df.empty:
+            day = pendulum.parse(date)
+            reverse_batch = max(self.windows[date]) - batch
+            bucket_name, _, prefix = self.output[len("s3://"):].partition("/")
+            s3_key = f"{prefix}/year={day.year}/month={day.month}/day={day.day}/{reverse_batch}.csv"
+            #raises on failure, so the unit is not checkpointed as done without its file
+            with timed_stage(report, "upload", rows_in=len(df), batch=batch) as stage:
+                stage.bytes = get_s3().upload_df_to_s3(df, bucket_name, s3_key, raise_errors=True)
+        return len(df)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a daily pipeline over a date range, resuming from checkpoints")
+    parser.add_argument("pipeline", choices=["campaigns", "tx_txn"])
+    parser.add_argument("--start", required=True, help="first date, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last date, YYYY-MM-DD, inclusive")
+    parser.add_argument("--max-workers", type=int, default=4, help="units running at the same time")
+    parser.add_argument("--checkpoints", default=None, help="local directory or s3://bucket/prefix, defaults to /home/chunkit/backfill/<pipeline>")
+    parser.add_argument("--output", default=None, help="tx_txn only (and required for it), s3://bucket/prefix the batches are written to")
+    parser.add_argument("--batch-size", type=int, default=500000, help="tx_txn only, transaction ids per batch")
+    parser.add_argument("--joinable-lag-days", type=int, default=0, help="tx_txn only, age of the joinable table snapshot relative to the date")
+    parser.add_argument("--cache-dir", default=None, help="tx_txn only, utils.cache_utils.ParquetCache directory for the joinable tables")
+    parser.add_argument("--report", default=None, help="JSON run report path, defaults to /home/chunkit/backfill/<pipeline>_<start>_<end>.json")
+    parser.add_argument("--prometheus", default=None, help="also write the stage totals as a Prometheus textfile to this path")
+    args = parser.parse_args()
+    #without an output every date would be checkpointed as done with nothing written
+    if args.pipeline == "tx_txn" and not args.output:
+        parser.error("--output is required for the tx_txn pipeline")
+
+    location = args.checkpoints or f"/home/chunkit/backfill/{args.pipeline}"
+    checkpoints = CheckpointStore(location, s3=get_s3() if location.startswith("s3://") else None)
+    dates = generate_date_strings(args.start, args.end)
+    report = RunReport(f"backfill_{args.pipeline}", start=args.start, end=args.end)
+
+    error = None
+    try:
+        if args.pipeline == "campaigns":
+            summary = run_backfill(dates, functools.partial(run_campaigns_date, report=report), checkpoints, max_workers=args.max_workers)
+        else:
+            cache = None
+            if args.cache_dir:
+                from utils.cache_utils import ParquetCache
+                cache = ParquetCache(args.cache_dir)
+            pipeline = TxTxnBackfill(args.output, args.batch_size, args.joinable_lag_days, cache, keep_dates=max(args.max_workers, 2), report=report)
+            summary = run_backfill(dates, pipeline.run_unit, checkpoints, plan_batches=pipeline.plan_batches, max_workers=args.max_workers)
+        if summary["failed"]:
+            error = RuntimeError(f"{len(summary['failed'])} units failed")
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        report.finish(error)
+        report.write_reports(args.report or f"/home/chunkit/backfill/{args.pipeline}_{args.start}_{args.end}.json", args.prometheus)
+    if summary["failed"]:
+        raise SystemExit(f"{len(summary['failed'])} units failed, run the same command again to retry them")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Per-call setup cost of bq_to_pd_v2 before and after the shared client registry.
+
+The service account file is a throwaway key generated here, and bigquery.Client.query is stubbed, so the numbers
+are only the credential loading and client/gRPC channel construction that every call used to pay. No request
+leaves the machine.
+
+Usage:
+    python benchmarks/bench_bq_client_setup.py --calls 50
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from utils import utils
+
+
+class _StubRowIterator:
+    total_rows = 1
+
+    def to_dataframe(self, bqstorage_client=None):
+        return pd.DataFrame({"test_column": [1]})
+
+
+class _StubQueryJob:
+    total_bytes_processed = 0
+
+    def result(self):
+        return _StubRowIterator()
+
+
+def _stub_query(self, query, *args, **kwargs):
+    return _StubQueryJob()
+
+
+def _write_fake_service_account(path):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode('utf-8')
+    with open(path, 'w') as f:
+        json.dump({
+            "type": "service_account",
+            "project_id": "benchmark-project",
+            "private_key_id": "benchmark",
+            "private_key": pem,
+            "client_email": "benchmark@benchmark-project.iam.gserviceaccount.com",
+            "client_id": "0",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }, f)
+
+
+def _time_calls(fn, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    from google.cloud import bigquery
+    bigquery.Client.query = _stub_query
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cred = os.path.join(tmp_dir, "service_account.json")
+        _write_fake_service_account(cred)
+
+        def per_call_clients():
+            # What bq_to_pd_v2 did before the registry: new credentials and clients on every call
+            client, bqstorageclient = utils._create_bq_clients(cred)
+            client.query("SELECT 1").result().to_dataframe(bqstorage_client=bqstorageclient)
+
+        before = _time_calls(per_call_clients, args.calls)
+        utils.reset_bq_clients()
+        after = _time_calls(lambda: utils.bq_to_pd_v2("SELECT 1", cred=cred), args.calls)
+        utils.reset_bq_clients()
+
+    for name, timings in [("per-call clients", before), ("shared clients", after)]:
+        print(f"{name:>16}: mean {statistics.mean(timings):8.3f} ms, median {statistics.median(timings):8.3f} ms, "
+              f"first call {timings[0]:8.3f} ms over {len(timings)} calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Peak RSS of bq_to_pd_v2 (eager) next to bq_to_pd_stream (chunked) for the same query.
+
+Each mode runs in its own freshly spawned process so the reported ru_maxrss belongs to that mode only. The query
+does hit BigQuery; chunks are consumed and dropped the way a chunk-by-chunk upload would.
+
+Usage:
+    python benchmarks/bench_bq_stream_memory.py --query-file q.sql --chunk-rows 200000
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _run_mode(mode, query, cred, chunk_rows, queue):
+    from utils.utils import bq_to_pd_v2, bq_to_pd_stream
+
+    start = time.perf_counter()
+    rows = 0
+    chunks = 0
+    if mode == "eager":
+        df = bq_to_pd_v2(query, cred=cred)
+        rows = len(df)
+        chunks = 1
+        del df
+    else:
+        for chunk in bq_to_pd_stream(query, cred=cred, chunk_rows=chunk_rows):
+            rows += len(chunk)
+            chunks += 1
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put({"mode": mode, "rows": rows, "chunks": chunks, "seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query-file", required=True)
+    parser.add_argument("--cred", default="/home/chunkit/codebase/blink-data-warehouse-fb84cc3e005f.json")
+    parser.add_argument("--chunk-rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    with open(args.query_file) as f:
+        query = f.read()
+
+    context = multiprocessing.get_context("spawn")
+    for mode in ["eager", "stream"]:
+        queue = context.Queue()
+        process = context.Process(target=_run_mode, args=(mode, query, args.cred, args.chunk_rows, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print(f"{result['mode']:>6}: rows {result['rows']}, chunks {result['chunks']}, "
+              f"{result['seconds']:.1f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
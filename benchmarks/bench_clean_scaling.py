@@ -0,0 +1,92 @@
+"""
+Runtime of the new_to_blink_s3.py cleaning steps at growing row counts, per-cell Python vs utils.clean_utils.
+
+The per-cell version is what new_to_blink_s3.py ran before: card_no .str.strip().astype(int), a Python function
+applied to every string cell for comma removal (printing each hit, sent to /dev/null here), then df.map(strip)
+over the whole frame. The vectorized version is parse_card_no + clean_string_columns. Both produce the same
+frame; the ns/row column staying flat as rows double is the linear scaling check.
+
+Usage:
+    python benchmarks/bench_clean_scaling.py --rows 500000 1000000 2000000 4000000
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from utils.clean_utils import clean_string_columns, parse_card_no, format_clean_summary
+
+
+def make_campaign_frame(rows, seed=0):
+    # shaped like the new_to_blink_s3.py query result: padded card numbers, names with stray commas and blanks
+    rng = np.random.default_rng(seed)
+    cards = np.array([f" {6000000000000000 + i} " for i in range(max(rows // 2, 1))], dtype=object)
+    names = np.array(["AHMAD ", " TAN, MEI LING", "LEE\t", "SITI,", "WONG KAH WAI"], dtype=object)
+    mobiles = np.array(["0123456789 ", " 0198765432", "60112233445", None], dtype=object)
+    return pd.DataFrame({
+        "transaction_id": np.arange(rows) + 900000000,
+        "card_no": rng.choice(cards, rows),
+        "total_txn_value": rng.gamma(2.0, 40.0, rows).round(2),
+        "transaction_date": pd.Timestamp("2024-08-01") + pd.to_timedelta(rng.integers(0, 86400, rows), unit="s"),
+        "registration_date": rng.choice(np.array(["2024-07-30 ", "2024-07-31"], dtype=object), rows),
+        "day_diff": rng.integers(-2, 30, rows),
+        "mobile": rng.choice(mobiles, rows),
+        "name": rng.choice(names, rows),
+    })
+
+
+def clean_per_cell(df):
+    df["card_no"] = df["card_no"].str.strip()
+    df["card_no"] = df["card_no"].astype(int)
+    for col in df.columns:
+        if pd.api.types.is_string_dtype(df[col]):
+            def remove_extra_commas(element):
+                if isinstance(element, str) and ',' in element:
+                    print(f"Broken CSV element found in column '{col}': {element}")
+                    return element.replace(',', '')
+                return element
+            df[col] = df[col].apply(remove_extra_commas)
+    return df.map(lambda x: x.strip() if isinstance(x, str) else x)
+
+
+def clean_vectorized(df, summary):
+    df = parse_card_no(df, summary=summary)
+    return clean_string_columns(df, remove_commas=True, strip=True, summary=summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[250000, 500000, 1000000, 2000000])
+    parser.add_argument("--skip-per-cell", action="store_true", help="only time the vectorized version")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'per-cell s':>10} {'ns/row':>8} {'vectorized s':>12} {'ns/row':>8} {'speedup':>8}")
+    for rows in args.rows:
+        df = make_campaign_frame(rows)
+
+        summary = {}
+        start = time.perf_counter()
+        vectorized = clean_vectorized(df.copy(), summary)
+        vectorized_time = time.perf_counter() - start
+
+        if args.skip_per_cell:
+            print(f"{rows:>10} {'-':>10} {'-':>8} {vectorized_time:12.2f} {vectorized_time / rows * 1e9:8.0f} {'-':>8}")
+            continue
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            per_cell = clean_per_cell(df.copy())
+            per_cell_time = time.perf_counter() - start
+        pd.testing.assert_frame_equal(per_cell, vectorized)
+        print(f"{rows:>10} {per_cell_time:10.2f} {per_cell_time / rows * 1e9:8.0f} {vectorized_time:12.2f} "
+              f"{vectorized_time / rows * 1e9:8.0f} {per_cell_time / vectorized_time:7.1f}x")
+    print(f"last run:: {format_clean_summary(summary)}")
+
+
+if __name__ == "__main__":
+    main()
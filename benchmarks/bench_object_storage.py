@@ -0,0 +1,420 @@
+"""
+Throughput, latency percentiles and peak memory of the S3, AsyncS3 and GCS helpers against local stand-ins.
+
+Every case uploads `objects` frames of `rows` rows in one format (.csv, .csv.gz or .parquet), reads them back
+through the prefix, copies them to a temporary directory and deletes them, over a sweep of rows, object counts
+and formats. Uploads are timed per object; reads, copies and deletes per call, once per repeat. The frames are
+the tx_txn frames of bench_parquet_profiles.py without the escaped JSON columns, which do not read back from
+QUOTE_NONE CSV.
+
+Unless --s3-endpoint / --gcs-endpoint point at running servers (MinIO, fake-gcs-server, ...), moto server and
+gcp-storage-emulator are started as subprocesses, so their memory and CPU stay out of the measurements. Peak
+memory is the RSS of this process sampled every 10 ms during the operation (needs psutil), relative to before it.
+
+Results go to a JSON file; compare prints the change per case between two such files and exits with status 1
+when a case got slower (and by at least --min-ms), lost throughput or used more memory by more than --threshold.
+
+Usage:
+    python benchmarks/bench_object_storage.py run --rows 1000,100000 --objects 1,16 --output base.json
+    python benchmarks/bench_object_storage.py run --backends s3,s3-async --formats parquet --output new.json
+    python benchmarks/bench_object_storage.py compare base.json new.json --threshold 0.15
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from bench_parquet_profiles import make_tx_txn_frame
+
+BACKENDS = ["s3", "s3-async", "gcs"]
+FORMATS = ["csv", "csv.gz", "parquet"]
+OPERATIONS = ["upload", "read", "copy_to_local", "delete"]
+BUCKET = "bench-bucket"
+
+
+class PeakRSS:
+    # Samples the RSS of this process on a thread, peak_mb is the highest sample above the RSS at start
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = None
+
+    def __enter__(self):
+        try:
+            import psutil
+        except ImportError:
+            self.process = None
+            return self
+        self.process = psutil.Process()
+        self.start_rss = self.peak_rss = self.process.memory_info().rss
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.stop.set()
+            self.thread.join()
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            self.peak_mb = (self.peak_rss - self.start_rss) / 1024 ** 2
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(command, port, timeout=30):
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"{command[0:4]} exited with status {process.returncode}")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{command[0:4]} did not listen on port {port} within {timeout}s")
+
+
+def start_stand_ins(args, backends):
+    # {backend: endpoint url} plus the server processes to stop afterwards
+    endpoints = {}
+    processes = []
+    if {"s3", "s3-async"} & set(backends):
+        if args.s3_endpoint is None:
+            port = _free_port()
+            processes.append(_start_server([sys.executable, "-m", "moto.server", "-p", str(port)], port))
+            args.s3_endpoint = f"http://127.0.0.1:{port}"
+        endpoints["s3"] = endpoints["s3-async"] = args.s3_endpoint
+    if "gcs" in backends:
+        if args.gcs_endpoint is None:
+            port = _free_port()
+            processes.append(_start_server([sys.executable, "-m", "gcp_storage_emulator", "start", "--port", str(port),
+                                            "--in-memory", "--default-bucket", BUCKET, "--quiet"], port))
+            args.gcs_endpoint = f"http://127.0.0.1:{port}"
+        endpoints["gcs"] = args.gcs_endpoint
+    return endpoints, processes
+
+
+class S3Runner:
+    def __init__(self, endpoint):
+        from utils.s3_utils import S3
+
+        # Stand-ins accept any credentials
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        self.s3 = S3(region_name="us-east-1", log_level=logging.ERROR, endpoint_url=endpoint)
+        try:
+            self.s3.s3_client.create_bucket(Bucket=BUCKET)
+        except self.s3.s3_client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+    def upload(self, df, key):
+        self.s3.upload_df_to_s3(df, BUCKET, key)
+
+    def read(self, prefix):
+        return self.s3.read_s3_files_to_df(BUCKET, prefix)
+
+    def copy_to_local(self, prefix, local_path):
+        self.s3.copy_to_local(BUCKET, prefix, local_path)
+
+    def delete(self, prefix):
+        self.s3.delete_objects_from_s3(BUCKET, prefix)
+
+    def sizes(self, prefix):
+        return [obj["Size"] for obj in self.s3._list_remote_objects(BUCKET, prefix).values()]
+
+    def close(self):
+        pass
+
+
+class AsyncS3Runner(S3Runner):
+    # Same operations through utils.async_s3_utils.AsyncS3 on one event loop, the uploads of a case are gathered
+    concurrent_upload = True
+
+    def __init__(self, endpoint):
+        super().__init__(endpoint)
+        from utils.async_s3_utils import AsyncS3
+
+        self.loop = asyncio.new_event_loop()
+        self.async_s3 = self.loop.run_until_complete(AsyncS3(region_name="us-east-1", endpoint_url=endpoint, log_level=logging.ERROR).__aenter__())
+
+    def upload_many(self, frames):
+        async def upload(key, df):
+            start = time.perf_counter()
+            await self.async_s3.upload_df_to_s3(df, BUCKET, key)
+            return time.perf_counter() - start
+
+        async def upload_all():
+            return await asyncio.gather(*(upload(key, df) for key, df in frames.items()))
+        return self.loop.run_until_complete(upload_all())
+
+    def read(self, prefix):
+        return self.loop.run_until_complete(self.async_s3.read_s3_files_to_df(BUCKET, prefix))
+
+    def copy_to_local(self, prefix, local_path):
+        self.loop.run_until_complete(self.async_s3.copy_to_local(BUCKET, prefix, local_path))
+
+    def delete(self, prefix):
+        self.loop.run_until_complete(self.async_s3.delete_objects_from_s3(BUCKET, prefix))
+
+    def close(self):
+        self.loop.run_until_complete(self.async_s3.__aexit__(None, None, None))
+        self.loop.close()
+
+
+class GCSRunner:
+    def __init__(self, endpoint):
+        from utils.gcs_utils import GCS
+
+        self.gcs = GCS(api_endpoint=endpoint, log_level=logging.ERROR)
+        if self.gcs.client.lookup_bucket(BUCKET) is None:
+            self.gcs.client.create_bucket(BUCKET)
+
+    def upload(self, df, key):
+        self.gcs.upload_df_to_gcs(df, BUCKET, key)
+
+    def read(self, prefix):
+        return self.gcs.read_gcs_files_to_df(BUCKET, prefix)
+
+    def copy_to_local(self, prefix, local_path):
+        self.gcs.copy_to_local(BUCKET, prefix, local_path)
+
+    def delete(self, prefix):
+        self.gcs.delete_objects_from_gcs(BUCKET, prefix)
+
+    def sizes(self, prefix):
+        return [blob.size for blob in self.gcs.client.list_blobs(BUCKET, prefix=prefix)]
+
+    def close(self):
+        pass
+
+
+RUNNERS = {"s3": S3Runner, "s3-async": AsyncS3Runner, "gcs": GCSRunner}
+
+
+def summarize(samples, seconds, total_bytes, objects, peaks):
+    # samples: latency of every timed call, seconds: wall time of all of them, which is less than their sum when
+    # they ran concurrently, total_bytes / objects: what they moved together
+    samples = np.asarray(samples)
+    peaks = [peak for peak in peaks if peak is not None]
+    return {
+        "samples": len(samples),
+        "seconds": seconds,
+        "latency_ms": {
+            "p50": float(np.percentile(samples, 50) * 1000),
+            "p90": float(np.percentile(samples, 90) * 1000),
+            "p99": float(np.percentile(samples, 99) * 1000),
+            "max": float(samples.max() * 1000),
+            "mean": float(samples.mean() * 1000),
+        },
+        "mb_per_s": total_bytes / 1024 ** 2 / seconds if seconds > 0 else None,
+        "objects_per_s": objects / seconds if seconds > 0 else None,
+        "peak_rss_mb": max(peaks) if peaks else None,
+    }
+
+
+def run_case(runner, backend, file_format, rows, objects, repeats, work_dir):
+    df = make_tx_txn_frame(rows).drop(columns=["points", "gateway"])
+    timings = {operation: [] for operation in OPERATIONS}
+    walls = {operation: 0.0 for operation in OPERATIONS}
+    peaks = {operation: [] for operation in OPERATIONS}
+    object_bytes = []
+    errors = []
+    for repeat in range(repeats):
+        prefix = f"bench/{file_format}/{rows}x{objects}/{repeat}/"
+        frames = {f"{prefix}{i}.{file_format}": df for i in range(objects)}
+
+        with PeakRSS() as peak:
+            wall_start = time.perf_counter()
+            if getattr(runner, "concurrent_upload", False):
+                timings["upload"].extend(runner.upload_many(frames))
+            else:
+                for key, frame in frames.items():
+                    start = time.perf_counter()
+                    runner.upload(frame, key)
+                    timings["upload"].append(time.perf_counter() - start)
+            walls["upload"] += time.perf_counter() - wall_start
+        peaks["upload"].append(peak.peak_mb)
+        object_bytes = runner.sizes(prefix)
+        if len(object_bytes) != objects:
+            errors.append(f"repeat {repeat}: {len(object_bytes)} of {objects} objects uploaded")
+
+        with PeakRSS() as peak:
+            start = time.perf_counter()
+            read = runner.read(prefix)
+            timings["read"].append(time.perf_counter() - start)
+        peaks["read"].append(peak.peak_mb)
+        if len(read) != rows * objects:
+            errors.append(f"repeat {repeat}: read {len(read)} of {rows * objects} rows")
+        del read
+
+        local_path = os.path.join(work_dir, f"{repeat}")
+        with PeakRSS() as peak:
+            start = time.perf_counter()
+            runner.copy_to_local(prefix, local_path)
+            timings["copy_to_local"].append(time.perf_counter() - start)
+        peaks["copy_to_local"].append(peak.peak_mb)
+        copied = sum(len(files) for _, _, files in os.walk(local_path))
+        if copied != objects:
+            errors.append(f"repeat {repeat}: copied {copied} of {objects} objects")
+        shutil.rmtree(local_path, ignore_errors=True)
+
+        with PeakRSS() as peak:
+            start = time.perf_counter()
+            runner.delete(prefix)
+            timings["delete"].append(time.perf_counter() - start)
+        peaks["delete"].append(peak.peak_mb)
+
+    total_bytes = sum(object_bytes)
+    results = []
+    for operation in OPERATIONS:
+        if operation != "upload":
+            walls[operation] = sum(timings[operation])
+        # Uploads are one sample per object, the other operations one sample per repeat covering every object
+        result = {"backend": backend, "operation": operation, "format": file_format, "rows": rows, "objects": objects,
+                  "object_bytes": int(np.mean(object_bytes)) if object_bytes else 0}
+        result.update(summarize(timings[operation], walls[operation], total_bytes * repeats, objects * repeats, peaks[operation]))
+        result["errors"] = errors
+        results.append(result)
+    return results
+
+
+def case_key(result):
+    return (result["backend"], result["operation"], result["format"], result["rows"], result["objects"])
+
+
+def run(args):
+    backends = args.backends.split(",")
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        raise SystemExit(f"Unknown backends {sorted(unknown)}, choose from {BACKENDS}")
+    endpoints, processes = start_stand_ins(args, backends)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for backend in backends:
+                runner = RUNNERS[backend](endpoints[backend])
+                try:
+                    for file_format in args.formats.split(","):
+                        for rows in [int(value) for value in args.rows.split(",")]:
+                            for objects in [int(value) for value in args.objects.split(",")]:
+                                for result in run_case(runner, backend, file_format, rows, objects, args.repeats, work_dir):
+                                    results.append(result)
+                                    print(f"{backend:>8} {result['operation']:>13} {file_format:>7} {rows:>8} rows x {objects:<4} "
+                                          f"p50 {result['latency_ms']['p50']:9.1f} ms  p99 {result['latency_ms']['p99']:9.1f} ms  "
+                                          f"{result['mb_per_s'] or 0:8.1f} MB/s  peak {result['peak_rss_mb'] or 0:7.1f} MB"
+                                          f"{'  ERRORS' if result['errors'] else ''}")
+                finally:
+                    runner.close()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    output = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "endpoints": endpoints,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
+    if any(result["errors"] for result in results):
+        raise SystemExit("Some cases did not move every object or row, see the errors of the results file")
+
+
+def _change(base, new):
+    if base is None or new is None or base == 0:
+        return None
+    return new / base - 1
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = {case_key(result): result for result in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = {case_key(result): result for result in json.load(f)["results"]}
+
+    regressions = []
+    print(f"{'backend':>8} {'operation':>13} {'format':>7} {'rows':>8} {'objects':>7} {'p50 ms':>19} {'p99 ms':>8} {'MB/s':>15} {'peak MB':>15}")
+    for key in sorted(set(base) & set(new)):
+        b, n = base[key], new[key]
+        changes = {
+            "p50": _change(b["latency_ms"]["p50"], n["latency_ms"]["p50"]),
+            "p99": _change(b["latency_ms"]["p99"], n["latency_ms"]["p99"]),
+            "mb_per_s": _change(b["mb_per_s"], n["mb_per_s"]),
+            # Peaks of a few MB are noise, memory only counts once the base used at least 8 MB
+            "peak": _change(b["peak_rss_mb"], n["peak_rss_mb"]) if (b["peak_rss_mb"] or 0) >= 8 else None,
+        }
+        # Latency only counts once it also grew by min_ms, a few ms either way is stand-in noise
+        grown_ms = {name: n["latency_ms"][name] - b["latency_ms"][name] for name in ["p50", "p99"]}
+        worse = [name for name, change in changes.items() if change is not None
+                 and (-change if name == "mb_per_s" else change) > args.threshold
+                 and grown_ms.get(name, args.min_ms) >= args.min_ms]
+        if worse:
+            regressions.append((key, worse))
+        fmt = lambda change: "" if change is None else f"{change:+.0%}"
+        print(f"{key[0]:>8} {key[1]:>13} {key[2]:>7} {key[3]:>8} {key[4]:>7} "
+              f"{n['latency_ms']['p50']:10.1f} {fmt(changes['p50']):>8} {fmt(changes['p99']):>8} "
+              f"{n['mb_per_s'] or 0:7.1f} {fmt(changes['mb_per_s']):>7} {n['peak_rss_mb'] or 0:7.1f} {fmt(changes['peak']):>7}"
+              f"{'  REGRESSION: ' + ', '.join(worse) if worse else ''}")
+    for key in sorted(set(base) ^ set(new)):
+        print(f"only in {'base' if key in base else 'new'}:: {key}")
+    if regressions:
+        raise SystemExit(f"{len(regressions)} of {len(set(base) & set(new))} cases regressed by more than {args.threshold:.0%}")
+    print(f"no regressions above {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the sweep and write a results file")
+    run_parser.add_argument("--backends", default=",".join(BACKENDS), help=f"comma separated, from {BACKENDS}")
+    run_parser.add_argument("--formats", default=",".join(FORMATS), help="comma separated file extensions")
+    run_parser.add_argument("--rows", default="1000,100000", help="comma separated rows per object")
+    run_parser.add_argument("--objects", default="1,16", help="comma separated object counts")
+    run_parser.add_argument("--repeats", type=int, default=3)
+    run_parser.add_argument("--s3-endpoint", default=None, help="running S3 stand-in, e.g. http://localhost:9000 for MinIO, defaults to a moto server subprocess")
+    run_parser.add_argument("--gcs-endpoint", default=None, help="running GCS stand-in, defaults to a gcp-storage-emulator subprocess")
+    run_parser.add_argument("--output", default="object_storage_results.json")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    compare_parser.add_argument("--min-ms", type=float, default=5.0, help="smallest latency increase counted as a regression")
+
+    args = parser.parse_args()
+    run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+File size, write time and read time of every Parquet write profile in utils.parquet_utils.PARQUET_PROFILES.
+
+The frame mimics a tx_txn day as downloaded by process_tx_txn: card numbers repeating across transactions,
+timestamps within one day, a few low-cardinality text columns and the escaped JSON payload columns. Reads are
+timed for the full file and for a card_no filter, which is where sorted row groups pay off.
+
+Usage:
+    python benchmarks/bench_parquet_profiles.py --rows 2000000
+"""
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from utils.parquet_utils import PARQUET_PROFILES, write_parquet
+
+
+def make_tx_txn_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    card_no = rng.integers(6000000000000000, 6000000000000000 + rows // 3, rows)
+    std_points = rng.integers(0, 200, rows).astype(float)
+    bonus_points = rng.choice([0.0, 0.0, 0.0, 50.0, 100.0], rows)
+    return pd.DataFrame({
+        "transaction_id": np.arange(rows) + 900000000,
+        "card_no": card_no,
+        "transaction_date": pd.Timestamp("2024-08-01") + pd.to_timedelta(rng.integers(0, 86400, rows), unit="s"),
+        "total_txn_value": rng.gamma(2.0, 40.0, rows).round(2),
+        "std_points_value": std_points,
+        "bonus_points_value": bonus_points,
+        "merch_ref": rng.choice([f"SHELL{i:04d}" for i in range(800)], rows),
+        "terminal_id": rng.choice([f"SH{i:06d}" for i in range(3000)], rows),
+        "form_of_pmt": rng.choice(["CASH", "CARD", "EWALLET"], rows),
+        "tx_type": "issue",
+        "points": [f'{{\\"standard\\": {s}, \\"bonus\\": {b}}}' for s, b in zip(std_points, bonus_points)],
+        "gateway": [f'{{\\"id\\": 1, \\"transactionId\\": \\"{t}\\"}}' for t in range(rows)],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    df = make_tx_txn_frame(args.rows)
+    probe_card = int(df["card_no"].iloc[len(df) // 2])
+    print(f"{'profile':>12} {'size MB':>9} {'write s':>8} {'read s':>7} {'card read s':>11} {'row groups':>10}")
+    for name, profile in PARQUET_PROFILES.items():
+        buffer = BytesIO()
+        start = time.perf_counter()
+        write_parquet(df, buffer, name)
+        write_time = time.perf_counter() - start
+        size = buffer.tell()
+
+        buffer.seek(0)
+        start = time.perf_counter()
+        pq.read_table(buffer).to_pandas()
+        read_time = time.perf_counter() - start
+
+        buffer.seek(0)
+        start = time.perf_counter()
+        pq.read_table(buffer, filters=[("card_no", "=", probe_card)]).to_pandas()
+        filtered_read_time = time.perf_counter() - start
+
+        row_groups = pq.ParquetFile(BytesIO(buffer.getvalue())).num_row_groups
+        print(f"{name:>12} {size / 1024 ** 2:9.2f} {write_time:8.2f} {read_time:7.2f} {filtered_read_time:11.3f} {row_groups:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Checks GCS.delete_objects_from_gcs and GCS.update_blobs_metadata against a real bucket.list_blobs iterator.
+
+Starts gcp-storage-emulator as a subprocess (unless --gcs-endpoint points at a running server), uploads more
+objects than fit in one listing page and one batch request, updates their metadata and deletes them through the
+prefix. Exits with status 1 if any object was missed.
+
+Usage:
+    python checks/check_gcs_blob_batches.py --objects 250 --page-size 100
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import subprocess
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BUCKET = "check-bucket"
+
+
+def _start_emulator(port, timeout=30):
+    process = subprocess.Popen([sys.executable, "-m", "gcp_storage_emulator", "start", "--port", str(port),
+                                "--in-memory", "--default-bucket", BUCKET, "--quiet"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"gcp-storage-emulator exited with status {process.returncode}")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gcp-storage-emulator did not listen on port {port} within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=250)
+    parser.add_argument("--page-size", type=int, default=100, help="max_results per listing page")
+    parser.add_argument("--gcs-endpoint", default=None, help="Running GCS stand-in, default starts gcp-storage-emulator")
+    args = parser.parse_args()
+
+    process = None
+    if args.gcs_endpoint is None:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        process = _start_emulator(port)
+        args.gcs_endpoint = f"http://127.0.0.1:{port}"
+
+    try:
+        from google.cloud.storage import Bucket
+        from utils.gcs_utils import GCS
+
+        gcs = GCS(api_endpoint=args.gcs_endpoint, log_level=logging.WARNING)
+        if gcs.client.lookup_bucket(BUCKET) is None:
+            gcs.client.create_bucket(BUCKET)
+        bucket = gcs.client.bucket(BUCKET)
+        prefix = "check/"
+        for i in range(args.objects):
+            bucket.blob(f"{prefix}{i:05d}.txt").upload_from_string(str(i))
+
+        # Small pages so the listing really is paginated, as it is for large prefixes
+        list_blobs = Bucket.list_blobs
+        with mock.patch.object(Bucket, "list_blobs", lambda self, **kwargs: list_blobs(self, max_results=None, page_size=args.page_size, **kwargs)):
+            updated = gcs.update_blobs_metadata(BUCKET, prefix, metadata={"checked": "1"})
+            deleted = gcs.delete_objects_from_gcs(BUCKET, prefix)
+
+        remaining = sum(1 for _ in bucket.list_blobs(prefix=prefix))
+        results = {"metadata update": updated, "delete": deleted}
+        ok = remaining == 0
+        for description, result in results.items():
+            if result is None or result["succeeded"] != args.objects:
+                ok = False
+            print(f"{description}: {result}")
+        print(f"remaining objects: {remaining}")
+        print("OK" if ok else "FAILED")
+        return 0 if ok else 1
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
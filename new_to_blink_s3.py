@@ -1,25 +1,62 @@
 from utils.utils import bq_to_pd_v2
 from utils.s3_utils import S3
+from utils.clean_utils import clean_string_columns, parse_card_no, format_clean_summary
+from utils.state_utils import AwardedCardState
+from utils.campaign_utils import active_campaigns, build_campaigns_query, split_campaign_winners
+from utils.metrics_utils import RunReport, timed_stage
+import argparse
+import time
 import pendulum
-from utils.setting import AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY
+import pandas as pd
 # import os
 # os.environ()
 
-    # AND ods.transaction_date < "{nxt_observation_date}"
+#first partition scanned for the campaign, the first transaction of every card is ranked from here on
+campaign_start_date = "2024-07-15"
+
+#SENSITIVE ASSIGNMENT#!!!!!!!!!!!!!
+region_name = "ap-southeast-1"
+#SENSITIVE ASSIGNMENT ENDED#!!!!!!!!!!!!!
+s3_path = f"bonuslink"
+bucket_name = 'bonuslink-production-partners-points-raw'
+#cards already awarded, read and written by --incremental runs, a local path or s3://bucket/key
+state_location = "/home/chunkit/bonus-state/shell-500_awarded_cards.parquet"
+#stage timings of every run, one JSON report per observation date (utils.metrics_utils)
+report_dir = "/home/chunkit/bonus-reports"
 
-observation_date = pendulum.now().to_date_string()
-joinable_date = pendulum.now().subtract(days=1).to_date_string()
-nxt_observation_date = pendulum.parse(observation_date).add(days=1).to_date_string()
-q = f'''
+#campaigns evaluated together in one scan, see utils.campaign_utils for the keys. build_query below is the
+#hand written query of the first one, kept for --legacy and as the reference of --compare
+campaigns = [
+    {
+        "name": "shell-500",
+        "start_date": campaign_start_date,
+        "tx_type_codes": ["0", "4"],
+        "min_txn_value": 30,
+        "min_transaction_date": "2024-07-22",
+        "min_app_install_date": "2024-07-22",
+        "app_day_diff": (-2, 30),
+        "blm_day_diff": (-2, 30),
+        "output_key": s3_path + "/{observation_date}/shell-500_1.csv",
+        "state": state_location,
+    },
+]
+
+def build_query(observation_date, legacy=False):
+    #the ranking always covers every partition from campaign_start_date up to observation_date, so row_num = 1 is
+    #still the card's first qualifying transaction of the campaign. Without legacy only the rows of observation_date
+    #leave BigQuery, legacy returns every first transaction so far and relies on the pandas filter afterwards
+    observation_filter = "" if legacy else f'''
+  AND partition_dt = "{observation_date}"'''
+    return f'''
 -- 30 days within shell
 -- transaction table participants id == 1
 
 WITH ranked_transactions AS (
-  SELECT 
-    ods.transaction_id, 
-    ods.card_no, 
+  SELECT
+    ods.transaction_id,
+    ods.card_no,
     ods.total_txn_value,
-    ods.transaction_date, 
+    ods.transaction_date,
     blm.assign_date,
     app.createddateutc,
     DATE_DIFF(DATE(ods.transaction_date), DATE(app.createddateutc), DAY) AS app_day_diff,
@@ -30,18 +67,18 @@ WITH ranked_transactions AS (
     blm.first_name as name,
     blm.email,
     ods.partition_dt
-  FROM 
+  FROM
     `blink-data-warehouse.base_layer.ods_tx_txn_df` ods
-  LEFT JOIN 
+  LEFT JOIN
     `blink-data-warehouse.aggregate_layer.dws_etl_cd_card_df` blm
-  ON 
+  ON
     CAST(TRIM(ods.card_no) AS INT) = CAST(blm.card_no AS INT)
-  LEFT JOIN 
+  LEFT JOIN
     `blink-data-warehouse.aggregate_layer.dws_etl_mobileapp2_blmember_df` app
   ON
     CAST(TRIM(ods.card_no) AS INT) = app.blcard
   WHERE
-    ods.partition_dt >= "2024-07-15"
+    ods.partition_dt >= "{campaign_start_date}"
     AND ods.partition_dt <= "{observation_date}"
     AND TRIM(tx_type_code) IN ("0", "4")
     AND app.createddateutc >= "2024-07-22"
@@ -53,12 +90,12 @@ WITH ranked_transactions AS (
     AND ods.total_txn_value >= 30
 )
 
-SELECT 
-  transaction_id, 
-  card_no, 
+SELECT
+  transaction_id,
+  card_no,
   total_txn_value,
-  transaction_date, 
-  assign_date as registration_date, 
+  transaction_date,
+  assign_date as registration_date,
   createddateutc as app_install_date,
   app_day_diff,
   blm_day_diff,
@@ -69,58 +106,176 @@ SELECT
   partition_dt
 FROM
   ranked_transactions
-WHERE 
-  row_num = 1
+WHERE
+  row_num = 1{observation_filter}
 '''
 
-df = bq_to_pd_v2(q)
+def prepare_upload_frame(df, observation_date, report=None):
+    with timed_stage(report, "clean", rows_in=len(df)) as stage:
+        df = _clean_upload_frame(df, observation_date)
+        stage.rows_out = len(df)
+    return df
+
+def _clean_upload_frame(df, observation_date):
+    #trim card_no and convert it to int
+    clean_summary = {}
+    df = parse_card_no(df, summary=clean_summary)
 
-#trim card_no and convert it to int
-df['card_no'] = df['card_no'].str.strip()
-df['card_no'] = df['card_no'].astype(int)
+    #fillna mobile with mobile_original
+    df['mobile'] = df['mobile'].fillna(df['mobile_original'])
+    df.drop(columns=['mobile_original', 'email'], inplace=True)
 
-import pandas as pd
-def clean_broken_csv_elements(df):
-    for col in df.columns:
-        # Check if the column contains strings
-        if pd.api.types.is_string_dtype(df[col]):
-            # Define a function to clean elements with extra commas
-            def remove_extra_commas(element):
-                if ',' in element:
-                    print(f"Broken CSV element found in column '{col}': {element}")
-                    # Remove extra commas (or modify as needed)
-                    return element.replace(',', '')
-                return element
-            
-            # Apply the function to the entire column
-            df[col] = df[col].apply(remove_extra_commas)
-    
+    #remove commas that would break the csv and strip leading or trailing spaces tabs from string columns
+    df = clean_string_columns(df, remove_commas=True, strip=True, summary=clean_summary)
+    print(f"cleaned:: {format_clean_summary(clean_summary)}")
+
+    #a no-op when the query already filtered on observation_date
+    df["partition_dt"] = df["partition_dt"].astype(str)
+    df = df[df["partition_dt"] == observation_date]
+
+    df = df.rename({"app_day_diff": "day_diff"}, axis=1)
+    df = df[['transaction_id', 'card_no', 'total_txn_value', 'transaction_date',
+           'registration_date', 'day_diff', 'mobile', 'name', 'partition_dt']]
     return df
 
-# Clean the DataFrame
-df = clean_broken_csv_elements(df)
+def _print_download(query_type, df, start):
+    print(f"downloaded:: {query_type} query, rows:: {len(df)}, "
+          f"bytes:: {df.memory_usage(deep=True).sum()}, seconds:: {time.perf_counter() - start:.2f}")
 
-#fillna mobile with mobile_original
-df['mobile'] = df['mobile'].fillna(df['mobile_original'])
-df.drop(columns=['mobile_original', 'email'], inplace=True)
+def fetch_campaign_frame(observation_date, legacy=False, report=None):
+    #the first campaign through its hand written query
+    start = time.perf_counter()
+    df = bq_to_pd_v2(build_query(observation_date, legacy=legacy), report=report)
+    _print_download('legacy' if legacy else 'filtered', df, start)
+    return prepare_upload_frame(df, observation_date, report)
 
-#strip leading or trailing spaces tabs from string columns
-df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
-df["partition_dt"] = df["partition_dt"].astype(str)
-df = df[df["partition_dt"] == observation_date]
+def open_states(campaigns, observation_date):
+    #{campaign name: AwardedCardState} of the campaigns active on observation_date
+    s3 = None
+    states = {}
+    for campaign in active_campaigns(campaigns, observation_date):
+        if "state" not in campaign:
+            raise ValueError(f"Campaign {campaign['name']} has no state location for incremental runs")
+        if campaign["state"].startswith("s3://") and s3 is None:
+            from utils.setting import AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY
+            s3 = S3(AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY, region_name = region_name, staging=False)
+        states[campaign["name"]] = AwardedCardState(campaign["state"], s3=s3 if campaign["state"].startswith("s3://") else None).load()
+    return states
 
-df.rename({"app_day_diff": "day_diff"}, axis=1, inplace=True)
-df = df[['transaction_id', 'card_no', 'total_txn_value', 'transaction_date',
-       'registration_date', 'day_diff', 'mobile', 'name', 'partition_dt']]
+def bootstrap_states(campaigns, states, observation_date, report=None):
+    #seeds empty states with every first transaction before observation_date, one full-window query for all of them
+    #and checks the others cover every day up to it, an incremental run is only exact on top of a complete state
+    through_date = pendulum.parse(observation_date).subtract(days=1).to_date_string()
+    for campaign in campaigns:
+        state = states[campaign["name"]]
+        if state.through_date is not None and state.through_date < through_date:
+            raise ValueError(f"State {state.location} only covers up to {state.through_date}, run the dates up to {through_date} first")
+    empty = [campaign for campaign in active_campaigns(campaigns, through_date) if states[campaign["name"]].through_date is None]
+    if empty:
+        df = parse_card_no(bq_to_pd_v2(build_campaigns_query(empty, through_date, observation_date_only=False), report=report))
+        for name, campaign_df in split_campaign_winners(df, empty).items():
+            states[name].record(campaign_df, None, through_date)
+    for campaign in campaigns:
+        if states[campaign["name"]].through_date is None:
+            # started on observation_date, nothing was awarded before
+            states[campaign["name"]].through_date = through_date
 
-#SENSITIVE ASSIGNMENT#!!!!!!!!!!!!!
-region_name = "ap-southeast-1"
-#SENSITIVE ASSIGNMENT ENDED#!!!!!!!!!!!!!
-s3_path = f"bonuslink"
-bucket_name = 'bonuslink-production-partners-points-raw'
-#compare s3 tables latest entries
+def fetch_campaign_winners(observation_date, campaigns=campaigns, states=None, report=None):
+    """
+    {campaign name: upload frame} for every campaign active on observation_date, all from one BigQuery scan.
+    With states ({campaign name: AwardedCardState}) only the observation_date partition is scanned and the cards
+    awarded on an earlier date are dropped. report (utils.metrics_utils.RunReport) records the stages.
+    """
+    active = active_campaigns(campaigns, observation_date)
+    if not active:
+        print(f"no active campaigns:: {observation_date}")
+        return {}
+    if states is not None:
+        bootstrap_states(active, states, observation_date, report)
+    start = time.perf_counter()
+    df = bq_to_pd_v2(build_campaigns_query(active, observation_date, daily=states is not None), report=report)
+    _print_download(f"{'daily ' if states is not None else ''}campaigns ({len(active)})", df, start)
+
+    winners = {}
+    for name, campaign_df in split_campaign_winners(df, active).items():
+        campaign_df = prepare_upload_frame(campaign_df, observation_date, report.bind(campaign=name) if report is not None else None)
+        if states is not None:
+            campaign_df = states[name].filter_new(campaign_df, observation_date).reset_index(drop=True)
+        print(f"winners:: {name}, rows:: {len(campaign_df)}")
+        winners[name] = campaign_df
+    return winners
+
+def _by_transaction_id(df):
+    return df.sort_values("transaction_id", kind="stable").reset_index(drop=True)
+
+def compare_paths(observation_date, states=None):
+    #checks the legacy query and the campaign engine (with states: the incremental engine) give the first campaign
+    #the same upload as its filtered query
+    df = fetch_campaign_frame(observation_date)
+    name = campaigns[0]["name"]
+    candidates = {
+        "legacy": fetch_campaign_frame(observation_date, legacy=True),
+        "campaigns": fetch_campaign_winners(observation_date, campaigns[:1])[name],
+    }
+    if states is not None:
+        candidates["incremental"] = fetch_campaign_winners(observation_date, campaigns[:1], {name: states[name]})[name]
+    #BigQuery returns rows in no particular order, so the paths are compared in transaction_id order
+    df = _by_transaction_id(df)
+    for path, candidate in candidates.items():
+        pd.testing.assert_frame_equal(_by_transaction_id(candidate), df)
+        print(f"identical:: {path}, {observation_date}, rows:: {len(df)}")
+    return df
+
+def upload_campaign_frames(winners, observation_date, campaigns=campaigns, states=None, report=None):
+    #only the upload needs the AWS keys, --compare runs without them
+    from utils.setting import AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY
+    s3 = S3(AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY, region_name = region_name, staging=False)
+    for campaign in campaigns:
+        if campaign["name"] not in winners:
+            continue
+        df = winners[campaign["name"]]
+        s3_key = campaign["output_key"].format(observation_date=observation_date)
+        #raises on failure, so neither the state nor a backfill checkpoint records a campaign that was not uploaded
+        with timed_stage(report, "upload", rows_in=len(df), campaign=campaign["name"]) as stage:
+            stage.bytes = s3.upload_df_to_s3(df, bucket_name, s3_key, raise_errors=True)
+        print(f"uploaded:: {bucket_name}/{s3_key}, rows:: {len(df)}, bytes:: {stage.bytes}")
+        if states is not None:
+            #recorded after the upload, a run that fails before it leaves the state untouched
+            with timed_stage(report, "state_save", rows_in=len(df), campaign=campaign["name"]):
+                states[campaign["name"]].record(df, observation_date, observation_date).save()
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload the first transaction campaign winners of one observation date to S3")
+    parser.add_argument("--observation-date", default=pendulum.now().to_date_string(), help="partition_dt to upload, YYYY-MM-DD, defaults to today")
+    parser.add_argument("--legacy", action="store_true", help="only the first campaign, downloading every first transaction since its start and filtering in pandas")
+    parser.add_argument("--incremental", action="store_true", help="scan only the observation date and skip cards already in each campaign's awarded card state")
+    parser.add_argument("--compare", action="store_true", help="check the legacy, campaign engine (and with --incremental, incremental) outputs against the filtered query and upload nothing")
+    parser.add_argument("--report", default=None, help="JSON run report path, defaults to <report_dir>/new_to_blink_s3_<observation date>.json")
+    parser.add_argument("--prometheus", default=None, help="also write the stage totals as a Prometheus textfile to this path")
+    args = parser.parse_args()
 
-s3 = S3(AWS_PROD_SERVER_PUBLIC_KEY, AWS_PROD_SERVER_SECRET_KEY, region_name = region_name, staging=False)
-s3.upload_df_to_s3(df, bucket_name, s3_path + f"/{observation_date}/shell-500_1.csv")
-print(f"completed:: {observation_date}")
+    observation_date = pendulum.parse(args.observation_date).to_date_string()
+    mode = "compare" if args.compare else "legacy" if args.legacy else "incremental" if args.incremental else "campaigns"
+    report = RunReport("new_to_blink_s3", observation_date=observation_date, mode=mode)
+    error = None
+    try:
+        states = open_states(campaigns, observation_date) if args.incremental else None
+        if args.compare:
+            compare_paths(observation_date, states)
+            return
+        if args.legacy:
+            winners = {campaigns[0]["name"]: fetch_campaign_frame(observation_date, legacy=True, report=report)}
+        else:
+            winners = fetch_campaign_winners(observation_date, campaigns, states, report)
+        upload_campaign_frames(winners, observation_date, campaigns, states, report)
+        print(f"completed:: {observation_date}")
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        #written for failed runs too, their failing stage is in the report
+        report.finish(error)
+        report.write_reports(args.report or f"{report_dir}/new_to_blink_s3_{observation_date}.json", args.prometheus)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import sys
+import csv
+import gzip
+from utils.parquet_utils import write_parquet
+
+# Helpers for uploading pyarrow Tables (e.g. bq_to_pd_v2(q, as_arrow=True)) without converting them to pandas.
+# Parquet is written with pq.write_table and CSV with pyarrow.csv, which formats values in C++ instead of
+# going through object columns. The CSV is the same as dataframe.to_csv writes for the frame bq_to_pd_v2 returns,
+# so tables with column types Arrow renders differently (see arrow_csv_supported) are written through pandas.
+
+# csv module quoting constants to pyarrow.csv quoting styles
+ARROW_CSV_QUOTING = {
+    csv.QUOTE_NONE: 'none',
+    csv.QUOTE_MINIMAL: 'needed',
+    csv.QUOTE_ALL: 'all_valid',
+}
+
+def is_arrow_table(obj):
+    #an object can only be a pyarrow Table if pyarrow has already been imported, so this never imports it
+    pa = sys.modules.get('pyarrow')
+    return pa is not None and isinstance(obj, pa.Table)
+
+def _contains_any(table, characters):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    for name, column in zip(table.column_names, table.columns):
+        if any(character in name for character in characters):
+            return True
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            for character in characters:
+                if pc.any(pc.match_substring(column, character)).as_py():
+                    return True
+    return False
+
+def arrow_csv_supported(table, quotechar, quoting, escapechar):
+    """
+    True if pyarrow.csv can write table with the given dataframe.to_csv settings.
+
+    pyarrow has no escapechar and always quotes with '"', so QUOTE_NONE only works when no header or string value
+    contains a delimiter, quote, escape or line break, and the quoting styles need quotechar='"'. Nested and binary
+    columns are not supported by the Arrow CSV writer at all. Boolean, floating point, timestamp and time columns
+    are written differently by Arrow (true / 1 / 2024-01-01 01:02:03.000000Z / 01:02:03.000000 where pandas writes
+    True / 1.0 / 2024-01-01 01:02:03+00:00 / 01:02:03), so they are left to pandas as well. Otherwise the caller
+    falls back to pandas.
+    """
+    import pyarrow as pa
+
+    if quoting not in ARROW_CSV_QUOTING:
+        return False
+    for column_type in table.schema.types:
+        if pa.types.is_nested(column_type) or pa.types.is_binary(column_type) or pa.types.is_large_binary(column_type):
+            return False
+        if (pa.types.is_boolean(column_type) or pa.types.is_floating(column_type)
+                or pa.types.is_timestamp(column_type) or pa.types.is_time(column_type)):
+            return False
+    if quoting == csv.QUOTE_NONE:
+        characters = {',', '"', '\n', '\r', quotechar, escapechar} - {None}
+        return not _contains_any(table, characters)
+    if quotechar != '"':
+        return False
+    # The header is written unquoted for QUOTE_MINIMAL, as pandas does
+    return quoting == csv.QUOTE_ALL or not any(c in name for name in table.column_names for c in ',"\n\r')
+
+def arrow_to_pandas(table):
+    #same nullable dtypes bq_to_pd_v2 gets from the BigQuery client, so a fallback writes integers as 1 rather than 1.0
+    from utils.utils import _bq_types_mapper
+    return table.to_pandas(types_mapper=_bq_types_mapper)
+
+def write_arrow_payload(table, f, key, quoting=csv.QUOTE_NONE, parquet_profile=None, batch_size=100000):
+    """
+    Writes table to the binary file object f in the format given by the key's extension (.csv, .csv.gz or .parquet).
+    CSV callers check arrow_csv_supported first.
+    """
+    if key.endswith('.parquet'):
+        write_parquet(table, f, parquet_profile)
+        return
+
+    import pyarrow.csv as pacsv
+
+    gz_file = gzip.GzipFile(fileobj=f, mode='wb') if key.endswith('.csv.gz') else None
+    target = gz_file or f
+    # pyarrow quotes header names in every style, pandas only does for QUOTE_ALL
+    include_header = quoting == csv.QUOTE_ALL
+    if not include_header:
+        target.write((','.join(table.column_names) + '\n').encode('utf-8'))
+    options = pacsv.WriteOptions(include_header=include_header, batch_size=batch_size, quoting_style=ARROW_CSV_QUOTING[quoting])
+    pacsv.write_csv(table, target, options)
+    if gz_file is not None:
+        gz_file.close()
@@ -0,0 +1,344 @@
+import asyncio
+import pandas as pd
+from io import BytesIO
+from contextlib import AsyncExitStack
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+import logging
+import csv
+import functools
+import time
+from botocore.exceptions import NoCredentialsError, ClientError
+from utils.s3_utils import encode_df_payload, concat_frames, delete_batch_attempts
+
+def _parse_payload(payload, key, columns=None):
+    # Module level so it also runs on a ProcessPoolExecutor, None for unsupported file types
+    if key.endswith('.csv'):
+        df = pd.read_csv(BytesIO(payload))
+    elif key.endswith(('.csv.gz', '.csv.zip')):
+        with gzip.GzipFile(fileobj=BytesIO(payload)) as gz:
+            df = pd.read_csv(gz)
+    elif key.endswith('.parquet'):
+        df = pd.read_parquet(BytesIO(payload), columns=columns)
+    else:
+        return None
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+class AsyncS3:
+    """
+    AsyncS3 class, the asyncio counterpart of utils.s3_utils.S3 for many objects at once.
+
+    One aiobotocore client (and so one connection pool of max_pool_connections) is shared by every call, and at
+    most max_concurrency requests are in flight at a time, whatever the number of tasks gathered. Parsing and
+    encoding (read_csv, Parquet, gzip) run on an executor so the event loop keeps serving the other transfers.
+    The client is opened and closed with the instance as an async context manager.
+
+    Attributes:
+        logger (logging.Logger): Logger instance for logging messages.
+        s3_client (aiobotocore.client.AioBaseClient): Async S3 client, set inside the async with block.
+        semaphore (asyncio.Semaphore): Limits the requests in flight to max_concurrency.
+        executor (concurrent.futures.Executor): Runs the CPU-bound parsing and encoding.
+
+    Methods:
+        __init__(self, aws_access_key_id, aws_secret_access_key, aws_session_token, region_name, staging, log_level, max_pool_connections, max_concurrency, executor, endpoint_url):
+            Initializes the class with AWS credentials, region, logging settings and pool / concurrency sizes.
+            executor defaults to a thread pool; a ProcessPoolExecutor also works, the offloaded functions are
+            module level. endpoint_url points the client at a local S3 stand-in such as moto server.
+
+        read_s3_files_to_df(self, bucket_name, prefix, columns):
+            Reads a file, or every file under a prefix, into a single pandas DataFrame, fetching objects concurrently.
+
+        read_many(self, bucket_name, keys, columns):
+            Reads a known list of keys into a single pandas DataFrame, fetching objects concurrently.
+
+        upload_df_to_s3(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, parquet_profile, multipart_threshold, part_size):
+            Uploads a pandas DataFrame or pyarrow Table in CSV, gzipped CSV or Parquet format, same output as
+            S3.upload_df_to_s3. Payloads of multipart_threshold bytes or more go up as concurrent multipart parts.
+
+        upload_many(self, frames, bucket_name, **kwargs):
+            Uploads {s3_key: dataframe} concurrently, returns the keys that failed.
+
+        list_objects_in_bucket(self, bucket_name, prefix, return_list):
+            Lists every object under the prefix, following the pagination.
+
+        copy_to_local(self, bucket_name, s3_prefix, local_path):
+            Downloads a file, or every file under a prefix, to local storage concurrently.
+
+        delete_objects_from_s3(self, bucket_name, s3_prefix, max_retries):
+            Deletes every object under the prefix, 1000 keys per request and the requests concurrent, retrying
+            keys that fail.
+
+    Sample usage:
+        async def main():
+            async with AsyncS3(region_name="ap-southeast-1", max_concurrency=64) as s3:
+                keys = await s3.list_objects_in_bucket('bl-data-staging', 'test/')
+                df = await s3.read_many('bl-data-staging', keys)
+                await s3.upload_many({f"test/copy/{i}.csv": part for i, part in enumerate(frames)}, 'bl-data-staging')
+        asyncio.run(main())
+    """
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None, staging=False, log_level=logging.INFO,
+                 max_pool_connections=64, max_concurrency=32, executor=None, endpoint_url=None):
+        # Set up logger
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(log_level)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+
+        # Retrieve credentials from environment variables if not provided
+        self.client_kwargs = {
+            'aws_access_key_id': aws_access_key_id or os.getenv('AWS_ACCESS_KEY_ID'),
+            'aws_secret_access_key': aws_secret_access_key or os.getenv('AWS_SECRET_ACCESS_KEY'),
+            'region_name': region_name or os.getenv('AWS_REGION'),
+            'endpoint_url': endpoint_url,
+        }
+        if staging:
+            self.client_kwargs['aws_session_token'] = aws_session_token or os.getenv('AWS_SESSION_TOKEN')
+        self.max_pool_connections = max_pool_connections
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.own_executor = executor is None
+        self.s3_client = None
+        self.semaphore = None
+        self.exit_stack = None
+
+    async def __aenter__(self):
+        from aiobotocore.session import get_session
+        from aiobotocore.config import AioConfig
+
+        self.exit_stack = AsyncExitStack()
+        config = AioConfig(max_pool_connections=self.max_pool_connections)
+        self.s3_client = await self.exit_stack.enter_async_context(get_session().create_client('s3', config=config, **self.client_kwargs))
+        # Created here so it belongs to the running event loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.own_executor:
+            self.executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.exit_stack.aclose()
+        self.s3_client = None
+        if self.own_executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def set_log_level(self, log_level):
+        self.logger.setLevel(log_level)
+        for handler in self.logger.handlers:
+            handler.setLevel(log_level)
+
+    async def _run_cpu(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _is_file(self, bucket_name, key):
+        try:
+            async with self.semaphore:
+                return await self.s3_client.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] == '404':
+                return None
+            raise e
+
+    async def _list_keys(self, bucket_name, prefix):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        keys = []
+        async for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        return keys
+
+    async def _get_bytes(self, bucket_name, key):
+        async with self.semaphore:
+            response = await self.s3_client.get_object(Bucket=bucket_name, Key=key)
+            async with response['Body'] as body:
+                return await body.read()
+
+    async def read_s3_files_to_df(self, bucket_name, prefix, columns=None):
+        try:
+            keys = [prefix] if await self._is_file(bucket_name, prefix) is not None else await self._list_keys(bucket_name, prefix)
+            return await self.read_many(bucket_name, keys, columns=columns)
+        except (NoCredentialsError, ClientError) as e:
+            self.logger.error(f"Error reading S3 files: {str(e)}")
+            return pd.DataFrame()
+
+    async def read_many(self, bucket_name, keys, columns=None):
+        async def read_key(key):
+            self.logger.info(f"Processing file: {key}")
+            payload = await self._get_bytes(bucket_name, key)
+            df = await self._run_cpu(_parse_payload, payload, key, columns)
+            if df is None:
+                self.logger.warning(f"Unsupported file type: {key}")
+                return pd.DataFrame()
+            return df
+
+        try:
+            start = time.perf_counter()
+            # gather keeps the frames in key order
+            data_frames = await asyncio.gather(*(read_key(key) for key in keys))
+            if not data_frames:
+                self.logger.warning("No valid files found to read.")
+                return pd.DataFrame()
+            df = await asyncio.to_thread(concat_frames, list(data_frames), self.logger)
+            self.logger.info(f"Read {len(keys)} files from {bucket_name}, {len(df)} rows in {time.perf_counter() - start:.1f}s")
+            return df
+        except (NoCredentialsError, ClientError) as e:
+            self.logger.error(f"Error reading S3 files: {str(e)}")
+            return pd.DataFrame()
+
+    async def upload_df_to_s3(self, dataframe, bucket_name, s3_key, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\',
+                              parquet_profile=None, multipart_threshold=64 * 1024 * 1024, part_size=16 * 1024 * 1024):
+        if not s3_key.endswith(('.csv', '.csv.gz', '.parquet')):
+            raise ValueError(f"Unsupported file extension for s3_key: {s3_key}")
+        try:
+            body = await self._run_cpu(encode_df_payload, dataframe, s3_key, index, quotechar, quoting, escapechar, parquet_profile)
+            if len(body) >= multipart_threshold:
+                parts = await self._upload_multipart(body, bucket_name, s3_key, max(part_size, 5 * 1024 * 1024))
+                self.logger.info(f"Successfully uploaded {len(body)} bytes in {parts} parts to {bucket_name}/{s3_key}")
+            else:
+                async with self.semaphore:
+                    await self.s3_client.put_object(Bucket=bucket_name, Key=s3_key, Body=body)
+                self.logger.info(f"Successfully uploaded {len(body)} bytes to {bucket_name}/{s3_key}")
+        except NoCredentialsError as e:
+            self.logger.error(f"Failed to upload to S3 due to credentials error: {e}")
+            raise
+        except Exception as e:
+            self.logger.error(f"An error occurred while uploading {bucket_name}/{s3_key}: {e}")
+            raise
+
+    async def _upload_multipart(self, body, bucket_name, s3_key, part_size):
+        async with self.semaphore:
+            upload_id = (await self.s3_client.create_multipart_upload(Bucket=bucket_name, Key=s3_key))['UploadId']
+
+        async def upload_part(part_number, start):
+            async with self.semaphore:
+                response = await self.s3_client.upload_part(
+                    Bucket=bucket_name, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=body[start:start + part_size]
+                )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+        try:
+            parts = await asyncio.gather(*(upload_part(i + 1, start) for i, start in enumerate(range(0, len(body), part_size))))
+            async with self.semaphore:
+                await self.s3_client.complete_multipart_upload(
+                    Bucket=bucket_name, Key=s3_key, UploadId=upload_id, MultipartUpload={'Parts': list(parts)}
+                )
+            return len(parts)
+        except BaseException:
+            # Leaves no half-finished upload (and its stored parts) behind
+            try:
+                await self.s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+            except ClientError as e:
+                self.logger.error(f"Failed to abort multipart upload: {e}")
+            raise
+
+    async def upload_many(self, frames, bucket_name, **kwargs):
+        # {s3_key: dataframe}, a failing upload does not cancel the others
+        keys = list(frames)
+        results = await asyncio.gather(*(self.upload_df_to_s3(frames[key], bucket_name, key, **kwargs) for key in keys), return_exceptions=True)
+        failed = [key for key, result in zip(keys, results) if isinstance(result, BaseException)]
+        if failed:
+            self.logger.error(f"Failed to upload {len(failed)} of {len(keys)} objects to {bucket_name}, e.g. {failed[:5]}")
+        return failed
+
+    async def list_objects_in_bucket(self, bucket_name, prefix='', return_list=True):
+        try:
+            keys = await self._list_keys(bucket_name, prefix)
+            for key in keys:
+                self.logger.info(key)
+            if return_list:
+                return keys
+            if not keys:
+                self.logger.info(f"No objects found in {bucket_name} with prefix '{prefix}'")
+        except NoCredentialsError as e:
+            self.logger.error(f"Failed to list objects in S3 due to credentials error: {e}")
+        except ClientError as e:
+            self.logger.error(f"Failed to list objects in S3 due to client error: {e}")
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+
+    async def _download(self, bucket_name, key, local_file_path, chunk_size=8 * 1024 * 1024):
+        os.makedirs(os.path.dirname(local_file_path) or '.', exist_ok=True)
+        size = 0
+        async with self.semaphore:
+            response = await self.s3_client.get_object(Bucket=bucket_name, Key=key)
+            with open(local_file_path, 'wb') as f:
+                async with response['Body'] as body:
+                    while True:
+                        chunk = await body.read(chunk_size)
+                        if not chunk:
+                            break
+                        # Disk writes block, they go to a thread (not the executor, it may be a process pool)
+                        await asyncio.to_thread(f.write, chunk)
+                        size += len(chunk)
+        self.logger.debug(f"Downloaded {key} to {local_file_path}")
+        return size
+
+    async def copy_to_local(self, bucket_name, s3_prefix, local_path):
+        try:
+            start = time.perf_counter()
+            if await self._is_file(bucket_name, s3_prefix) is not None:
+                transfers = {s3_prefix: os.path.join(local_path, os.path.basename(s3_prefix))}
+            else:
+                transfers = {key: os.path.join(local_path, os.path.relpath(key, s3_prefix)) for key in await self._list_keys(bucket_name, s3_prefix)}
+            results = await asyncio.gather(*(self._download(bucket_name, key, path) for key, path in transfers.items()), return_exceptions=True)
+            failed = [(key, result) for key, result in zip(transfers, results) if isinstance(result, BaseException)]
+            transferred = sum(result for result in results if not isinstance(result, BaseException))
+            elapsed = time.perf_counter() - start
+            throughput = transferred / 1024 ** 2 / elapsed if elapsed > 0 else 0
+            self.logger.info(f"Downloaded {len(transfers) - len(failed)} files ({transferred / 1024 ** 2:.1f} MiB) from {bucket_name}/{s3_prefix} "
+                             f"to {local_path} in {elapsed:.1f}s, {throughput:.1f} MiB/s")
+            if failed:
+                self.logger.error(f"Failed to download {len(failed)} files from {bucket_name}, first errors: {failed[:5]}")
+        except NoCredentialsError as e:
+            self.logger.error(f"Failed to copy from S3 due to credentials error: {e}")
+        except ClientError as e:
+            self.logger.error(f"Failed to copy from S3 due to client error: {e}")
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+
+    async def delete_objects_from_s3(self, bucket_name, s3_prefix, max_retries=3):
+        try:
+            start = time.perf_counter()
+            # Every listing page holds at most 1000 keys, exactly one delete_objects request
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            tasks = []
+            async for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix):
+                if page.get('Contents'):
+                    # Deletes start while the listing goes on
+                    tasks.append(asyncio.create_task(self._delete_batch(bucket_name, [obj['Key'] for obj in page['Contents']], max_retries)))
+            results = await asyncio.gather(*tasks)
+            deleted_count = sum(deleted for deleted, _ in results)
+            failed = [error for _, errors in results for error in errors]
+
+            elapsed = time.perf_counter() - start
+            if deleted_count == 0 and not failed:
+                self.logger.info(f"No objects found in {bucket_name} with prefix '{s3_prefix}'")
+                return
+            rate = deleted_count / elapsed if elapsed > 0 else 0
+            self.logger.info(f"Deleted {deleted_count} objects from {bucket_name} with prefix '{s3_prefix}' in {elapsed:.1f}s ({rate:.0f} objects/s)")
+            if failed:
+                self.logger.error(f"Failed to delete {len(failed)} objects from {bucket_name}, first errors: {failed[:5]}")
+        except NoCredentialsError as e:
+            self.logger.error(f"Failed to delete from S3 due to credentials error: {e}")
+        except ClientError as e:
+            self.logger.error(f"Failed to delete from S3 due to client error: {e}")
+        except Exception as e:
+            self.logger.error(f"An error occurred while deleting from S3: {e}")
+
+    async def _delete_batch(self, bucket_name, keys, max_retries=3):
+        # Deletes up to 1000 keys, retrying the keys reported in Errors with backoff. Returns (deleted, failed errors)
+        attempts = delete_batch_attempts(bucket_name, keys, max_retries, self.logger)
+        try:
+            delay, delete = next(attempts)
+            while True:
+                if delay:
+                    await asyncio.sleep(delay)
+                async with self.semaphore:
+                    response = await self.s3_client.delete_objects(Bucket=bucket_name, Delete=delete)
+                delay, delete = attempts.send(response)
+        except StopIteration as result:
+            return result.value
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+class CheckpointStore:
+    """
+    CheckpointStore class for remembering which units of a backfill have completed.
+
+    A unit is one (date, batch) pair, batch is None for pipelines that run a date in one go. Every completed unit
+    is its own small JSON object, <location>/<date>/<batch>.json, so concurrent workers never rewrite a shared file,
+    and a date whose units all completed also gets <location>/<date>/_DONE.json so a resumed run skips it without
+    planning its batches again. location is a local directory or s3://bucket/prefix.
+
+    Attributes:
+        logger (logging.Logger): Logger instance for logging messages.
+        location (str): Local directory or s3://bucket/prefix of the checkpoints.
+        s3 (utils.s3_utils.S3): Client used for s3:// locations.
+
+    Methods:
+        completed_units(self, date):
+            Returns the batch names of the completed units of a date.
+
+        is_date_done(self, date):
+            True if every unit of the date completed.
+
+        mark_unit(self, date, batch, record):
+            Stores the checkpoint of a unit, record is written as its JSON body.
+
+        mark_date(self, date, record):
+            Marks the whole date as completed.
+
+    Sample usage:
+        checkpoints = CheckpointStore("s3://bl-data-staging/backfill/tx_txn", s3=s3)
+        run_backfill(dates, run_unit, checkpoints, plan_batches=plan_batches, max_workers=4)
+    """
+    done_marker = "_DONE"
+
+    def __init__(self, location, s3=None, log_level=logging.INFO):
+        # Set up logger
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(log_level)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+
+        if location.startswith("s3://") and s3 is None:
+            raise ValueError("An utils.s3_utils.S3 instance is needed for s3:// checkpoint locations")
+        self.location = location.rstrip("/")
+        self.s3 = s3
+
+    def _split_s3_location(self, *parts):
+        bucket_name, _, prefix = self.location[len("s3://"):].partition("/")
+        return bucket_name, "/".join(part for part in [prefix, *parts] if part)
+
+    def _names(self, date):
+        #names of the checkpoint objects of a date, without .json
+        if self.s3 is None:
+            try:
+                return [name[:-len(".json")] for name in os.listdir(os.path.join(self.location, date)) if name.endswith(".json")]
+            except FileNotFoundError:
+                return []
+        bucket_name, prefix = self._split_s3_location(date)
+        prefix += "/"
+        names = []
+        paginator = self.s3.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(prefix):]
+                if name.endswith(".json") and "/" not in name:
+                    names.append(name[:-len(".json")])
+        return names
+
+    def _write(self, date, name, record):
+        body = json.dumps(record, default=str).encode("utf-8")
+        if self.s3 is None:
+            path = os.path.join(self.location, date, f"{name}.json")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        else:
+            bucket_name, key = self._split_s3_location(date, f"{name}.json")
+            self.s3.s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+
+    def completed_units(self, date):
+        return {name for name in self._names(date) if name != self.done_marker}
+
+    def is_date_done(self, date):
+        return self.done_marker in self._names(date)
+
+    def mark_unit(self, date, batch, record):
+        self._write(date, unit_name(batch), record)
+
+    def mark_date(self, date, record):
+        self._write(date, self.done_marker, record)
+        self.logger.info(f"Checkpointed {date} as done in {self.location}")
+
+def unit_name(batch):
+    #checkpoint name of a batch, "all" for pipelines without batches
+    return "all" if batch is None else str(batch)
+
+def _run_unit(run_unit, date, batch):
+    start = time.perf_counter()
+    # thread_time, so concurrent units on a thread pool do not count each other's CPU
+    cpu_start = time.thread_time()
+    rows = run_unit(date, batch)
+    if hasattr(rows, "__len__"):
+        rows = len(rows)
+    return {"date": date, "batch": batch, "rows": int(rows or 0), "seconds": time.perf_counter() - start,
+            "cpu_seconds": time.thread_time() - cpu_start}
+
+def run_backfill(dates, run_unit, checkpoints=None, plan_batches=None, max_workers=4, use_processes=False):
+    """
+    Runs run_unit(date, batch) for every date in dates and every batch plan_batches(date) returns ([None] without
+    plan_batches), at most max_workers units at a time. run_unit returns the number of rows it produced (or a
+    DataFrame, counted with len).
+
+    Completed units are checkpointed and skipped when the backfill is run again, a failing unit is reported and
+    left unmarked so the next run retries it. use_processes=True runs the units on a process pool, run_unit must
+    then be a picklable module level function.
+
+    Returns {"units": per-unit timings, "failed": [(date, batch, error)], "rows", "dates", "seconds"} and prints
+    the per-unit timings as units complete plus the overall dates/hour and rows/sec.
+
+    Sample usage:
+        run_backfill(generate_date_strings("2024-07-01", "2024-07-31"), run_day, CheckpointStore("/home/chunkit/backfill/shell"), max_workers=4)
+    """
+    start = time.perf_counter()
+    units = []
+    remaining = {}
+    failed = []
+    skipped_dates = 0
+    for date in dates:
+        if checkpoints is not None and checkpoints.is_date_done(date):
+            skipped_dates += 1
+            continue
+        try:
+            batches = plan_batches(date) if plan_batches is not None else [None]
+        except Exception as e:
+            failed.append((date, None, repr(e)))
+            print(f"failed:: date:: {date}, planning batches, error:: {e!r}")
+            continue
+        completed = checkpoints.completed_units(date) if checkpoints is not None else set()
+        pending = [batch for batch in batches if unit_name(batch) not in completed]
+        remaining[date] = len(pending)
+        if not pending and checkpoints is not None:
+            checkpoints.mark_date(date, {"date": date, "batches": len(batches)})
+        units.extend((date, batch) for batch in pending)
+    print(f"backfill:: dates:: {len(remaining)} to run, {skipped_dates} already done, units:: {len(units)}")
+
+    results = []
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=max_workers) as executor:
+        futures = {executor.submit(_run_unit, run_unit, date, batch): (date, batch) for date, batch in units}
+        for future in as_completed(futures):
+            date, batch = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append((date, batch, repr(e)))
+                print(f"failed:: date:: {date}, batch:: {unit_name(batch)}, error:: {e!r}")
+                continue
+            results.append(result)
+            print(f"completed:: date:: {date}, batch:: {unit_name(batch)}, rows:: {result['rows']}, "
+                  f"seconds:: {result['seconds']:.2f}, cpu seconds:: {result['cpu_seconds']:.2f}")
+            if checkpoints is not None:
+                checkpoints.mark_unit(date, batch, result)
+            remaining[date] -= 1
+            if remaining[date] == 0 and checkpoints is not None:
+                checkpoints.mark_date(date, {"date": date, "completed_at": time.time()})
+
+    wall_time = time.perf_counter() - start
+    rows = sum(result["rows"] for result in results)
+    completed_dates = sum(1 for count in remaining.values() if count == 0)
+    dates_per_hour = completed_dates / wall_time * 3600 if wall_time > 0 else 0
+    rows_per_second = rows / wall_time if wall_time > 0 else 0
+    unit_seconds = sum(result["seconds"] for result in results)
+    print(f"backfill completed:: dates:: {completed_dates}, units:: {len(results)}, failed units:: {len(failed)}, rows:: {rows}, "
+          f"wall seconds:: {wall_time:.2f}, dates/hour:: {dates_per_hour:.1f}, rows/sec:: {rows_per_second:.1f}, "
+          f"summed unit seconds:: {unit_seconds:.2f}")
+    return {"units": results, "failed": failed, "rows": rows, "dates": completed_dates, "seconds": wall_time}
@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import hashlib
+import pandas as pd
+from utils.arrow_utils import is_arrow_table
+
+class ParquetCache:
+    """
+    ParquetCache class for keeping DataFrames on local disk between pipeline runs.
+
+    Every entry is a single Parquet file stored under <cache_dir>/<table>/<key>.parquet. Entries older than
+    ttl_seconds are treated as misses, and once the directory grows past max_bytes the least recently read
+    entries are evicted. Writes go through a temporary file and os.replace so several pipelines on the same
+    VM can share one cache directory.
+
+    Attributes:
+        logger (logging.Logger): Logger instance for logging messages.
+        cache_dir (str): Root directory of the cache.
+        ttl_seconds (int): Age after which an entry is no longer served, None disables expiry.
+        max_bytes (int): Size budget of the whole cache directory, None disables size based eviction.
+
+    Methods:
+        get(self, table, key, as_arrow):
+            Returns the cached DataFrame (a pyarrow Table with as_arrow=True) or None on a miss.
+
+        put(self, table, key, dataframe):
+            Stores a DataFrame or pyarrow Table and evicts old entries if the cache is over budget.
+
+        get_or_load(self, table, key, loader, as_arrow):
+            Returns the cached DataFrame, or calls loader() and caches its result on a miss.
+
+        evict(self):
+            Removes expired entries, then least recently used entries until the cache fits max_bytes.
+
+        clear(self, table):
+            Removes every entry, or only the entries of one table.
+
+    Sample usage:
+        cache = ParquetCache("/home/chunkit/bq-cache", ttl_seconds=7 * 24 * 3600, max_bytes=20 * 1024 ** 3)
+        df = cache.get_or_load("nc_contact_base", "2024-08-01", lambda: bq_to_pd_v2(q))
+    """
+    def __init__(self, cache_dir, ttl_seconds=24 * 3600, max_bytes=10 * 1024 ** 3, log_level=logging.INFO):
+        # Set up logger
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(log_level)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, table, key):
+        #keys such as dates are kept readable, anything else is hashed into a safe file name
+        safe_key = key if all(c.isalnum() or c in "-_=." for c in key) else hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, table, f"{safe_key}.parquet")
+
+    def _is_expired(self, path, now=None):
+        if self.ttl_seconds is None:
+            return False
+        now = now or time.time()
+        return now - os.path.getmtime(path) > self.ttl_seconds
+
+    def get(self, table, key, as_arrow=False):
+        path = self._path(table, key)
+        try:
+            if self._is_expired(path):
+                self.logger.info(f"Cache expired: {table}/{key}")
+                os.remove(path)
+                return None
+            start = time.perf_counter()
+            if as_arrow:
+                import pyarrow.parquet as pq
+                df = pq.read_table(path)
+            else:
+                df = pd.read_parquet(path)
+        except FileNotFoundError:
+            self.logger.info(f"Cache miss: {table}/{key}")
+            return None
+        # Touch the access time only, mtime stays the write time used for the ttl
+        try:
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except FileNotFoundError:
+            pass
+        self.logger.info(f"Cache hit: {table}/{key}, {len(df)} rows loaded in {time.perf_counter() - start:.2f}s")
+        return df
+
+    def put(self, table, key, dataframe):
+        path = self._path(table, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if is_arrow_table(dataframe):
+                import pyarrow.parquet as pq
+                pq.write_table(dataframe, tmp_path)
+            else:
+                dataframe.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            self.logger.info(f"Cached {table}/{key}: {len(dataframe)} rows, {os.path.getsize(path)} bytes")
+        except Exception as e:
+            self.logger.error(f"Failed to cache {table}/{key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def get_or_load(self, table, key, loader, as_arrow=False):
+        df = self.get(table, key, as_arrow=as_arrow)
+        if df is not None:
+            return df
+        start = time.perf_counter()
+        df = loader()
+        self.logger.info(f"Loaded {table}/{key} from source: {len(df)} rows in {time.perf_counter() - start:.2f}s")
+        self.put(table, key, df)
+        return df
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith('.parquet'):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat))
+        return entries
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path, stat in self._entries():
+            if self.ttl_seconds is not None and now - stat.st_mtime > self.ttl_seconds:
+                self._remove(path, "expired")
+            else:
+                entries.append((path, stat))
+
+        if self.max_bytes is None:
+            return
+        total = sum(stat.st_size for _, stat in entries)
+        # Least recently read first
+        for path, stat in sorted(entries, key=lambda entry: entry[1].st_atime):
+            if total <= self.max_bytes:
+                break
+            self._remove(path, "over size budget")
+            total -= stat.st_size
+
+    def _remove(self, path, reason):
+        try:
+            os.remove(path)
+            self.logger.info(f"Evicted {os.path.relpath(path, self.cache_dir)} ({reason})")
+        except FileNotFoundError:
+            pass
+
+    def clear(self, table=None):
+        for path, _ in self._entries():
+            if table is None or os.path.dirname(path) == os.path.join(self.cache_dir, table):
+                self._remove(path, "cleared")
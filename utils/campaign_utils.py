@@ -0,0 +1,183 @@
+# Config driven first-transaction campaigns evaluated in a single scan of ods_tx_txn_df.
+#
+# Every campaign is a dict:
+#   name                  used in logs and output keys, e.g. "shell-500"
+#   start_date            first partition_dt of the campaign, 'YYYY-MM-DD'
+#   end_date              optional last partition_dt, the campaign is skipped after it
+#   tx_type_codes         list of TRIM(tx_type_code) values that count, e.g. ["0", "4"]
+#   min_txn_value         optional minimum total_txn_value
+#   min_transaction_date  optional earliest transaction_date
+#   min_app_install_date  optional earliest app createddateutc
+#   app_day_diff          optional (low, high) days between app install and transaction, inclusive
+#   blm_day_diff          optional (low, high) days between card assignment and transaction, inclusive
+#   extra_condition       optional SQL over the columns of the scan, ANDed to the rule
+#   output_key            S3 key of the winners file, formatted with observation_date
+#   state                 optional awarded card state location for incremental runs (utils.state_utils)
+#
+# The query joins the cards and app members once over the union of the campaign windows, flags every row with
+# qualifies_<i> per campaign and ranks ROW_NUMBER() OVER (PARTITION BY card_no, qualifies_<i>), so row_num_<i> = 1
+# among the qualifying rows is that campaign's first transaction. Only the winners of observation_date are
+# returned, with one winner_<i> column per campaign that split_campaign_winners uses to split them.
+
+required_campaign_keys = ["name", "start_date", "tx_type_codes", "output_key"]
+
+# Columns of the single scan, campaign rules and extra_condition refer to these names
+scan_columns = '''
+    ods.transaction_id,
+    ods.card_no,
+    ods.total_txn_value,
+    ods.transaction_date,
+    TRIM(tx_type_code) AS tx_type_code,
+    blm.assign_date,
+    app.createddateutc,
+    DATE_DIFF(DATE(ods.transaction_date), DATE(app.createddateutc), DAY) AS app_day_diff,
+    DATE_DIFF(DATE(ods.transaction_date), DATE(blm.assign_date), DAY) AS blm_day_diff,
+    blm.mobile,
+    blm.mobile_original,
+    blm.first_name as name,
+    blm.email,
+    ods.partition_dt'''
+
+# Same columns (and names) the single campaign query of new_to_blink_s3.py returns
+output_columns = '''
+  transaction_id,
+  card_no,
+  total_txn_value,
+  transaction_date,
+  assign_date as registration_date,
+  createddateutc as app_install_date,
+  app_day_diff,
+  blm_day_diff,
+  mobile,
+  mobile_original,
+  name,
+  email,
+  partition_dt'''
+
+def validate_campaign(campaign):
+    missing = [key for key in required_campaign_keys if key not in campaign]
+    if missing:
+        raise ValueError(f"Campaign {campaign.get('name')} is missing {missing}")
+    if not campaign["tx_type_codes"]:
+        raise ValueError(f"Campaign {campaign['name']} has no tx_type_codes")
+    for key in ["app_day_diff", "blm_day_diff"]:
+        if campaign.get(key) is not None and len(campaign[key]) != 2:
+            raise ValueError(f"Campaign {campaign['name']} {key} must be a (low, high) pair")
+
+def active_campaigns(campaigns, observation_date):
+    #campaigns whose window contains observation_date
+    active = []
+    for campaign in campaigns:
+        validate_campaign(campaign)
+        if campaign["start_date"] <= observation_date and (campaign.get("end_date") is None or observation_date <= campaign["end_date"]):
+            active.append(campaign)
+    return active
+
+def _quote_list(values):
+    return ", ".join(f'"{value}"' for value in values)
+
+def campaign_rule(campaign, start_date):
+    #the campaign's WHERE clause over the scan columns, from start_date on
+    conditions = [
+        f'partition_dt >= "{start_date}"',
+        f"tx_type_code IN ({_quote_list(campaign['tx_type_codes'])})",
+    ]
+    if campaign.get("end_date") is not None:
+        conditions.append(f'partition_dt <= "{campaign["end_date"]}"')
+    if campaign.get("min_app_install_date") is not None:
+        conditions.append(f'createddateutc >= "{campaign["min_app_install_date"]}"')
+    if campaign.get("min_transaction_date") is not None:
+        conditions.append(f'transaction_date >= "{campaign["min_transaction_date"]}"')
+    for key in ["app_day_diff", "blm_day_diff"]:
+        if campaign.get(key) is not None:
+            low, high = campaign[key]
+            conditions.append(f"{key} <= {high}")
+            conditions.append(f"{key} >= {low}")
+    if campaign.get("min_txn_value") is not None:
+        conditions.append(f"total_txn_value >= {campaign['min_txn_value']}")
+    if campaign.get("extra_condition"):
+        conditions.append(f"({campaign['extra_condition']})")
+    return "\n      AND ".join(conditions)
+
+def build_campaigns_query(campaigns, observation_date, daily=False, observation_date_only=True):
+    """
+    One query returning the observation_date winners of every campaign. campaigns must be active on
+    observation_date (see active_campaigns).
+
+    daily=True scans and ranks only the observation_date partition, for incremental runs where an awarded card
+    state drops the cards that already won on an earlier date.
+    observation_date_only=False returns the winners of every date up to observation_date, to seed such a state.
+    """
+    if not campaigns:
+        raise ValueError("No campaigns to evaluate")
+    starts = [observation_date if daily else campaign["start_date"] for campaign in campaigns]
+    tx_type_codes = sorted({code for campaign in campaigns for code in campaign["tx_type_codes"]})
+
+    qualifies = ",\n".join(
+        f"    IFNULL(\n      {campaign_rule(campaign, start)}\n    , FALSE) AS qualifies_{i}"
+        for i, (campaign, start) in enumerate(zip(campaigns, starts))
+    )
+    row_nums = ",\n".join(
+        f"    ROW_NUMBER() OVER (PARTITION BY card_no, qualifies_{i} ORDER BY transaction_id ASC) AS row_num_{i}"
+        for i in range(len(campaigns))
+    )
+    any_qualifies = " OR ".join(f"qualifies_{i}" for i in range(len(campaigns)))
+    winners = ",\n".join(f"  qualifies_{i} AND row_num_{i} = 1 AS winner_{i}" for i in range(len(campaigns)))
+    any_winner = " OR ".join(f"(qualifies_{i} AND row_num_{i} = 1)" for i in range(len(campaigns)))
+    names = ", ".join(campaign["name"] for campaign in campaigns)
+    date_filter = f'partition_dt = "{observation_date}"\n  AND ' if observation_date_only else ""
+
+    return f'''
+-- first transaction campaigns: {names}
+
+WITH scanned AS (
+  SELECT {scan_columns}
+  FROM
+    `blink-data-warehouse.base_layer.ods_tx_txn_df` ods
+  LEFT JOIN
+    `blink-data-warehouse.aggregate_layer.dws_etl_cd_card_df` blm
+  ON
+    CAST(TRIM(ods.card_no) AS INT) = CAST(blm.card_no AS INT)
+  LEFT JOIN
+    `blink-data-warehouse.aggregate_layer.dws_etl_mobileapp2_blmember_df` app
+  ON
+    CAST(TRIM(ods.card_no) AS INT) = app.blcard
+  WHERE
+    ods.partition_dt >= "{min(starts)}"
+    AND ods.partition_dt <= "{observation_date}"
+    AND TRIM(tx_type_code) IN ({_quote_list(tx_type_codes)})
+),
+
+flagged AS (
+  SELECT
+    *,
+{qualifies}
+  FROM
+    scanned
+),
+
+ranked AS (
+  SELECT
+    *,
+{row_nums}
+  FROM
+    flagged
+  WHERE
+    {any_qualifies}
+)
+
+SELECT {output_columns},
+{winners}
+FROM
+  ranked
+WHERE
+  {date_filter}({any_winner})
+'''
+
+def split_campaign_winners(df, campaigns):
+    #{campaign name: that campaign's rows of the build_campaigns_query result, without the winner_<i> columns}
+    winner_columns = [f"winner_{i}" for i in range(len(campaigns))]
+    results = {}
+    for campaign, column in zip(campaigns, winner_columns):
+        results[campaign["name"]] = df[df[column].fillna(False).astype(bool)].drop(columns=winner_columns)
+    return results
@@ -0,0 +1,130 @@
+import pandas as pd
+
+# Vectorized cleaning for frames downloaded from BigQuery before they are written out as unquoted CSV.
+# Every string column is converted to Arrow once and comma removal, whitespace trimming and null filling run as
+# pyarrow compute kernels on that array, instead of a Python function per cell. Works on pandas DataFrames
+# (columns are replaced in place, the frame is returned for chaining) and on pyarrow Tables (a new Table is
+# returned). What was changed is counted into an optional summary dict, {column: {action: count}}, instead of
+# being printed row by row; format_clean_summary turns it into a single log line.
+
+def _add_count(summary, column, action, count):
+    if summary is None or not count:
+        return
+    counts = summary.setdefault(column, {})
+    counts[action] = counts.get(action, 0) + count
+
+def _to_arrow_strings(values):
+    #values as a pyarrow string array, or None if the column does not hold strings
+    import pyarrow as pa
+
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        arrow_values = values
+    elif pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype):
+        try:
+            arrow_values = pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return None
+    else:
+        return None
+    if pa.types.is_string(arrow_values.type) or pa.types.is_large_string(arrow_values.type):
+        return arrow_values
+    if pa.types.is_null(arrow_values.type):
+        # all missing, e.g. a left join without a single match
+        return arrow_values.cast(pa.string())
+    return None
+
+def _to_pandas_values(arrow_values, dtype):
+    if pd.api.types.is_object_dtype(dtype):
+        return arrow_values.to_numpy(zero_copy_only=False)
+    return pd.array(arrow_values.to_numpy(zero_copy_only=False), dtype=dtype)
+
+def _clean_array(arrow_values, column, remove_commas, strip, fill_value, summary):
+    import pyarrow.compute as pc
+
+    if remove_commas:
+        _add_count(summary, column, "commas_removed", pc.sum(pc.match_substring(arrow_values, ",")).as_py())
+        arrow_values = pc.replace_substring(arrow_values, ",", "")
+    if strip:
+        stripped = pc.utf8_trim_whitespace(arrow_values)
+        _add_count(summary, column, "stripped", pc.sum(pc.not_equal(pc.binary_length(stripped), pc.binary_length(arrow_values))).as_py())
+        arrow_values = stripped
+    if fill_value is not None and arrow_values.null_count:
+        _add_count(summary, column, "nulls_filled", arrow_values.null_count)
+        arrow_values = pc.fill_null(arrow_values, fill_value)
+    return arrow_values
+
+def clean_string_columns(df, columns=None, remove_commas=False, strip=True, fill_value=None, summary=None):
+    """
+    Cleans the string columns of df (all of them, or only those in columns) in one pass per column.
+
+    remove_commas: drop every ',' so values cannot break an unquoted CSV
+    strip: trim leading and trailing whitespace, same characters as str.strip()
+    fill_value: replacement for nulls, either one value or a {column: value} dict as for DataFrame.fillna
+    Columns that do not hold strings are left untouched.
+    """
+    import pyarrow as pa
+
+    is_table = isinstance(df, pa.Table)
+    names = df.column_names if is_table else df.columns
+    for column in (names if columns is None else columns):
+        values = df.column(column) if is_table else df[column]
+        arrow_values = _to_arrow_strings(values)
+        if arrow_values is None:
+            continue
+        column_fill = fill_value.get(column) if isinstance(fill_value, dict) else fill_value
+        arrow_values = _clean_array(arrow_values, column, remove_commas, strip, column_fill, summary)
+        if is_table:
+            df = df.set_column(df.schema.get_field_index(column), column, arrow_values)
+        else:
+            df[column] = _to_pandas_values(arrow_values, values.dtype)
+    return df
+
+def parse_card_no(df, column="card_no", errors="raise", summary=None):
+    """
+    Trims and converts card numbers to int64, the vectorized form of df['card_no'].str.strip().astype(int).
+
+    errors='raise' raises ValueError on a null or non-numeric card number, as astype(int) did.
+    errors='coerce' turns them into nulls (a nullable Int64 column) and counts them as invalid in summary.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    is_table = isinstance(df, pa.Table)
+    values = df.column(column) if is_table else df[column]
+    if not is_table and pd.api.types.is_integer_dtype(values.dtype):
+        return df
+    arrow_values = _to_arrow_strings(values)
+    if arrow_values is None:
+        arrow_values = pa.array(values, from_pandas=True) if not is_table else values
+        if pa.types.is_integer(arrow_values.type):
+            arrow_values = arrow_values.cast(pa.int64())
+        else:
+            raise ValueError(f"Column {column} holds {arrow_values.type}, expected card numbers as strings or integers")
+    else:
+        trimmed = pc.utf8_trim_whitespace(arrow_values)
+        if errors == "coerce":
+            valid = pc.match_substring_regex(trimmed, r"^-?[0-9]+$")
+            invalid = pc.sum(pc.invert(pc.fill_null(valid, False))).as_py()
+            _add_count(summary, column, "invalid_card_no", invalid)
+            trimmed = pc.if_else(valid, trimmed, pa.scalar(None, pa.string()))
+        elif errors != "raise":
+            raise ValueError(f"errors must be 'raise' or 'coerce', got {errors}")
+        elif trimmed.null_count:
+            raise ValueError(f"Column {column} has {trimmed.null_count} missing card numbers")
+        arrow_values = pc.cast(trimmed, pa.int64())
+
+    if is_table:
+        return df.set_column(df.schema.get_field_index(column), column, arrow_values)
+    if arrow_values.null_count:
+        # through Arrow rather than float, 16 digit card numbers do not survive a float64 round trip
+        df[column] = arrow_values.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get).array
+    else:
+        df[column] = arrow_values.to_numpy(zero_copy_only=False)
+    return df
+
+def format_clean_summary(summary):
+    #e.g. "card_no: 2 invalid_card_no; name: 3 commas_removed, 40 stripped", or "nothing changed"
+    parts = []
+    for column, counts in summary.items():
+        parts.append(f"{column}: " + ", ".join(f"{count} {action}" for action, count in counts.items()))
+    return "; ".join(parts) or "nothing changed"
@@ -1,10 +1,26 @@
 from google.cloud import storage
+from google.cloud.storage.batch import Batch
 import pandas as pd
-from io import StringIO, BytesIO
+from io import StringIO, BytesIO, TextIOWrapper
 import gzip
 import os
 import logging
 import csv
+import time
+import uuid
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from utils.parquet_utils import write_parquet
+from utils.arrow_utils import is_arrow_table, arrow_csv_supported, arrow_to_pandas, write_arrow_payload
+
+class _RecordingBatch(Batch):
+    # Keeps what finish() returns, one response per deferred call in the order they were added, which the
+    # with block otherwise discards
+    responses = ()
+
+    def finish(self, raise_exception=True):
+        self.responses = super().finish(raise_exception=raise_exception)
+        return self.responses
 
 class GCS:
     """
@@ -18,20 +34,27 @@ class GCS:
         client (storage.Client): Google Cloud Storage client instance.
 
     Methods:
-        __init__(self, google_credential_path, log_level):
-            Initializes the GCS class with Google Cloud credentials and logging settings.
+        __init__(self, google_credential_path, log_level, max_workers, api_endpoint):
+            Initializes the GCS class with Google Cloud credentials, logging settings and the reader thread pool size.
+            google_credential_path is optional, without it application default credentials are used. api_endpoint
+            points the client at another server (e.g. a local fake GCS server) with anonymous credentials.
         
-        read_gcs_files_to_df(self, bucket_name, prefix):
-            Reads files from a GCS bucket with the given prefix into a pandas DataFrame.
+        read_gcs_files_to_df(self, bucket_name, prefix, max_workers):
+            Reads files from a GCS bucket with the given prefix into a pandas DataFrame, several blobs at a time.
         
         _read_file_from_blob(self, blob):
-            Helper method to read different file types from a GCS blob.
+            Helper method to read different file types from a GCS blob, streaming it instead of buffering it whole.
         
         set_log_level(self, log_level):
             Sets the logging level.
         
-        upload_df_to_gcs(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar):
-            Uploads a pandas DataFrame to GCS in CSV, gzipped CSV, or Parquet format.
+        upload_df_to_gcs(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, composite_threshold, component_size, max_workers, parquet_profile, raise_errors):
+            Uploads a pandas DataFrame to GCS in CSV, gzipped CSV, or Parquet format. Frames whose in-memory size
+            reaches composite_threshold bytes go through a parallel composite upload. parquet_profile names an entry
+            of utils.parquet_utils.PARQUET_PROFILES (or is a dict of the same keys). dataframe may also be a pyarrow
+            Table, written with pyarrow's Parquet/CSV writers (CSV falls back to pandas when values need escapechar).
+            Failed uploads are logged; with raise_errors=True the error is raised as well, as S3.upload_df_to_s3
+            does. Returns the bytes uploaded, None on a logged failure.
         
         copy_to_gcs(self, path, bucket_name, gcs_prefix):
             Copies files or directories from local storage to GCS.
@@ -48,23 +71,35 @@ class GCS:
         _upload_directory(self, directory_path, bucket_name, gcs_prefix):
             Helper method to upload a directory from local storage to GCS.
         
-        _upload_csv(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar):
+        _upload_csv(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, raise_errors):
             Helper method to upload a pandas DataFrame to GCS in CSV format.
         
-        _upload_csv_gzip(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar):
+        _upload_csv_gzip(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, raise_errors):
             Helper method to upload a pandas DataFrame to GCS in gzipped CSV format.
         
-        _upload_parquet(self, dataframe, bucket_name, gcs_key):
+        _upload_parquet(self, dataframe, bucket_name, gcs_key, parquet_profile, raise_errors):
             Helper method to upload a pandas DataFrame to GCS in Parquet format.
         
-        delete_objects_from_gcs(self, bucket_name, gcs_prefix):
-            Deletes objects from a GCS bucket with the given prefix.
+        _upload_composite(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, component_size, max_workers, parquet_profile, raise_errors):
+            Helper method to write the payload to a temporary file, upload it as parallel components and compose them.
+        
+        _write_payload(self, dataframe, f, gcs_key, index, quotechar, quoting, escapechar, parquet_profile):
+            Helper method to write the CSV, gzipped CSV or Parquet payload of a DataFrame to a binary file.
+        
+        delete_objects_from_gcs(self, bucket_name, gcs_prefix, max_workers):
+            Deletes objects from a GCS bucket with the given prefix, 100 deletes per batch request.
+        
+        update_blobs_metadata(self, bucket_name, gcs_prefix, content_type, metadata, max_workers):
+            Sets the content type and/or custom metadata of every object with the given prefix, 100 patches per batch request.
+        
+        _run_blob_batches(self, blobs, operation, description, max_workers):
+            Helper method to apply an operation to blobs through concurrent batch requests and log a summary.
         
         list_objects_in_bucket(self, bucket_name, prefix, return_list):
             Lists objects in a GCS bucket with the given prefix.
     """
     
-    def __init__(self, google_credential_path, log_level=logging.INFO):
+    def __init__(self, google_credential_path=None, log_level=logging.INFO, max_workers=16, api_endpoint=None):
         # Set up logger
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(log_level)
@@ -74,19 +109,43 @@ class GCS:
         if not self.logger.handlers:
             self.logger.addHandler(handler)
         
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = google_credential_path
-        self.client = storage.Client()
+        self.max_workers = max_workers
+        if api_endpoint:
+            # Local stand-in such as fake-gcs-server, no real credentials involved
+            from google.auth.credentials import AnonymousCredentials
+            credentials = AnonymousCredentials()
+            client_kwargs = {"project": "test", "client_options": {"api_endpoint": api_endpoint}}
+        else:
+            # Without a key file the client falls back to application default credentials
+            import google.auth
+            if google_credential_path:
+                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = google_credential_path
+            credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+            client_kwargs = {}
+
+        # One HTTP connection per worker thread instead of the default pool of 10
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.client = storage.Client(credentials=credentials, _http=session, **client_kwargs)
 
-    def read_gcs_files_to_df(self, bucket_name, prefix):
+    def read_gcs_files_to_df(self, bucket_name, prefix, max_workers=None):
         try:
             bucket = self.client.bucket(bucket_name)
             blobs = bucket.list_blobs(prefix=prefix)
-            data_frames = []
-            
-            for blob in blobs:
+
+            def read_blob(blob):
                 self.logger.info(f"Processing file: {blob.name}")
-                data_frames.append(self._read_file_from_blob(blob))
-                
+                return self._read_file_from_blob(blob)
+
+            with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                # Blobs are submitted page by page while the listing continues, results keep the listing order
+                futures = [executor.submit(read_blob, blob) for page in blobs.pages for blob in page]
+                data_frames = [future.result() for future in futures]
+
             if data_frames:
                 return pd.concat(data_frames, ignore_index=True)
             else:
@@ -98,15 +157,18 @@ class GCS:
             return pd.DataFrame()
 
     def _read_file_from_blob(self, blob):
+        # blob.open streams the object in chunks, the parsers pull from it as they go
         if blob.name.endswith('.csv'):
-            content = blob.download_as_text()
-            return pd.read_csv(StringIO(content))
+            with blob.open('rb') as f:
+                return pd.read_csv(f)
         elif blob.name.endswith('.csv.gz'):
-            content = gzip.decompress(blob.download_as_bytes())
-            return pd.read_csv(BytesIO(content))
+            # Decompressed incrementally while pandas reads
+            with blob.open('rb') as f, gzip.GzipFile(fileobj=f) as gz:
+                return pd.read_csv(gz)
         elif blob.name.endswith('.parquet'):
-            content = blob.download_as_bytes()
-            return pd.read_parquet(BytesIO(content))
+            # BlobReader is seekable, so pyarrow reads the footer and then the column chunks
+            with blob.open('rb') as f:
+                return pd.read_parquet(f)
         else:
             self.logger.warning(f"Unsupported file type: {blob.name}")
             return pd.DataFrame()
@@ -116,14 +178,26 @@ class GCS:
         for handler in self.logger.handlers:
             handler.setLevel(log_level)
 
-    def upload_df_to_gcs(self, dataframe, bucket_name, gcs_key, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\'):
+    def upload_df_to_gcs(self, dataframe, bucket_name, gcs_key, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\',
+                         composite_threshold=512 * 1024 * 1024, component_size=64 * 1024 * 1024, max_workers=None, parquet_profile=None, raise_errors=False):
         try:
-            if gcs_key.endswith('.csv'):
-                self._upload_csv(dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar)
+            is_arrow = is_arrow_table(dataframe)
+            if is_arrow and gcs_key.endswith(('.csv', '.csv.gz')) and not arrow_csv_supported(dataframe, quotechar, quoting, escapechar):
+                self.logger.info("Values need escaping the Arrow CSV writer does not support, converting the table to pandas")
+                dataframe = arrow_to_pandas(dataframe)
+                is_arrow = False
+            size = dataframe.nbytes if is_arrow else dataframe.memory_usage(deep=True).sum()
+            is_large = composite_threshold is not None and size >= composite_threshold
+            if is_large and gcs_key.endswith(('.csv', '.csv.gz', '.parquet')):
+                return self._upload_composite(dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, component_size, max_workers, parquet_profile, raise_errors)
+            elif is_arrow and gcs_key.endswith(('.csv', '.csv.gz', '.parquet')):
+                return self._upload_arrow(dataframe, bucket_name, gcs_key, quoting, parquet_profile, raise_errors)
+            elif gcs_key.endswith('.csv'):
+                return self._upload_csv(dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, raise_errors)
             elif gcs_key.endswith('.csv.gz'):
-                self._upload_csv_gzip(dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar)
+                return self._upload_csv_gzip(dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, raise_errors)
             elif gcs_key.endswith('.parquet'):
-                self._upload_parquet(dataframe, bucket_name, gcs_key)
+                return self._upload_parquet(dataframe, bucket_name, gcs_key, parquet_profile, raise_errors)
             else:
                 raise ValueError(f"Unsupported file extension for gcs_key: {gcs_key}")
         except Exception as e:
@@ -193,55 +267,211 @@ class GCS:
                 gcs_key = os.path.join(gcs_prefix, os.path.relpath(file_path, directory_path))
                 self._upload_file(file_path, bucket_name, gcs_key)
 
-    def _upload_csv(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar):
+    def _upload_csv(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, raise_errors=False):
         try:
             csv_buffer = StringIO()
             dataframe.to_csv(csv_buffer, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar)
+            body = csv_buffer.getvalue().encode('utf-8')
             bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(gcs_key)
-            blob.upload_from_string(csv_buffer.getvalue(), content_type='text/csv')
+            blob.upload_from_string(body, content_type='text/csv')
             self.logger.info(f"Successfully uploaded CSV to {bucket_name}/{gcs_key}")
+            return len(body)
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
+            if raise_errors:
+                raise
 
-    def _upload_csv_gzip(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar):
+    def _upload_csv_gzip(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, raise_errors=False):
         try:
             csv_buffer = StringIO()
             dataframe.to_csv(csv_buffer, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar)
             gz_buffer = BytesIO()
             with gzip.GzipFile(fileobj=gz_buffer, mode='w') as gz_file:
                 gz_file.write(csv_buffer.getvalue().encode('utf-8'))
+            body = gz_buffer.getvalue()
             bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(gcs_key)
-            blob.upload_from_string(gz_buffer.getvalue(), content_type='application/gzip')
+            blob.upload_from_string(body, content_type='application/gzip')
             self.logger.info(f"Successfully uploaded gzipped CSV to {bucket_name}/{gcs_key}")
+            return len(body)
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
+            if raise_errors:
+                raise
 
-    def _upload_parquet(self, dataframe, bucket_name, gcs_key):
+    def _upload_parquet(self, dataframe, bucket_name, gcs_key, parquet_profile=None, raise_errors=False):
         try:
             parquet_buffer = BytesIO()
-            dataframe.to_parquet(parquet_buffer, index=False)
+            write_parquet(dataframe, parquet_buffer, parquet_profile)
+            body = parquet_buffer.getvalue()
             bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(gcs_key)
-            blob.upload_from_string(parquet_buffer.getvalue(), content_type='application/octet-stream')
+            blob.upload_from_string(body, content_type='application/octet-stream')
             self.logger.info(f"Successfully uploaded Parquet to {bucket_name}/{gcs_key}")
+            return len(body)
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+            if raise_errors:
+                raise
+
+    def _upload_arrow(self, table, bucket_name, gcs_key, quoting, parquet_profile=None, raise_errors=False):
+        content_type = 'application/octet-stream' if gcs_key.endswith('.parquet') else 'application/gzip' if gcs_key.endswith('.csv.gz') else 'text/csv'
+        try:
+            buffer = BytesIO()
+            write_arrow_payload(table, buffer, gcs_key, quoting, parquet_profile)
+            body = buffer.getvalue()
+            bucket = self.client.bucket(bucket_name)
+            blob = bucket.blob(gcs_key)
+            blob.upload_from_string(body, content_type=content_type)
+            self.logger.info(f"Successfully uploaded Arrow table to {bucket_name}/{gcs_key}")
+            return len(body)
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
+            if raise_errors:
+                raise
+
+    def _write_payload(self, dataframe, f, gcs_key, index, quotechar, quoting, escapechar, parquet_profile=None, chunk_rows=100000):
+        if is_arrow_table(dataframe):
+            write_arrow_payload(dataframe, f, gcs_key, quoting, parquet_profile, chunk_rows)
+            return
+        if gcs_key.endswith('.parquet'):
+            write_parquet(dataframe, f, parquet_profile)
+            return
+        gz_file = gzip.GzipFile(fileobj=f, mode='wb') if gcs_key.endswith('.csv.gz') else None
+        text = TextIOWrapper(gz_file or f, encoding='utf-8', newline='')
+        # Written in row chunks so no full-size string of the output is ever built
+        for start in range(0, max(len(dataframe), 1), chunk_rows):
+            dataframe.iloc[start:start + chunk_rows].to_csv(
+                text, header=start == 0, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar
+            )
+        text.flush()
+        text.detach()
+        if gz_file is not None:
+            gz_file.close()
 
-    def delete_objects_from_gcs(self, bucket_name, gcs_prefix):
+    def _upload_composite(self, dataframe, bucket_name, gcs_key, index, quotechar, quoting, escapechar, component_size, max_workers=None, parquet_profile=None, raise_errors=False):
+        # compose accepts at most 32 sources per call
+        max_compose_sources = 32
+        content_type = 'application/octet-stream' if gcs_key.endswith('.parquet') else 'application/gzip' if gcs_key.endswith('.csv.gz') else 'text/csv'
+        bucket = self.client.bucket(bucket_name)
+        tmp_prefix = f"{gcs_key}.compose-{uuid.uuid4().hex}/"
+        temporary_blobs = []
+        try:
+            start = time.perf_counter()
+            with tempfile.TemporaryFile() as f:
+                self._write_payload(dataframe, f, gcs_key, index, quotechar, quoting, escapechar, parquet_profile)
+                size = f.tell()
+                f.flush()
+
+                def upload_component(number, offset):
+                    # pread reads at an offset without moving the shared file position
+                    blob = bucket.blob(f"{tmp_prefix}{number:05d}")
+                    blob.upload_from_string(os.pread(f.fileno(), component_size, offset), content_type=content_type)
+                    # Recorded as soon as it exists, so a later failure still cleans it up
+                    temporary_blobs.append(blob)
+                    return blob
+
+                def compose_group(sources, target):
+                    target.compose(sources)
+                    temporary_blobs.append(target)
+
+                offsets = range(0, max(size, 1), component_size)
+                with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                    sources = list(executor.map(upload_component, range(len(offsets)), offsets))
+
+                    # Compose level by level until one call can produce the destination
+                    level = 0
+                    while len(sources) > max_compose_sources:
+                        groups = [sources[i:i + max_compose_sources] for i in range(0, len(sources), max_compose_sources)]
+                        targets = [bucket.blob(f"{tmp_prefix}level{level}-{number:05d}") for number in range(len(groups))]
+                        for target in targets:
+                            target.content_type = content_type
+                        list(executor.map(compose_group, groups, targets))
+                        sources = targets
+                        level += 1
+
+            destination = bucket.blob(gcs_key)
+            destination.content_type = content_type
+            destination.compose(sources)
+            self.logger.info(f"Successfully uploaded {size} bytes to {bucket_name}/{gcs_key} as {len(offsets)} composed components in {time.perf_counter() - start:.1f}s")
+            return size
+        except Exception as e:
+            self.logger.error(f"An error occurred during composite upload: {e}")
+            if raise_errors:
+                raise
+        finally:
+            if temporary_blobs:
+                # A failed cleanup is logged, it must not replace the upload's own error
+                try:
+                    self._run_blob_batches(temporary_blobs, lambda blob: blob.delete(), "temporary component cleanup")
+                except Exception as e:
+                    self.logger.error(f"Failed to clean up the temporary components under {bucket_name}/{tmp_prefix}: {e}")
+
+    def delete_objects_from_gcs(self, bucket_name, gcs_prefix, max_workers=None):
         try:
             bucket = self.client.bucket(bucket_name)
             blobs = bucket.list_blobs(prefix=gcs_prefix)
+            return self._run_blob_batches(blobs, lambda blob: blob.delete(), "delete", max_workers)
 
-            for blob in blobs:
-                self.logger.info(f"Deleting file {blob.name}")
-                blob.delete()
-                self.logger.info(f"File {blob.name} deleted")
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+
+    def update_blobs_metadata(self, bucket_name, gcs_prefix, content_type=None, metadata=None, max_workers=None):
+        def patch(blob):
+            if content_type is not None:
+                blob.content_type = content_type
+            if metadata is not None:
+                blob.metadata = metadata
+            blob.patch()
+
+        try:
+            bucket = self.client.bucket(bucket_name)
+            blobs = bucket.list_blobs(prefix=gcs_prefix)
+            return self._run_blob_batches(blobs, patch, "metadata update", max_workers)
 
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
 
+    def _run_blob_batches(self, blobs, operation, description, max_workers=None):
+        # The JSON API accepts at most 100 calls per batch request
+        batch_size = 100
+
+        def run_batch(batch_blobs):
+            with _RecordingBatch(self.client, raise_exception=False) as batch:
+                for blob in batch_blobs:
+                    operation(blob)
+            return [
+                (blob.name, response.status_code)
+                for blob, response in zip(batch_blobs, batch.responses)
+                if not 200 <= response.status_code < 300
+            ]
+
+        start = time.perf_counter()
+        total = 0
+        failed = []
+        # Batches are kept per thread by the client, so several can be in flight at once
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = []
+            # Listings are consumed page by page, a plain list of blobs is treated as one page. pages may only be
+            # read once, reading it starts the listing (so no hasattr check before it)
+            pages = getattr(blobs, 'pages', None)
+            for page in (pages if pages is not None else [blobs]):
+                page_blobs = list(page)
+                total += len(page_blobs)
+                for i in range(0, len(page_blobs), batch_size):
+                    futures.append(executor.submit(run_batch, page_blobs[i:i + batch_size]))
+            for future in futures:
+                failed.extend(future.result())
+
+        elapsed = time.perf_counter() - start
+        succeeded = total - len(failed)
+        rate = succeeded / elapsed if elapsed > 0 else 0
+        self.logger.info(f"Batch {description}: {succeeded} of {total} objects succeeded in {elapsed:.1f}s ({rate:.0f} objects/s)")
+        if failed:
+            self.logger.error(f"Batch {description} failed for {len(failed)} objects, first failures (name, status): {failed[:5]}")
+        return {"total": total, "succeeded": succeeded, "failed": failed}
+
     def list_objects_in_bucket(self, bucket_name, prefix='', return_list=True):
         try:
             bucket = self.client.bucket(bucket_name)
@@ -26,14 +26,13 @@ class GCS:
         self.bucket_name = bucket_name
         self.bucket = self.client.get_bucket(bucket_name)
     
-    def send_parquet_gcs(self, df, gcs_file_path):
+    def send_parquet_gcs(self, df, gcs_file_path, profile="gzip", preserve_index=None):
         import io
-        import pyarrow as pa
-        import pyarrow.parquet as pq
-        #upload as parquet
+        from utils.parquet_utils import write_parquet
+        #upload as parquet, profile is a name from utils.parquet_utils.PARQUET_PROFILES or a dict
+        #preserve_index=None writes the index as pa.Table.from_pandas(df) always did, False drops it
         buffer = io.BytesIO()
-        table = pa.Table.from_pandas(df)
-        pq.write_table(table, buffer, compression='gzip')
+        write_parquet(df, buffer, profile, preserve_index=preserve_index)
         buffer.seek(0)
         blob = self.bucket.blob(gcs_file_path)
         blob.upload_from_file(buffer, content_type='application/octet-stream')
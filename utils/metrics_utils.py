@@ -0,0 +1,290 @@
+# Stage timings of a pipeline run, written as a JSON report and optionally a Prometheus textfile.
+#
+# Every stage records wall time, CPU time (process_time, and thread_time for the thread the stage ran on, which
+# is what counts when several units share the process), rows in / out, bytes and the peak RSS of the process.
+# bytes depends on the stage:
+#   query      bytes BigQuery processed for the job
+#   download   in-memory size of the downloaded frame
+#   cache_read in-memory size of the cached frame
+#   upload     bytes put to the object store (upload_df_to_s3 encodes and sends in one call, so encoding is
+#              part of the upload stage)
+# The other stages (clean, transform, ...) leave it empty. Peak RSS is the process high-water mark (ru_maxrss),
+# rss_growth_mb how much the stage raised it.
+
+import os
+import sys
+import json
+import time
+import copy
+import logging
+import resource
+import functools
+import threading
+
+def _prometheus_value(value):
+    # Exact integers for counts and bytes, full precision for seconds
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class StageTimer:
+    """
+    One stage of a run, as a context manager. rows_out and bytes (and rows_in if unknown up front) are set on it
+    inside the block. A stage that raises is recorded with status "error" and the exception propagates.
+    """
+    def __init__(self, report, name, labels=None, rows_in=None):
+        self.report = report
+        self.name = name
+        self.labels = labels or {}
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes = None
+        self.record = None
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.thread_cpu_start = time.thread_time()
+        self.rss_start = _peak_rss_bytes()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        peak_rss = _peak_rss_bytes()
+        self.record = {
+            "stage": self.name,
+            "labels": self.labels,
+            "status": "ok" if exc_type is None else "error",
+            "started_at": self.started_at,
+            "wall_seconds": time.perf_counter() - self.start,
+            "cpu_seconds": time.process_time() - self.cpu_start,
+            "thread_cpu_seconds": time.thread_time() - self.thread_cpu_start,
+            "rows_in": None if self.rows_in is None else int(self.rows_in),
+            "rows_out": None if self.rows_out is None else int(self.rows_out),
+            "bytes": None if self.bytes is None else int(self.bytes),
+            "peak_rss_mb": peak_rss / 1024 ** 2,
+            "rss_growth_mb": (peak_rss - self.rss_start) / 1024 ** 2,
+        }
+        if exc_type is not None:
+            self.record["error"] = repr(exc)
+        if self.report is not None:
+            self.report.add(self.record)
+        return False
+
+def timed_stage(report, name, rows_in=None, **labels):
+    #report.stage(...), or an unrecorded StageTimer when report is None, so callers need no branches
+    if report is None:
+        return StageTimer(None, name, labels, rows_in)
+    return report.stage(name, rows_in=rows_in, **labels)
+
+class RunReport:
+    """
+    RunReport class for collecting the stage timings of one pipeline run.
+
+    Stages are recorded with the stage context manager or the timed decorator, from any thread. bind returns a
+    view of the report that adds labels (e.g. batch) to its stages, stages recorded in another process are added
+    with extend. At the end of the run write_json writes every stage plus per-stage totals, write_prometheus the
+    totals as gauges for the node_exporter textfile collector.
+
+    Attributes:
+        logger (logging.Logger): Logger instance for logging messages.
+        run (str): Name of the run, e.g. "new_to_blink_s3".
+        labels (dict): Labels of the whole run, e.g. the observation date.
+        stages (list): Recorded stages, dicts as described at the top of this module.
+        status (str): "ok", or "error" once finish(error) was called.
+
+    Methods:
+        stage(self, name, rows_in, **labels):
+            Context manager timing one stage.
+
+        timed(self, name, **labels):
+            Decorator timing every call of a function as a stage, rows_out is the length of its result.
+
+        bind(self, **labels):
+            Report view sharing the stages, adding labels to those recorded through it.
+
+        extend(self, stages):
+            Adds stages recorded elsewhere, e.g. in a worker process.
+
+        totals(self):
+            Per stage name: count, wall / cpu seconds, rows, bytes and the highest peak RSS.
+
+        finish(self, error):
+            Marks the end of the run, failed if error is given.
+
+        write_json(self, path):
+            Writes the report to path.
+
+        write_prometheus(self, path, prefix):
+            Writes the totals in the Prometheus text format to path.
+
+        write_reports(self, json_path, prometheus_path):
+            write_json and, with prometheus_path, write_prometheus, logging a failed write instead of raising it, so
+            the end of a run (failed ones included) never replaces the run's own error.
+
+    Sample usage:
+        report = RunReport("new_to_blink_s3", observation_date="2024-08-02")
+        with report.stage("clean", rows_in=len(df)) as stage:
+            df = clean_string_columns(df)
+            stage.rows_out = len(df)
+        report.finish()
+        report.write_reports("/home/chunkit/bonus-reports/new_to_blink_s3_2024-08-02.json",
+                             "/var/lib/node_exporter/textfile/new_to_blink_s3.prom")
+    """
+    def __init__(self, run, log_level=logging.INFO, **labels):
+        # Set up logger
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(log_level)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+
+        self.run = run
+        self.labels = labels
+        self.stage_labels = {}
+        self.stages = []
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.finished_at = None
+        self.wall_seconds = None
+        self.status = "running"
+        self.error = None
+
+    def stage(self, name, rows_in=None, **labels):
+        return StageTimer(self, name, {**self.stage_labels, **labels}, rows_in)
+
+    def timed(self, name, **labels):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name, **labels) as stage:
+                    result = func(*args, **kwargs)
+                    if hasattr(result, "__len__"):
+                        stage.rows_out = len(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def bind(self, **labels):
+        # Shallow copy, the view appends to the same stages list under the same lock
+        view = copy.copy(self)
+        view.stage_labels = {**self.stage_labels, **labels}
+        return view
+
+    def add(self, record):
+        with self.lock:
+            self.stages.append(record)
+
+    def extend(self, stages):
+        with self.lock:
+            self.stages.extend(stages)
+
+    def totals(self):
+        totals = {}
+        with self.lock:
+            stages = list(self.stages)
+        for record in stages:
+            total = totals.setdefault(record["stage"], {"count": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                        "thread_cpu_seconds": 0.0, "rows_in": 0, "rows_out": 0, "bytes": 0,
+                                                        "peak_rss_mb": 0.0})
+            total["count"] += 1
+            total["errors"] += record["status"] != "ok"
+            for key in ["wall_seconds", "cpu_seconds", "thread_cpu_seconds", "rows_in", "rows_out", "bytes"]:
+                total[key] += record[key] or 0
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], record["peak_rss_mb"])
+        for total in totals.values():
+            total["rows_per_second"] = total["rows_out"] / total["wall_seconds"] if total["wall_seconds"] > 0 else None
+        return totals
+
+    def finish(self, error=None):
+        self.finished_at = time.time()
+        self.wall_seconds = time.perf_counter() - self.start
+        self.status = "ok" if error is None else "error"
+        self.error = None if error is None else repr(error)
+        for name, total in self.totals().items():
+            self.logger.info(f"{self.run} stage {name}: {total['count']} x, {total['wall_seconds']:.2f}s wall, "
+                             f"{total['cpu_seconds']:.2f}s cpu, rows {total['rows_out']}, bytes {total['bytes']}, peak RSS {total['peak_rss_mb']:.0f} MB")
+        self.logger.info(f"{self.run} {self.status} in {self.wall_seconds:.2f}s")
+        return self
+
+    def to_dict(self):
+        with self.lock:
+            stages = list(self.stages)
+        return {
+            "run": self.run,
+            "labels": self.labels,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_seconds": self.wall_seconds,
+            "peak_rss_mb": _peak_rss_bytes() / 1024 ** 2,
+            "totals": self.totals(),
+            "stages": stages,
+        }
+
+    def _write_atomic(self, path, text):
+        # Readers (and the textfile collector) never see a half-written file
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def write_json(self, path):
+        self._write_atomic(path, json.dumps(self.to_dict(), indent=2, default=str))
+        self.logger.info(f"Wrote run report {path}")
+        return path
+
+    def write_prometheus(self, path, prefix="bonus_pipeline"):
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        run_labels = f'run="{escape(self.run)}"'
+        metrics = [
+            ("stage_runs", "Stages of this name in the last run", "count", 1),
+            ("stage_errors", "Failed stages of this name in the last run", "errors", 1),
+            ("stage_wall_seconds", "Wall time of the stage in the last run, summed", "wall_seconds", 1),
+            ("stage_cpu_seconds", "Process CPU time during the stage in the last run, summed", "cpu_seconds", 1),
+            ("stage_rows_in", "Rows into the stage in the last run", "rows_in", 1),
+            ("stage_rows_out", "Rows out of the stage in the last run", "rows_out", 1),
+            ("stage_bytes", "Bytes of the stage in the last run, see utils.metrics_utils", "bytes", 1),
+            ("stage_peak_rss_bytes", "Peak RSS of the process at the end of the stage", "peak_rss_mb", 1024 ** 2),
+        ]
+        totals = self.totals()
+        lines = []
+        for metric, description, key, scale in metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} gauge")
+            for name, total in totals.items():
+                lines.append(f'{prefix}_{metric}{{{run_labels},stage="{escape(name)}"}} {_prometheus_value(total[key] * scale)}')
+        run_metrics = [
+            ("run_wall_seconds", "Wall time of the last run", self.wall_seconds or 0),
+            ("run_success", "1 if the last run succeeded", int(self.status == "ok")),
+            ("run_finished_timestamp_seconds", "End of the last run, unix time", self.finished_at or time.time()),
+        ]
+        for metric, description, value in run_metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} gauge")
+            lines.append(f"{prefix}_{metric}{{{run_labels}}} {_prometheus_value(value)}")
+        self._write_atomic(path, "\n".join(lines) + "\n")
+        self.logger.info(f"Wrote Prometheus textfile {path}")
+        return path
+
+    def write_reports(self, json_path, prometheus_path=None):
+        written = []
+        for write, path in [(self.write_json, json_path), (self.write_prometheus, prometheus_path)]:
+            if path is None:
+                continue
+            try:
+                written.append(write(path))
+            except Exception as e:
+                self.logger.error(f"Failed to write {path}: {e!r}")
+        return written
@@ -1,10 +1,15 @@
 from utils.utils import bq_to_pd_v2
+from utils.clean_utils import clean_string_columns, parse_card_no, format_clean_summary
+from utils.metrics_utils import RunReport, timed_stage
 import pendulum
 import pandas as pd
 import numpy as np
 import json
 
-def process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, groupcode_df, productcode_df, pii_df, outlet_location_info_df):
+def process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, groupcode_df, productcode_df, pii_df, outlet_location_info_df, legacy_payload=False, report=None):
+    #report: optional utils.metrics_utils.RunReport, the query, download, clean and transform stages are recorded with the batch
+    if report is not None:
+        report = report.bind(batch=batch)
     interested_cols = [
         "ods.partition_dt", 
         "ods.transaction_id", 
@@ -44,21 +49,34 @@ def process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, gro
             AND ods.transaction_id >= {transaction_id_min}
             AND ods.transaction_id < {transaction_id_max}
         """
-    df = bq_to_pd_v2(query)
+    df = bq_to_pd_v2(query, report=report)
     #check if df is empty, if empty return None
     if df.empty:
         print(f"completed batch {batch} with null entry, nothing will be written")
         return pd.DataFrame()
 
-    #join df with productcode and groupcode for addtional information
+    clean_summary = {}
+    with timed_stage(report, "clean", rows_in=len(df)) as stage:
+        df = _clean_tx_txn(df, clean_summary)
+        stage.rows_out = len(df)
+    with timed_stage(report, "transform", rows_in=len(df)) as stage:
+        _2 = _transform_tx_txn(df, groupcode_df, pii_df, outlet_location_info_df, legacy_payload, clean_summary)
+        stage.rows_out = len(_2)
+
+    print(f"cleaned batch {batch}:: {format_clean_summary(clean_summary)}")
+    return _2
+
+def _clean_tx_txn(df, clean_summary):
     #convert column type to match int
     df["group_code"] = pd.to_numeric(df["group_code"], errors='coerce')
     df["product_code"] = pd.to_numeric(df["product_code"], errors='coerce')
-    df['card_no'] = df['card_no'].str.strip()
-    df["card_no"] = df["card_no"].astype(int)
+    df = parse_card_no(df, summary=clean_summary)
     #strip the 
-    df["terminal_id"] = df["terminal_id"].str.strip()
+    df = clean_string_columns(df, columns=["terminal_id"], summary=clean_summary)
+    return df
 
+def _transform_tx_txn(df, groupcode_df, pii_df, outlet_location_info_df, legacy_payload, clean_summary):
+    #join df with productcode and groupcode for addtional information
     df = df.merge(groupcode_df, how="left", on="group_code")
     # df = df.merge(productcode_df, how="left", on="product_code")
     df = df.merge(pii_df, how="left", on="card_no")
@@ -85,8 +103,6 @@ def process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, gro
     _['std_pts'] = pd.to_numeric(_["std_pts"], errors='coerce').astype(float)
     _['bonus_pts'] = pd.to_numeric(_["bonus_pts"], errors='coerce').astype(float)
 
-    _["email"] = _["email"].fillna("")
-    _["mobile"] = _["mobile"].fillna("")
     _["product_code"] = _["product_code"].fillna(0)
     #group_code replace nan with empty string
     _["group_code"] = _["group_code"].fillna("")
@@ -96,17 +112,71 @@ def process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, gro
     _["value"] = _["value"].fillna(0)
     _["std_points_value"] = _["std_points_value"].fillna(0).astype(float)
     _["bonus_points_value"] = _["bonus_points_value"].fillna(0).astype(float)
-    _["userId"] = _["userId"].fillna("")
-    _["userId_type"] = _["userId_type"].fillna("")
-
-    #strip tabs and leading and trailing tabs
-    _["group_code"] = _['group_code'].str.strip()
-    _["email"] = _['email'].str.strip()
-    _["mobile"] = _['mobile'].str.strip()
-    _["userId"] = _['userId'].str.strip()
-    _["userId_type"] = _['userId_type'].str.strip()
+
+    #strip tabs and leading and trailing tabs, missing contacts become empty strings
+    _ = clean_string_columns(_, columns=["group_code", "email", "mobile", "userId", "userId_type"], fill_value="", summary=clean_summary)
     _["group_code"] = _['group_code'].replace('nan', '')
 
+    if legacy_payload:
+        product_gateway_out = _build_payload_legacy(_)
+    else:
+        product_gateway_out = _build_payload_columnar(_)
+    product_gateway_out["transaction_id"] = product_gateway_out["transaction_id"].astype(str)
+    #columns needed
+    out_cols = ["transaction_id", "card_no", "total_txn_value", "std_points_value", 
+                "bonus_points_value", 'merch_ref', 'participant_name', "form_of_pmt", 'transaction_date', 
+                "terminal_id", 'tx_type', "latitude", 'longitude']
+
+
+    _2 = df[out_cols].drop_duplicates()
+    _2["transaction_id"] = _2["transaction_id"].astype(str)
+    _2 = _2.merge(product_gateway_out, how="left", on="transaction_id")
+    _2 = _2[["card_no", 'user', "total_txn_value", "gateway", "transaction_date", "merch_ref", 
+        "participant_name", "form_of_pmt", "points", "products", "terminal_id", "tx_type", "latitude", "longitude"]]
+
+    _2 = clean_string_columns(_2, columns=["merch_ref", "participant_name", "form_of_pmt", "terminal_id", "tx_type"],
+                              fill_value={"participant_name": ""}, summary=clean_summary)
+
+    #correct format
+    # _2["total_txn_value"] = _2["total_txn_value"].astype('float')
+    # _2["std_points_value"] = _2["std_points_value"].astype('int64')
+    # _2["bonus_points_value"] = _2["bonus_points_value"].astype('int64')
+    _2["latitude"] = _2["latitude"].fillna(0)
+    _2["longitude"] = _2["longitude"].fillna(0)
+
+    #rename all to match the right column names
+    _2.rename(columns={
+        "card_no":"cardId", 
+        "total_txn_value":"amount", 
+        "transaction_date":"issuedAt",
+        'merch_ref':'merchantReference',
+        'participant_name':'partner',
+        'form_of_pmt': 'paymentMode',
+        'terminal_id':'terminalId',
+        'tx_type': 'type'
+        },inplace=True)
+
+    return _2
+
+    # #upload to s3
+    # # Define your S3 bucket name and the object name (file name)
+    # reverse_batch = max_batch - batch
+    # s3_path = f's3://{bucket}/{s3_path}/year={year}/month={month}/day={day}/{reverse_batch}.csv'
+
+    # # Write DataFrame to S3
+    # #initiate S3 Instance
+    # s3 = S3(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_SESSION_TOKEN, AWS_REGION_NAME, staging=True, log_level=logging.CRITICAL)
+    # _2.to_csv(s3_path, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\', storage_options={
+    #     'key': AWS_ACCESS_KEY_ID,
+    #     'secret': AWS_SECRET_ACCESS_KEY,
+    #     'token': AWS_SESSION_TOKEN,
+    #     'client_kwargs': {'region_name': AWS_REGION_NAME}
+    # })
+    # print(f"completed date:: {yesterday}, batch:: {batch}")
+   
+
+def _build_payload_legacy(_):
+    #original row-wise payload builder, kept for comparison against _build_payload_columnar
     # Group by and aggregate the columns into lists
     grouped = _.groupby(['transaction_id']).agg(list).reset_index()
 
@@ -164,68 +234,78 @@ def process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, gro
     grouped['points'] = grouped['points'].apply(lambda x: json.dumps(x).replace('"','\\"'))
 
     product_gateway_out = grouped[["transaction_id","products", 'gateway', 'points', 'user']].copy()
-    product_gateway_out["transaction_id"] = product_gateway_out["transaction_id"].astype(str)
-    #columns needed
-    out_cols = ["transaction_id", "card_no", "total_txn_value", "std_points_value", 
-                "bonus_points_value", 'merch_ref', 'participant_name', "form_of_pmt", 'transaction_date', 
-                "terminal_id", 'tx_type', "latitude", 'longitude']
-
-
-    _2 = df[out_cols].drop_duplicates()
-    _2["transaction_id"] = _2["transaction_id"].astype(str)
-    _2 = _2.merge(product_gateway_out, how="left", on="transaction_id")
-    _2 = _2[["card_no", 'user', "total_txn_value", "gateway", "transaction_date", "merch_ref", 
-        "participant_name", "form_of_pmt", "points", "products", "terminal_id", "tx_type", "latitude", "longitude"]]
-
-    _2["merch_ref"] = _2["merch_ref"].str.strip()
-    _2["participant_name"] = _2["participant_name"].str.strip()
-    _2["form_of_pmt"] = _2["form_of_pmt"].str.strip()
-    _2["terminal_id"] = _2["terminal_id"].str.strip()
-    _2["tx_type"] = _2["tx_type"].str.strip()
-
-    #correct format
-    # _2["total_txn_value"] = _2["total_txn_value"].astype('float')
-    # _2["std_points_value"] = _2["std_points_value"].astype('int64')
-    # _2["bonus_points_value"] = _2["bonus_points_value"].astype('int64')
-    _2["participant_name"] = _2["participant_name"].fillna("")
-    _2["latitude"] = _2["latitude"].fillna(0)
-    _2["longitude"] = _2["longitude"].fillna(0)
-
-    #rename all to match the right column names
-    _2.rename(columns={
-        "card_no":"cardId", 
-        "total_txn_value":"amount", 
-        "transaction_date":"issuedAt",
-        'merch_ref':'merchantReference',
-        'participant_name':'partner',
-        'form_of_pmt': 'paymentMode',
-        'terminal_id':'terminalId',
-        'tx_type': 'type'
-        },inplace=True)
-
-    return _2
-
-    # #upload to s3
-    # # Define your S3 bucket name and the object name (file name)
-    # reverse_batch = max_batch - batch
-    # s3_path = f's3://{bucket}/{s3_path}/year={year}/month={month}/day={day}/{reverse_batch}.csv'
-
-    # # Write DataFrame to S3
-    # #initiate S3 Instance
-    # s3 = S3(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_SESSION_TOKEN, AWS_REGION_NAME, staging=True, log_level=logging.CRITICAL)
-    # _2.to_csv(s3_path, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\', storage_options={
-    #     'key': AWS_ACCESS_KEY_ID,
-    #     'secret': AWS_SECRET_ACCESS_KEY,
-    #     'token': AWS_SESSION_TOKEN,
-    #     'client_kwargs': {'region_name': AWS_REGION_NAME}
-    # })
-    # print(f"completed date:: {yesterday}, batch:: {batch}")
-   
+    return product_gateway_out
+
+def _json_scalars(values):
+    #render every element exactly as json.dumps would, formatting each distinct value only once
+    if isinstance(values, pd.Series) and values.dtype == np.float64:
+        #factorize on the raw bits so -0.0 and 0.0 keep their own rendering
+        codes, uniques = pd.factorize(values.to_numpy().view(np.int64))
+        rendered = [json.dumps(v) for v in uniques.view(np.float64).tolist()]
+    else:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        rendered = [json.dumps(v) for v in uniques.tolist()]
+    return np.asarray(rendered, dtype=object)[codes]
+
+def _build_payload_columnar(_):
+    #columnar equivalent of _build_payload_legacy, output is byte-identical
+    #sort once (stable, so product order inside a transaction is kept) and work on contiguous group slices
+    _ = _.sort_values("transaction_id", kind="stable").reset_index(drop=True)
+    transaction_ids = _["transaction_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, transaction_ids[1:] != transaction_ids[:-1]])
+    ends = np.r_[starts[1:], len(_)]
+
+    #one json fragment per product row, built column-wise
+    product_json = (
+        '{"amount": ' + _json_scalars(_["value"])
+        + ', "categoryCode": ' + _json_scalars(_["group_code"])
+        + ', "points": {"standard": ' + _json_scalars(_["std_pts"])
+        + ', "bonus": ' + _json_scalars(_["bonus_pts"])
+        + '}, "productCode": ' + _json_scalars(_["product_code"])
+        + ', "quantity": ' + _json_scalars(_["qty"])
+        + '}'
+    ).tolist()
+    products = ['[' + ', '.join(product_json[start:end]) + ']' for start, end in zip(starts, ends)]
+
+    #per transaction reductions over the same slices
+    aggregated = pd.DataFrame({"transaction_id": transaction_ids[starts]})
+    for col in ["userId", "userId_type"]:
+        #max over strings via their sorted codes, same ordering as python's max()
+        codes, uniques = pd.factorize(_[col], sort=True)
+        aggregated[col] = uniques.take(np.maximum.reduceat(codes, starts))
+    for col in ["std_points_value", "bonus_points_value"]:
+        aggregated[col] = np.maximum.reduceat(_[col].to_numpy(dtype=np.float64), starts)
+
+    product_gateway_out = pd.DataFrame({"transaction_id": aggregated["transaction_id"]})
+    product_gateway_out["products"] = products
+    product_gateway_out["gateway"] = '{"id": 1, "transactionId": ' + _json_scalars(aggregated["transaction_id"]) + '}'
+    product_gateway_out["points"] = (
+        '{"standard": ' + _json_scalars(aggregated["std_points_value"])
+        + ', "bonus": ' + _json_scalars(aggregated["bonus_points_value"]) + '}'
+    )
+    product_gateway_out["user"] = (
+        '{"id": ' + _json_scalars(aggregated["userId"])
+        + ', "type": ' + _json_scalars(aggregated["userId_type"]) + '}'
+    )
+
+    #escape the quotes in one pass per column, same as json.dumps(...).replace('"','\\"')
+    for col in ["products", "gateway", "points", "user"]:
+        product_gateway_out[col] = product_gateway_out[col].str.replace('"', '\\"', regex=False)
+    return product_gateway_out
+
+def _load_joinable(cache, table, joinable_yesterday, q):
+    #read a dimension table through the optional ParquetCache, keyed by table + joinable_yesterday
+    if cache is None:
+        return bq_to_pd_v2(q)
+    return cache.get_or_load(table, joinable_yesterday, lambda: bq_to_pd_v2(q))
 
 #joinable tables function
-def get_all_joinable(joinable_yesterday):
+def get_all_joinable(joinable_yesterday, cache=None):
+    #cache: optional utils.cache_utils.ParquetCache so reruns and backfills read the dimension tables from local disk
     #add all joinable tables first
-    q = '''
+    #the terminal snapshot is the partition of the day after joinable_yesterday (today's for the daily run), so the
+    #query matches its cache key and reruns / backfills of past dates read the same snapshot
+    q = f'''
         SELECT 
             pp.participant_id,
             trim(pp.description) participant_name,
@@ -236,20 +316,20 @@ def get_all_joinable(joinable_yesterday):
         INNER JOIN base_layer.pt_participant AS pp1 ON pp.participant_id = pp1.parent_id --outlet
         INNER JOIN base_layer.pt_participant AS pp2 ON pp1.participant_id = pp2.parent_id 
         INNER JOIN base_layer.pt_terminal pt ON pp2.participant_id = pt.participant_id
-        where pp._PARTITIONDATE = current_date()
-        and pp1._PARTITIONDATE = current_date()
-        and pp2._PARTITIONDATE = current_date()
-        and pt._PARTITIONDATE = current_date()
+        where pp._PARTITIONDATE = DATE_ADD(DATE('{joinable_yesterday}'), INTERVAL 1 DAY)
+        and pp1._PARTITIONDATE = DATE_ADD(DATE('{joinable_yesterday}'), INTERVAL 1 DAY)
+        and pp2._PARTITIONDATE = DATE_ADD(DATE('{joinable_yesterday}'), INTERVAL 1 DAY)
+        and pt._PARTITIONDATE = DATE_ADD(DATE('{joinable_yesterday}'), INTERVAL 1 DAY)
         and pt.terminal_id not in ('SHVPTS01', 'SHVPTS02', 'SHVPTS03', 'SHVPTS04', 'SHVPTS05', 'SHVPTS06', 'SHVPTS07', 'SHVPTS08', 'SHVPTS09', 'SHVPTS10')
         '''
         
-    outlet_id_df = bq_to_pd_v2(q)
-    outlet_id_df["terminal_id"] = outlet_id_df["terminal_id"].str.strip()
+    outlet_id_df = _load_joinable(cache, "pt_participant_terminal", joinable_yesterday, q)
+    outlet_id_df = clean_string_columns(outlet_id_df, columns=["terminal_id"])
 
     q = f"""
         SELECT outletid as outlet_id, latitude, longitude FROM `blink-data-warehouse.base_layer.etl_mobileapp2_outlet` WHERE TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) = TIMESTAMP("{joinable_yesterday}")
         """
-    outlet_location_info_df = bq_to_pd_v2(q)
+    outlet_location_info_df = _load_joinable(cache, "etl_mobileapp2_outlet", joinable_yesterday, q)
 
     outlet_location_info_df = outlet_location_info_df.merge(outlet_id_df, on="outlet_id", how="left")
     #drop outlet_id_df no longer useful
@@ -259,7 +339,7 @@ def get_all_joinable(joinable_yesterday):
     q = f'''
         SELECT * FROM `blink-data-warehouse.base_layer._Shell_ref_groupcode` WHERE TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) = TIMESTAMP('{joinable_yesterday}')
         '''
-    groupcode_df = bq_to_pd_v2(q)[["group_code", "category", "sub_category", "product_type"]]
+    groupcode_df = _load_joinable(cache, "_Shell_ref_groupcode", joinable_yesterday, q)[["group_code", "category", "sub_category", "product_type"]]
     groupcode_df["group_code"] = pd.to_numeric(groupcode_df["group_code"], errors='coerce')
     groupcode_df.dropna(subset=["group_code"],inplace=True)
     groupcode_df["group_code"] = groupcode_df["group_code"].astype(int)
@@ -271,9 +351,8 @@ def get_all_joinable(joinable_yesterday):
         WHERE TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) = TIMESTAMP("{joinable_yesterday}") 
         AND (email IS NOT NULL OR mobile IS NOT NULL);
     '''
-    pii_df = bq_to_pd_v2(q)
-    pii_df["card_no"] = pii_df["card_no"].str.strip()
-    pii_df["card_no"] = pii_df["card_no"].astype(int)
+    pii_df = _load_joinable(cache, "nc_contact_base", joinable_yesterday, q)
+    pii_df = parse_card_no(pii_df)
 
     return groupcode_df, productcode_df, pii_df, outlet_location_info_df
 
@@ -290,4 +369,102 @@ def generate_date_strings(start_date_str, end_date_str, fmt="YYYY-MM-DD"):
         date_list.append(current_date.format(fmt))
         current_date = current_date.add(days=1)
 
-    return date_list
\ No newline at end of file
+    return date_list
+
+def get_transaction_id_range(yesterday):
+    #min/max transaction_id of the issue transactions in a partition, used to split the day into windows
+    q = f"""
+        SELECT MIN(transaction_id) transaction_id_min, MAX(transaction_id) transaction_id_max
+        FROM `blink-data-warehouse.base_layer.ods_tx_txn_df`
+        WHERE partition_dt = "{yesterday}"
+        AND TRIM(tx_type_code) IN ("0", "4")
+        """
+    df = bq_to_pd_v2(q)
+    if df.empty or pd.isna(df["transaction_id_min"].iloc[0]):
+        return None, None
+    return int(df["transaction_id_min"].iloc[0]), int(df["transaction_id_max"].iloc[0])
+
+def generate_transaction_id_windows(transaction_id_min, transaction_id_max, batch_size):
+    #[(batch, window_min, window_max), ...], window_max is exclusive to match process_tx_txn
+    windows = []
+    batch = 0
+    window_min = transaction_id_min
+    while window_min <= transaction_id_max:
+        window_max = min(window_min + batch_size, transaction_id_max + 1)
+        windows.append((batch, window_min, window_max))
+        window_min = window_max
+        batch += 1
+    return windows
+
+#joinable frames of the current worker process, set once by _init_tx_txn_worker
+_worker_joinables = None
+
+def _init_tx_txn_worker(joinables):
+    global _worker_joinables
+    _worker_joinables = joinables
+
+def _run_tx_txn_window(yesterday, batch, transaction_id_min, transaction_id_max, legacy_payload, instrument=False):
+    import time
+    start = time.perf_counter()
+    #a report of the worker's own, its stages go back to the parent with the result
+    report = RunReport("tx_txn_window", date=yesterday) if instrument else None
+    df = process_tx_txn(yesterday, batch, transaction_id_min, transaction_id_max, *_worker_joinables, legacy_payload=legacy_payload, report=report)
+    return batch, df, time.perf_counter() - start, report.stages if instrument else []
+
+def process_tx_txn_windows(yesterday, windows, joinables, max_workers=None, write_batch=None, legacy_payload=False, report=None):
+    """
+    Runs process_tx_txn over transaction_id windows on a process pool.
+
+    joinables is the tuple returned by get_all_joinable; it is handed to every worker once through the pool
+    initializer instead of being pickled with each task. max_workers=1 runs the windows serially in this process,
+    which is the baseline to compare the pool against.
+
+    Results are returned (and passed to write_batch(batch, df) when given) in batch order, together with a
+    list of per-batch timings {"batch", "rows", "seconds"}. With report (utils.metrics_utils.RunReport) the stages of
+    every batch, recorded in the workers, are added to it and write_batch is timed as a write stage.
+
+    Sample usage:
+        joinables = get_all_joinable(joinable_yesterday)
+        transaction_id_min, transaction_id_max = get_transaction_id_range(yesterday)
+        windows = generate_transaction_id_windows(transaction_id_min, transaction_id_max, 500000)
+        frames, timings = process_tx_txn_windows(yesterday, windows, joinables, max_workers=4)
+    """
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
+    frames = []
+    timings = []
+
+    def collect(batch, df, seconds, stages):
+        timings.append({"batch": batch, "rows": len(df), "seconds": seconds})
+        print(f"completed date:: {yesterday}, batch:: {batch}, rows:: {len(df)}, seconds:: {seconds:.2f}")
+        if report is not None:
+            report.extend(stages)
+        if write_batch is not None:
+            with timed_stage(report, "write", rows_in=len(df), batch=batch):
+                write_batch(batch, df)
+        frames.append(df)
+
+    instrument = report is not None
+    if max_workers == 1:
+        _init_tx_txn_worker(joinables)
+        for batch, window_min, window_max in windows:
+            collect(*_run_tx_txn_window(yesterday, batch, window_min, window_max, legacy_payload, instrument))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_tx_txn_worker, initargs=(joinables,)) as executor:
+            futures = [
+                executor.submit(_run_tx_txn_window, yesterday, batch, window_min, window_max, legacy_payload, instrument)
+                for batch, window_min, window_max in windows
+            ]
+            #futures are consumed in submission order so results and writes stay in batch order
+            for future in futures:
+                collect(*future.result())
+
+    wall_time = time.perf_counter() - start
+    batch_time = sum(timing["seconds"] for timing in timings)
+    rows = sum(timing["rows"] for timing in timings)
+    speedup = batch_time / wall_time if wall_time > 0 else 0
+    print(f"completed date:: {yesterday}, batches:: {len(timings)}, rows:: {rows}, wall seconds:: {wall_time:.2f}, "
+          f"summed batch seconds:: {batch_time:.2f}, speedup vs serial:: {speedup:.2f}x")
+    return frames, timings
@@ -0,0 +1,70 @@
+from datetime import date
+
+# Helpers for Hive style year=/month=/day= partitions on S3.
+# Each level is listed with Delimiter='/', so a lookup costs a few small listing calls per level
+# instead of enumerating every object under the table prefix. They take a plain boto3 S3 client and
+# work the same for utils.s3_utils.S3 and utils.s3_utils_archived.S3.
+
+def list_partition_values(s3_client, bucket_name, prefix, name):
+    """
+    Returns the values of partition level `name` directly under prefix as written in the keys, e.g. ['2024', '2025']
+    for year=, ordered numerically when every value is a number (so day=9 sorts before day=10).
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    paginator = s3_client.get_paginator('list_objects_v2')
+    values = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}{name}=", Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            values.append(common_prefix['Prefix'][len(prefix) + len(name) + 1:].rstrip('/'))
+    if all(value.isdigit() for value in values):
+        return sorted(values, key=int)
+    return sorted(values)
+
+def _partition_exists(s3_client, bucket_name, partition_prefix, marker):
+    if marker is None:
+        return True
+    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=f"{partition_prefix}{marker}", MaxKeys=1)
+    return response.get('KeyCount', 0) > 0
+
+def find_latest_partition(s3_client, bucket_name, prefix, marker=None):
+    """
+    Returns the latest year=/month=/day= partition under prefix as a 'YYYY-MM-DD' string, or None.
+
+    marker optionally names an object that must exist in the partition (e.g. '0.csv', the first batch file),
+    so a partition that is still being written is skipped in favour of the previous one.
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    for year in reversed(list_partition_values(s3_client, bucket_name, prefix, 'year')):
+        year_prefix = f"{prefix}year={year}/"
+        for month in reversed(list_partition_values(s3_client, bucket_name, year_prefix, 'month')):
+            month_prefix = f"{year_prefix}month={month}/"
+            for day in reversed(list_partition_values(s3_client, bucket_name, month_prefix, 'day')):
+                if _partition_exists(s3_client, bucket_name, f"{month_prefix}day={day}/", marker):
+                    return date(int(year), int(month), int(day)).isoformat()
+    return None
+
+def list_partition_dates(s3_client, bucket_name, prefix, start_date=None, end_date=None, marker=None):
+    """
+    Returns the 'YYYY-MM-DD' dates of the partitions under prefix between start_date and end_date (inclusive,
+    'YYYY-MM-DD' strings, None for open ended), oldest first. Years and months outside the range are not listed.
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    start = date.fromisoformat(start_date) if start_date else date.min
+    end = date.fromisoformat(end_date) if end_date else date.max
+    dates = []
+    for year in list_partition_values(s3_client, bucket_name, prefix, 'year'):
+        if not start.year <= int(year) <= end.year:
+            continue
+        year_prefix = f"{prefix}year={year}/"
+        for month in list_partition_values(s3_client, bucket_name, year_prefix, 'month'):
+            if not (start.year, start.month) <= (int(year), int(month)) <= (end.year, end.month):
+                continue
+            month_prefix = f"{year_prefix}month={month}/"
+            for day in list_partition_values(s3_client, bucket_name, month_prefix, 'day'):
+                partition_date = date(int(year), int(month), int(day))
+                if start <= partition_date <= end and _partition_exists(s3_client, bucket_name, f"{month_prefix}day={day}/", marker):
+                    dates.append(partition_date.isoformat())
+    return dates
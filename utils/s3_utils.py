@@ -1,11 +1,216 @@
 import boto3
 import pandas as pd
-from io import StringIO, BytesIO
+from io import StringIO, BytesIO, TextIOWrapper, RawIOBase
 import gzip
 import os
 import logging
 import csv
+import threading
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
+from utils.parquet_utils import write_parquet, parquet_writer_kwargs, resolve_parquet_profile, sort_for_parquet_profile
+from utils.arrow_utils import is_arrow_table, arrow_csv_supported, arrow_to_pandas, write_arrow_payload
+
+def encode_df_payload(dataframe, s3_key, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\', parquet_profile=None):
+    # The bytes S3.upload_df_to_s3 and AsyncS3.upload_df_to_s3 put for s3_key in one request
+    if is_arrow_table(dataframe):
+        if s3_key.endswith('.parquet') or arrow_csv_supported(dataframe, quotechar, quoting, escapechar):
+            buffer = BytesIO()
+            write_arrow_payload(dataframe, buffer, s3_key, quoting, parquet_profile)
+            return buffer.getvalue()
+        dataframe = arrow_to_pandas(dataframe)
+    if s3_key.endswith('.parquet'):
+        buffer = BytesIO()
+        write_parquet(dataframe, buffer, parquet_profile)
+        return buffer.getvalue()
+    csv_buffer = StringIO()
+    dataframe.to_csv(csv_buffer, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar)
+    body = csv_buffer.getvalue().encode('utf-8')
+    if s3_key.endswith('.csv.gz'):
+        gz_buffer = BytesIO()
+        with gzip.GzipFile(fileobj=gz_buffer, mode='w') as gz_file:
+            gz_file.write(body)
+        return gz_buffer.getvalue()
+    return body
+
+def concat_frames(data_frames, logger=None):
+    # One DataFrame from the frames of several objects, whose schemas may differ (missing columns, int vs double)
+    import pyarrow as pa
+
+    data_frames = [df for df in data_frames if len(df.columns) > 0]
+    if not data_frames:
+        return pd.DataFrame()
+    if len(data_frames) == 1:
+        return data_frames[0]
+    try:
+        tables = [pa.Table.from_pandas(df, preserve_index=False) for df in data_frames]
+        # Missing columns become nulls and numeric types are widened, e.g. int64 + double -> double;
+        # pyarrow < 14 only has the older promote flag
+        if int(pa.__version__.split('.')[0]) >= 14:
+            table = pa.concat_tables(tables, promote_options="permissive")
+        else:
+            table = pa.concat_tables(tables, promote=True)
+        return table.to_pandas()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        # Schemas that cannot be unified in Arrow (e.g. int and string in one column) fall back to pandas
+        (logger or logging.getLogger(__name__)).warning(f"Arrow concatenation failed, falling back to pandas: {e}")
+        return pd.concat(data_frames, ignore_index=True)
+
+def delete_batch_attempts(bucket_name, keys, max_retries=3, logger=None):
+    # The retry loop of S3._delete_batch and AsyncS3._delete_batch, which only differ in how they sleep and send.
+    # Yields (delay, Delete argument of delete_objects) and takes the response back through send();
+    # the StopIteration value is (deleted, failed errors)
+    errors = []
+    deleted = 0
+    for attempt in range(max_retries + 1):
+        delay = min(2 ** attempt * 0.1, 5) if attempt else 0
+        # Quiet mode only returns the failures, which keeps the response small
+        response = yield delay, {'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        errors = response.get('Errors', [])
+        deleted += len(keys) - len(errors)
+        if not errors:
+            break
+        keys = [error['Key'] for error in errors]
+        (logger or logging.getLogger(__name__)).warning(
+            f"{len(errors)} keys failed to delete from {bucket_name} (attempt {attempt + 1}), e.g. {errors[0].get('Code')}")
+    return deleted, errors
+
+class _S3MultipartWriter(RawIOBase):
+    """
+    Write-only file object that uploads what is written to it as an S3 multipart upload.
+
+    Bytes are buffered until part_size is reached, then the part is handed to a thread pool; at most
+    max_concurrency parts are in flight, so memory stays around (max_concurrency + 1) * part_size whatever the
+    total size. close() uploads the last part and completes the upload, abort() cancels it.
+    """
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, s3_client, bucket_name, s3_key, part_size=16 * 1024 * 1024, max_concurrency=4):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.s3_key = s3_key
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=s3_key)['UploadId']
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.in_flight = threading.BoundedSemaphore(max_concurrency)
+        self.futures = []
+        self.buffer = bytearray()
+        self.position = 0
+        self.part_number = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._submit_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _submit_part(self, body):
+        # Blocks while max_concurrency parts are still uploading
+        self.in_flight.acquire()
+        self.part_number += 1
+        future = self.executor.submit(self._upload_part, self.part_number, body)
+        future.add_done_callback(lambda _: self.in_flight.release())
+        self.futures.append(future)
+
+    def _upload_part(self, part_number, body):
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=self.s3_key, UploadId=self.upload_id, PartNumber=part_number, Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # The last part may be smaller than 5 MiB, and an empty object still needs one part
+            if self.buffer or self.part_number == 0:
+                self._submit_part(bytes(self.buffer))
+                self.buffer = bytearray()
+            parts = [future.result() for future in self.futures]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.s3_key, UploadId=self.upload_id, MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            # A failed part or complete leaves the upload open. Abort it here, the writer is closed afterwards so
+            # S3._abort_multipart skips it; the original error is the one raised
+            try:
+                self.abort()
+            except ClientError:
+                pass
+            raise
+        self.executor.shutdown(wait=True)
+        super().close()
+
+    def abort(self):
+        try:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.s3_key, UploadId=self.upload_id)
+        finally:
+            super().close()
+
+class _S3RangeFile(RawIOBase):
+    """
+    Read-only, seekable file object over an S3 object that fetches only the byte ranges actually read.
+
+    Each read becomes a GET with a Range header, so pyarrow can read a Parquet footer and then just the column
+    chunks / row groups it needs. bytes_fetched counts what was transferred, size is the full object size.
+    """
+    def __init__(self, s3_client, bucket_name, key, size=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket_name, Key=key)['ContentLength']
+        self.position = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        elif whence == os.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b''
+        end = self.position + size - 1
+        body = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key, Range=f"bytes={self.position}-{end}")['Body'].read()
+        self.position += len(body)
+        self.bytes_fetched += len(body)
+        self.requests += 1
+        return body
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
 
 class S3:
     """
@@ -20,11 +225,19 @@ class S3:
         s3_client (boto3.client): Boto3 S3 client instance.
 
     Methods:
-        __init__(self, aws_access_key_id, aws_secret_access_key, aws_session_token, region_name, staging, log_level):
-            Initializes the S3 class with AWS credentials, region, and logging settings.
+        __init__(self, aws_access_key_id, aws_secret_access_key, aws_session_token, region_name, staging, log_level, max_pool_connections, max_workers, endpoint_url):
+            Initializes the S3 class with AWS credentials, region, logging settings and connection pool / thread pool sizes.
+            endpoint_url points the clients at a local S3 stand-in such as moto server or MinIO.
+        
+        read_s3_files_to_df(self, bucket_name, prefix, max_workers, columns, filters):
+            Reads files from an S3 bucket with the given prefix into a pandas DataFrame, fetching objects concurrently.
+            columns limits the columns read; filters (pyarrow filter syntax, Parquet only) skips row groups and rows.
         
-        read_s3_files_to_df(self, bucket_name, prefix):
-            Reads files from an S3 bucket with the given prefix into a pandas DataFrame.
+        read_many(self, bucket_name, keys, max_workers, columns, filters):
+            Reads a known list of keys into a single pandas DataFrame, fetching objects concurrently.
+        
+        _read_parquet_ranged(self, bucket_name, key, columns, filters):
+            Helper method to read a Parquet object through HTTP range requests, fetching only the needed column chunks.
         
         _read_file_from_object(self, obj, key):
             Helper method to read different file types from an S3 object.
@@ -32,14 +245,29 @@ class S3:
         set_log_level(self, log_level):
             Sets the logging level.
         
-        upload_df_to_s3(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar):
-            Uploads a pandas DataFrame to S3 in CSV, gzipped CSV, or Parquet format.
+        upload_df_to_s3(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, streaming, chunk_rows, part_size, max_concurrency, parquet_profile, raise_errors):
+            Uploads a pandas DataFrame to S3 in CSV, gzipped CSV, or Parquet format. With streaming=True the output
+            is encoded chunk_rows rows at a time and sent as a concurrent multipart upload instead of one put.
+            parquet_profile names an entry of utils.parquet_utils.PARQUET_PROFILES (or is a dict of the same keys).
+            dataframe may also be a pyarrow Table, which is written with pyarrow's Parquet/CSV writers without a
+            pandas conversion (CSV falls back to pandas when values need escapechar, see utils.arrow_utils).
+            Failed uploads are logged; with raise_errors=True the error is raised as well, for callers that must not
+            carry on (e.g. mark a backfill unit done) after a failed upload. Returns the bytes uploaded, None on a
+            logged failure.
+        
+        copy_to_s3(self, path, bucket_name, s3_prefix, sync, max_workers, transfer_config):
+            Copies files or directories from local storage to S3. With sync=True only new or changed files are
+            uploaded, concurrently.
         
-        copy_to_s3(self, path, bucket_name, s3_prefix):
-            Copies files or directories from local storage to S3.
+        copy_to_local(self, bucket_name, s3_prefix, local_path, sync, max_workers, transfer_config):
+            Copies files from S3 to local storage. With sync=True only new or changed objects are downloaded,
+            concurrently.
         
-        copy_to_local(self, bucket_name, s3_prefix, local_path):
-            Copies files from S3 to local storage.
+        _sync(self, bucket_name, transfers, direction, max_workers, transfer_config):
+            Helper method to run the transfers of a sync on a thread pool and log a bytes/throughput summary.
+        
+        _local_etag(self, file_path, transfer_config):
+            Helper method to compute the ETag S3 would report for a local file uploaded with transfer_config.
         
         _download_file(self, bucket_name, s3_key, local_path):
             Helper method to download a single file from S3 to local storage.
@@ -50,21 +278,34 @@ class S3:
         _upload_directory(self, directory_path, bucket_name, s3_prefix):
             Helper method to upload a directory from local storage to S3.
         
-        _upload_csv(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar):
+        _upload_csv(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, raise_errors):
             Helper method to upload a pandas DataFrame to S3 in CSV format.
         
-        _upload_csv_gzip(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar):
+        _upload_csv_gzip(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, raise_errors):
             Helper method to upload a pandas DataFrame to S3 in gzipped CSV format.
         
-        _upload_parquet(self, dataframe, bucket_name, s3_key):
+        _upload_parquet(self, dataframe, bucket_name, s3_key, parquet_profile, raise_errors):
             Helper method to upload a pandas DataFrame to S3 in Parquet format.
         
-        delete_objects_from_s3(self, bucket_name, s3_prefix):
-            Deletes objects from an S3 bucket with the given prefix.
+        _upload_streaming(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, chunk_rows, part_size, max_concurrency, parquet_profile, raise_errors):
+            Helper method to upload a pandas DataFrame to S3 through a streaming multipart upload.
+        
+        delete_objects_from_s3(self, bucket_name, s3_prefix, max_workers, max_retries):
+            Deletes objects from an S3 bucket with the given prefix, 1000 keys per request and several requests
+            in parallel, retrying keys that fail.
+        
+        _delete_batch(self, bucket_name, keys, max_retries):
+            Helper method to delete up to 1000 keys in one request and retry the reported errors.
         
         list_objects_in_bucket(self, bucket_name, prefix, return_list):
             Lists objects in an S3 bucket with the given prefix.
         
+        identify_latest_partition_date(self, bucket_name, prefix, marker):
+            Returns the latest year=/month=/day= partition under the prefix as a 'YYYY-MM-DD' string.
+        
+        list_partition_dates(self, bucket_name, prefix, start_date, end_date, marker):
+            Lists the year=/month=/day= partition dates under the prefix within a date range.
+        
         # Deprecated: list_all_permissions(self):
             # Lists all permissions for the current AWS IAM entity. (Commented out in the code as it might not be useful)
         #Sample Usage:
@@ -79,7 +320,7 @@ class S3:
             # Do this to get all valid functions within the class:
                 [func for func in dir(S3) if callable(getattr(S3, func)) and not func.startswith("_")]
     """
-    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None, staging=False,log_level=logging.INFO):
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None, staging=False,log_level=logging.INFO, max_pool_connections=32, max_workers=16, endpoint_url=None):
         # Set up logger
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(log_level)
@@ -93,6 +334,12 @@ class S3:
         aws_access_key_id = aws_access_key_id or os.getenv('AWS_ACCESS_KEY_ID')
         aws_secret_access_key = aws_secret_access_key or os.getenv('AWS_SECRET_ACCESS_KEY')
         region_name = region_name or os.getenv('AWS_REGION')
+
+        # Size the botocore connection pool so concurrent reads/writes do not queue on connections
+        self.max_workers = max_workers
+        config = Config(max_pool_connections=max_pool_connections)
+        # Used by the sync transfers, multipart above 64 MiB with 4 threads per file
+        self.transfer_config = TransferConfig(multipart_threshold=64 * 1024 * 1024, multipart_chunksize=64 * 1024 * 1024, max_concurrency=4)
     
         if staging:
             aws_session_token = aws_session_token or os.getenv('AWS_SESSION_TOKEN')
@@ -101,14 +348,18 @@ class S3:
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
                 region_name=region_name,
-                aws_session_token=aws_session_token
+                aws_session_token=aws_session_token,
+                config=config,
+                endpoint_url=endpoint_url
             )
             self.s3_client = boto3.client(
                 's3',
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
                 region_name=region_name,
-                aws_session_token=aws_session_token
+                aws_session_token=aws_session_token,
+                config=config,
+                endpoint_url=endpoint_url
             )
             #THIS MIGHT NOT BE USEFUL SINCE THE PORTAL METHOD SEEMS TO BE CREATING THE ARN DIFFERENTLY
             # self.sts_client = boto3.client(
@@ -130,13 +381,17 @@ class S3:
                 's3',
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
-                region_name=region_name
+                region_name=region_name,
+                config=config,
+                endpoint_url=endpoint_url
             )
             self.s3_client = boto3.client(
                 's3',
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
-                region_name=region_name
+                region_name=region_name,
+                config=config,
+                endpoint_url=endpoint_url
             )
             #THIS MIGHT NOT BE USEFUL SINCE THE PORTAL METHOD SEEMS TO BE CREATING THE ARN DIFFERENTLY
             # self.sts_client = boto3.client(
@@ -152,7 +407,7 @@ class S3:
             #     region_name=region_name
             # )
 
-    def read_s3_files_to_df(self, bucket_name, prefix):
+    def read_s3_files_to_df(self, bucket_name, prefix, max_workers=None, columns=None, filters=None):
         try:
             # Try to get the object metadata to check if it's a file
             try:
@@ -164,25 +419,40 @@ class S3:
                 else:
                     raise e
 
-            data_frames = []
-
             if is_file:
-                self.logger.info(f"Processing file: {prefix}")
-                obj = self.s3_client.get_object(Bucket=bucket_name, Key=prefix)
-                data_frames.append(self._read_file_from_object(obj, prefix))
+                keys = [prefix]
             else:
-                bucket = self.s3.Bucket(bucket_name)
-                files = bucket.objects.filter(Prefix=prefix)
+                paginator = self.s3_client.get_paginator('list_objects_v2')
+                keys = [
+                    obj['Key']
+                    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+                    for obj in page.get('Contents', [])
+                ]
+            return self.read_many(bucket_name, keys, max_workers=max_workers, columns=columns, filters=filters)
 
-                for file in files:
-                    key = file.key
-                    self.logger.info(f"Processing file: {key}")
+        except (NoCredentialsError, ClientError) as e:
+            self.logger.error(f"Error reading S3 files: {str(e)}")
+            return pd.DataFrame()
 
-                    obj = self.s3_client.get_object(Bucket=bucket_name, Key=key)
-                    data_frames.append(self._read_file_from_object(obj, key))
+    def read_many(self, bucket_name, keys, max_workers=None, columns=None, filters=None):
+        # Callers that already know the keys skip the head_object probe and the listing
+        def read_key(key):
+            self.logger.info(f"Processing file: {key}")
+            if key.endswith('.parquet') and (columns is not None or filters is not None):
+                return self._read_parquet_ranged(bucket_name, key, columns, filters)
+            obj = self.s3_client.get_object(Bucket=bucket_name, Key=key)
+            df = self._read_file_from_object(obj, key)
+            if columns is not None:
+                df = df[[col for col in columns if col in df.columns]]
+            return df
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                # map keeps the frames in key order
+                data_frames = list(executor.map(read_key, keys))
 
             if data_frames:
-                return pd.concat(data_frames, ignore_index=True)
+                return concat_frames(data_frames, self.logger)
             else:
                 self.logger.warning("No valid files found to read.")
                 return pd.DataFrame()
@@ -191,10 +461,20 @@ class S3:
             self.logger.error(f"Error reading S3 files: {str(e)}")
             return pd.DataFrame()
 
+    def _read_parquet_ranged(self, bucket_name, key, columns=None, filters=None):
+        import pyarrow.parquet as pq
+
+        f = _S3RangeFile(self.s3_client, bucket_name, key)
+        # pre_buffer coalesces nearby column chunk ranges into fewer GETs
+        table = pq.read_table(f, columns=columns, filters=filters, pre_buffer=True)
+        share = f.bytes_fetched / f.size * 100 if f.size else 0
+        self.logger.info(f"Read {key}: fetched {f.bytes_fetched} of {f.size} bytes ({share:.1f}%) in {f.requests} range requests")
+        return table.to_pandas()
+
     def _read_file_from_object(self, obj, key):
         if key.endswith('.csv'):
             return pd.read_csv(obj['Body'])
-        elif key.endswith('.csv.zip'):
+        elif key.endswith(('.csv.gz', '.csv.zip')):
             with gzip.GzipFile(fileobj=BytesIO(obj['Body'].read())) as gz:
                 return pd.read_csv(gz)
         elif key.endswith('.parquet'):
@@ -208,14 +488,22 @@ class S3:
         for handler in self.logger.handlers:
             handler.setLevel(log_level)
 
-    def upload_df_to_s3(self, dataframe, bucket_name, s3_key, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\'):
+    def upload_df_to_s3(self, dataframe, bucket_name, s3_key, index=False, quotechar='\'', quoting=csv.QUOTE_NONE, escapechar='\\',
+                        streaming=False, chunk_rows=100000, part_size=16 * 1024 * 1024, max_concurrency=4, parquet_profile=None, raise_errors=False):
         try:
-            if s3_key.endswith('.csv'):
-                self._upload_csv(dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar)
+            if is_arrow_table(dataframe) and s3_key.endswith(('.csv', '.csv.gz', '.parquet')):
+                if s3_key.endswith('.parquet') or arrow_csv_supported(dataframe, quotechar, quoting, escapechar):
+                    return self._upload_arrow(dataframe, bucket_name, s3_key, quoting, streaming, part_size, max_concurrency, parquet_profile, raise_errors)
+                self.logger.info("Values need escaping the Arrow CSV writer does not support, converting the table to pandas")
+                dataframe = arrow_to_pandas(dataframe)
+            if streaming and s3_key.endswith(('.csv', '.csv.gz', '.parquet')):
+                return self._upload_streaming(dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, chunk_rows, part_size, max_concurrency, parquet_profile, raise_errors)
+            elif s3_key.endswith('.csv'):
+                return self._upload_csv(dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, raise_errors)
             elif s3_key.endswith('.csv.gz'):
-                self._upload_csv_gzip(dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar)
+                return self._upload_csv_gzip(dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, raise_errors)
             elif s3_key.endswith('.parquet'):
-                self._upload_parquet(dataframe, bucket_name, s3_key)
+                return self._upload_parquet(dataframe, bucket_name, s3_key, parquet_profile, raise_errors)
             else:
                 raise ValueError(f"Unsupported file extension for s3_key: {s3_key}")
         except NoCredentialsError as e:
@@ -225,9 +513,21 @@ class S3:
             self.logger.error(f"An error occurred: {e}")
             raise
 
-    def copy_to_s3(self, path, bucket_name, s3_prefix):
+    def copy_to_s3(self, path, bucket_name, s3_prefix, sync=False, max_workers=None, transfer_config=None):
         try:
-            if os.path.isfile(path):
+            if sync and (os.path.isfile(path) or os.path.isdir(path)):
+                if os.path.isfile(path):
+                    local_files = {os.path.join(s3_prefix, os.path.basename(path)): path}
+                else:
+                    local_files = {
+                        os.path.join(s3_prefix, os.path.relpath(os.path.join(root, file), path)): os.path.join(root, file)
+                        for root, _, files in os.walk(path)
+                        for file in files
+                    }
+                remote = self._list_remote_objects(bucket_name, s3_prefix)
+                transfers = [(file_path, s3_key, remote.get(s3_key)) for s3_key, file_path in sorted(local_files.items())]
+                self._sync(bucket_name, transfers, 'upload', max_workers, transfer_config)
+            elif os.path.isfile(path):
                 s3_key = os.path.join(s3_prefix, os.path.basename(path))
                 self._upload_file(path, bucket_name, s3_key)
             elif os.path.isdir(path):
@@ -241,7 +541,7 @@ class S3:
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
 
-    def copy_to_local(self, bucket_name, s3_prefix, local_path):
+    def copy_to_local(self, bucket_name, s3_prefix, local_path, sync=False, max_workers=None, transfer_config=None):
         try:
             # Check if the given S3 path is a file
             try:
@@ -253,7 +553,16 @@ class S3:
                 else:
                     raise e
 
-            if is_file:
+            if sync:
+                if is_file:
+                    remote = {s3_prefix: {'Size': obj_metadata['ContentLength'], 'ETag': obj_metadata['ETag'], 'LastModified': obj_metadata['LastModified']}}
+                    local_files = {s3_prefix: os.path.join(local_path, os.path.basename(s3_prefix))}
+                else:
+                    remote = self._list_remote_objects(bucket_name, s3_prefix)
+                    local_files = {key: os.path.join(local_path, os.path.relpath(key, s3_prefix)) for key in remote}
+                transfers = [(local_files[key], key, remote[key]) for key in sorted(remote)]
+                self._sync(bucket_name, transfers, 'download', max_workers, transfer_config)
+            elif is_file:
                 self._download_file(bucket_name, s3_prefix, local_path)
             else:
                 bucket = self.s3.Bucket(bucket_name)
@@ -278,6 +587,83 @@ class S3:
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
 
+    def _list_remote_objects(self, bucket_name, s3_prefix):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        return {
+            obj['Key']: obj
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix)
+            for obj in page.get('Contents', [])
+        }
+
+    def _local_etag(self, file_path, transfer_config):
+        # Plain MD5 for single part uploads, MD5 of the part MD5s plus "-<parts>" for multipart uploads
+        size = os.path.getsize(file_path)
+        part_digests = []
+        with open(file_path, 'rb') as f:
+            if size < transfer_config.multipart_threshold:
+                md5 = hashlib.md5()
+                for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+                    md5.update(block)
+                return f'"{md5.hexdigest()}"'
+            for part in iter(lambda: f.read(transfer_config.multipart_chunksize), b''):
+                part_digests.append(hashlib.md5(part).digest())
+        return f'"{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}"'
+
+    def _is_in_sync(self, file_path, remote, direction, transfer_config):
+        if remote is None or not os.path.isfile(file_path):
+            return False
+        if os.path.getsize(file_path) != remote['Size']:
+            return False
+        # Files downloaded by an earlier sync carry the object's LastModified as mtime, no need to hash them
+        if direction == 'download' and int(os.path.getmtime(file_path)) == int(remote['LastModified'].timestamp()):
+            return True
+        return self._local_etag(file_path, transfer_config) == remote['ETag']
+
+    def _sync(self, bucket_name, transfers, direction, max_workers=None, transfer_config=None):
+        # transfers: [(local file path, s3 key, listed remote object or None), ...]
+        transfer_config = transfer_config or self.transfer_config
+        totals = {'transferred_files': 0, 'transferred_bytes': 0, 'skipped_files': 0, 'skipped_bytes': 0, 'failed_files': 0}
+        totals_lock = threading.Lock()
+
+        def run(transfer):
+            file_path, s3_key, remote = transfer
+            try:
+                if self._is_in_sync(file_path, remote, direction, transfer_config):
+                    with totals_lock:
+                        totals['skipped_files'] += 1
+                        totals['skipped_bytes'] += remote['Size']
+                    return
+                if direction == 'upload':
+                    self.s3_client.upload_file(file_path, bucket_name, s3_key, Config=transfer_config)
+                    size = os.path.getsize(file_path)
+                else:
+                    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+                    self.s3_client.download_file(bucket_name, s3_key, file_path, Config=transfer_config)
+                    size = remote['Size']
+                    last_modified = remote['LastModified'].timestamp()
+                    os.utime(file_path, (last_modified, last_modified))
+                self.logger.debug(f"Synced {file_path} <-> {bucket_name}/{s3_key}")
+                with totals_lock:
+                    totals['transferred_files'] += 1
+                    totals['transferred_bytes'] += size
+            except (ClientError, OSError) as e:
+                self.logger.error(f"Failed to {direction} {file_path} <-> {bucket_name}/{s3_key}: {e}")
+                with totals_lock:
+                    totals['failed_files'] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            list(executor.map(run, transfers))
+        elapsed = time.perf_counter() - start
+        throughput = totals['transferred_bytes'] / 1024 ** 2 / elapsed if elapsed > 0 else 0
+        self.logger.info(
+            f"Sync {direction} {bucket_name}: transferred {totals['transferred_files']} files "
+            f"({totals['transferred_bytes'] / 1024 ** 2:.1f} MiB), skipped {totals['skipped_files']} unchanged files "
+            f"({totals['skipped_bytes'] / 1024 ** 2:.1f} MiB), failed {totals['failed_files']}, "
+            f"{elapsed:.1f}s, {throughput:.1f} MiB/s"
+        )
+        return totals
+
     def _download_file(self, bucket_name, s3_key, local_path):
         try:
             local_file_path = os.path.join(local_path, os.path.basename(s3_key))
@@ -312,70 +698,179 @@ class S3:
                 s3_key = os.path.join(s3_prefix, os.path.relpath(file_path, directory_path))
                 self._upload_file(file_path, bucket_name, s3_key)
 
-    def _upload_csv(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar):
+    def _upload_csv(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, raise_errors=False):
         try:
-            csv_buffer = StringIO()
-            dataframe.to_csv(csv_buffer, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar)
-            self.s3.Object(bucket_name, s3_key).put(Body=csv_buffer.getvalue())
+            body = encode_df_payload(dataframe, s3_key, index, quotechar, quoting, escapechar)
+            self.s3.Object(bucket_name, s3_key).put(Body=body)
             self.logger.info(f"Successfully uploaded CSV to {bucket_name}/{s3_key}")
+            return len(body)
         except NoCredentialsError as e:
             self.logger.error(f"Failed to upload CSV to S3 due to credentials error: {e}")
+            if raise_errors:
+                raise
         except ClientError as e:
             self.logger.error(f"Failed to upload CSV to S3 due to client error: {e}")
+            if raise_errors:
+                raise
         except Exception as e:
             self.logger.error(f"An error occurred while uploading CSV: {e}")
+            if raise_errors:
+                raise
 
-    def _upload_csv_gzip(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar):
+    def _upload_csv_gzip(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, raise_errors=False):
         try:
-            csv_buffer = StringIO()
-            dataframe.to_csv(csv_buffer, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar)
-            gz_buffer = BytesIO()
-            with gzip.GzipFile(fileobj=gz_buffer, mode='w') as gz_file:
-                gz_file.write(csv_buffer.getvalue().encode('utf-8'))
-            self.s3.Object(bucket_name, s3_key).put(Body=gz_buffer.getvalue())
+            body = encode_df_payload(dataframe, s3_key, index, quotechar, quoting, escapechar)
+            self.s3.Object(bucket_name, s3_key).put(Body=body)
             self.logger.info(f"Successfully uploaded gzipped CSV to {bucket_name}/{s3_key}")
+            return len(body)
         except NoCredentialsError as e:
             self.logger.error(f"Failed to upload gzipped CSV to S3 due to credentials error: {e}")
+            if raise_errors:
+                raise
         except ClientError as e:
             self.logger.error(f"Failed to upload gzipped CSV to S3 due to client error: {e}")
+            if raise_errors:
+                raise
         except Exception as e:
             self.logger.error(f"An error occurred while uploading gzipped CSV: {e}")
+            if raise_errors:
+                raise
 
-    def _upload_parquet(self, dataframe, bucket_name, s3_key):
+    def _upload_parquet(self, dataframe, bucket_name, s3_key, parquet_profile=None, raise_errors=False):
         try:
-            parquet_buffer = BytesIO()
-            dataframe.to_parquet(parquet_buffer, index=False)
-            self.s3.Object(bucket_name, s3_key).put(Body=parquet_buffer.getvalue())
+            body = encode_df_payload(dataframe, s3_key, parquet_profile=parquet_profile)
+            self.s3.Object(bucket_name, s3_key).put(Body=body)
             self.logger.info(f"Successfully uploaded Parquet to {bucket_name}/{s3_key}")
+            return len(body)
         except NoCredentialsError as e:
             self.logger.error(f"Failed to upload Parquet to S3 due to credentials error: {e}")
+            if raise_errors:
+                raise
         except ClientError as e:
             self.logger.error(f"Failed to upload Parquet to S3 due to client error: {e}")
+            if raise_errors:
+                raise
         except Exception as e:
             self.logger.error(f"An error occurred while uploading Parquet: {e}")
+            if raise_errors:
+                raise
 
-    def delete_objects_from_s3(self, bucket_name, s3_prefix):
+    def _upload_streaming(self, dataframe, bucket_name, s3_key, index, quotechar, quoting, escapechar, chunk_rows, part_size, max_concurrency, parquet_profile=None, raise_errors=False):
+        writer = None
         try:
-            # List all objects with the given prefix
-            response = self.s3_client.list_objects_v2(Bucket=bucket_name, Prefix=s3_prefix)
-            if 'Contents' in response:
-                # Collect all object keys to delete
-                objects_to_delete = [{'Key': obj['Key']} for obj in response['Contents']]
-                
-                # Perform the batch delete operation
-                delete_response = self.s3_client.delete_objects(
-                    Bucket=bucket_name,
-                    Delete={'Objects': objects_to_delete}
-                )
-                
-                # Log the deleted objects
-                if 'Deleted' in delete_response:
-                    for deleted in delete_response['Deleted']:
-                        self.logger.info(f"Successfully deleted {bucket_name}/{deleted['Key']}")
-                else:
-                    self.logger.info(f"No objects were deleted from {bucket_name} with prefix '{s3_prefix}'")
+            writer = _S3MultipartWriter(self.s3_client, bucket_name, s3_key, part_size=part_size, max_concurrency=max_concurrency)
+            if s3_key.endswith('.parquet'):
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                # Schema of the whole frame, so every row group is written with the same types
+                dataframe = sort_for_parquet_profile(dataframe, parquet_profile)
+                schema = pa.Schema.from_pandas(dataframe, preserve_index=False)
+                # Each chunk becomes its own row group, so chunk_rows follows the profile's row_group_size
+                chunk_rows = resolve_parquet_profile(parquet_profile).get("row_group_size", chunk_rows)
+                with pq.ParquetWriter(writer, schema, **parquet_writer_kwargs(parquet_profile)) as parquet_writer:
+                    for start in range(0, len(dataframe), chunk_rows):
+                        chunk = dataframe.iloc[start:start + chunk_rows]
+                        parquet_writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            else:
+                gz_file = gzip.GzipFile(fileobj=writer, mode='wb') if s3_key.endswith('.csv.gz') else None
+                text = TextIOWrapper(gz_file or writer, encoding='utf-8', newline='')
+                # Header only with the first chunk, an empty frame still writes its header
+                for start in range(0, max(len(dataframe), 1), chunk_rows):
+                    dataframe.iloc[start:start + chunk_rows].to_csv(
+                        text, header=start == 0, index=index, quotechar=quotechar, quoting=quoting, escapechar=escapechar
+                    )
+                text.flush()
+                text.detach()
+                if gz_file is not None:
+                    gz_file.close()
+            writer.close()
+            file_format = 'Parquet' if s3_key.endswith('.parquet') else 'gzipped CSV' if s3_key.endswith('.csv.gz') else 'CSV'
+            self.logger.info(f"Successfully uploaded {file_format} in {writer.part_number} parts to {bucket_name}/{s3_key}")
+            return writer.position
+        except NoCredentialsError as e:
+            self._abort_multipart(writer)
+            self.logger.error(f"Failed to stream upload to S3 due to credentials error: {e}")
+            if raise_errors:
+                raise
+        except ClientError as e:
+            self._abort_multipart(writer)
+            self.logger.error(f"Failed to stream upload to S3 due to client error: {e}")
+            if raise_errors:
+                raise
+        except Exception as e:
+            self._abort_multipart(writer)
+            self.logger.error(f"An error occurred while stream uploading: {e}")
+            if raise_errors:
+                raise
+
+    def _upload_arrow(self, table, bucket_name, s3_key, quoting, streaming, part_size, max_concurrency, parquet_profile=None, raise_errors=False):
+        file_format = 'Parquet' if s3_key.endswith('.parquet') else 'gzipped CSV' if s3_key.endswith('.csv.gz') else 'CSV'
+        writer = None
+        try:
+            if streaming:
+                writer = _S3MultipartWriter(self.s3_client, bucket_name, s3_key, part_size=part_size, max_concurrency=max_concurrency)
+                write_arrow_payload(table, writer, s3_key, quoting, parquet_profile)
+                writer.close()
+                self.logger.info(f"Successfully uploaded {file_format} from Arrow in {writer.part_number} parts to {bucket_name}/{s3_key}")
+                return writer.position
             else:
+                buffer = BytesIO()
+                write_arrow_payload(table, buffer, s3_key, quoting, parquet_profile)
+                body = buffer.getvalue()
+                self.s3.Object(bucket_name, s3_key).put(Body=body)
+                self.logger.info(f"Successfully uploaded {file_format} from Arrow to {bucket_name}/{s3_key}")
+                return len(body)
+        except NoCredentialsError as e:
+            self._abort_multipart(writer)
+            self.logger.error(f"Failed to upload {file_format} to S3 due to credentials error: {e}")
+            if raise_errors:
+                raise
+        except ClientError as e:
+            self._abort_multipart(writer)
+            self.logger.error(f"Failed to upload {file_format} to S3 due to client error: {e}")
+            if raise_errors:
+                raise
+        except Exception as e:
+            self._abort_multipart(writer)
+            self.logger.error(f"An error occurred while uploading {file_format}: {e}")
+            if raise_errors:
+                raise
+
+    def _abort_multipart(self, writer):
+        # Leaves no half-finished upload (and its stored parts) behind
+        try:
+            if writer is not None and not writer.closed:
+                writer.abort()
+        except ClientError as e:
+            self.logger.error(f"Failed to abort multipart upload: {e}")
+
+    def delete_objects_from_s3(self, bucket_name, s3_prefix, max_workers=None, max_retries=3):
+        try:
+            start = time.perf_counter()
+            deleted_count = 0
+            failed = []
+            # Every listing page holds at most 1000 keys, exactly one delete_objects request
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                futures = [
+                    executor.submit(self._delete_batch, bucket_name, [obj['Key'] for obj in page['Contents']], max_retries)
+                    for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix)
+                    if page.get('Contents')
+                ]
+                for future in futures:
+                    batch_deleted, batch_failed = future.result()
+                    deleted_count += batch_deleted
+                    failed.extend(batch_failed)
+
+            elapsed = time.perf_counter() - start
+            if deleted_count == 0 and not failed:
                 self.logger.info(f"No objects found in {bucket_name} with prefix '{s3_prefix}'")
+                return
+            rate = deleted_count / elapsed if elapsed > 0 else 0
+            self.logger.info(f"Deleted {deleted_count} objects from {bucket_name} with prefix '{s3_prefix}' in {elapsed:.1f}s ({rate:.0f} objects/s)")
+            if failed:
+                self.logger.error(f"Failed to delete {len(failed)} objects from {bucket_name}, first errors: {failed[:5]}")
         except NoCredentialsError as e:
             self.logger.error(f"Failed to delete from S3 due to credentials error: {e}")
         except ClientError as e:
@@ -383,6 +878,18 @@ class S3:
         except Exception as e:
             self.logger.error(f"An error occurred while deleting from S3: {e}")
 
+    def _delete_batch(self, bucket_name, keys, max_retries=3):
+        # Deletes up to 1000 keys, retrying the keys reported in Errors with backoff. Returns (deleted, failed errors)
+        attempts = delete_batch_attempts(bucket_name, keys, max_retries, self.logger)
+        try:
+            delay, delete = next(attempts)
+            while True:
+                if delay:
+                    time.sleep(delay)
+                response = self.s3_client.delete_objects(Bucket=bucket_name, Delete=delete)
+                delay, delete = attempts.send(response)
+        except StopIteration as result:
+            return result.value
 
     def list_objects_in_bucket(self, bucket_name, prefix='', return_list=True):
         try:
@@ -404,6 +911,25 @@ class S3:
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
 
+    def identify_latest_partition_date(self, bucket_name, prefix, marker=None):
+        from utils.s3_partition_utils import find_latest_partition
+        try:
+            return find_latest_partition(self.s3_client, bucket_name, prefix, marker=marker)
+        except NoCredentialsError as e:
+            self.logger.error(f"Failed to list partitions in S3 due to credentials error: {e}")
+        except ClientError as e:
+            self.logger.error(f"Failed to list partitions in S3 due to client error: {e}")
+
+    def list_partition_dates(self, bucket_name, prefix, start_date=None, end_date=None, marker=None):
+        from utils.s3_partition_utils import list_partition_dates
+        try:
+            return list_partition_dates(self.s3_client, bucket_name, prefix, start_date, end_date, marker=marker)
+        except NoCredentialsError as e:
+            self.logger.error(f"Failed to list partitions in S3 due to credentials error: {e}")
+        except ClientError as e:
+            self.logger.error(f"Failed to list partitions in S3 due to client error: {e}")
+        return []
+
     # THIS MIGHT NOT BE USEFUL SINCE THE PORTAL METHOD SEEMS TO BE CREATING THE ARN DIFFERENTLY
     # def list_all_permissions(self):
     #     try:
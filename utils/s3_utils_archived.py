@@ -57,33 +57,21 @@ class S3:
             return [content['Key'] for content in response['Contents']]
         else:
             return []
-    def identify_latest_date_from_partitioned(self, path):
+    def identify_latest_date_from_partitioned(self, path='tx_txn/type=issue/'):
         #compare s3 tables latest entries
-        from utils.s3_utils import S3
-        import pendulum
+        from utils.s3_partition_utils import find_latest_partition
 
-        done_paths = self.list_files_in_s3('tx_txn/type=issue/')
-        #filter only string ends with /0.csv, the slash is literal and not an escape
-        done_paths = [path for path in done_paths if path.endswith('/0.csv')]
-
-        if done_paths:
-            #get the max date of the latest file
-            done_paths.sort(reverse=True)
-            latest_path = done_paths[0]
-            #extract year from year=
-            year = latest_path.split('year=')[1].split('/')[0]
-            #extract month from month=
-            month = latest_path.split('month=')[1].split('/')[0]
-            #extract day from day=
-            day = latest_path.split('day=')[1].split('/')[0]
-            #construct a date string out of it
-            date = f"{year}-{month}-{day}"
-
-            latest_entry_in_s3 = pendulum.from_format(date, 'YYYY-M-D')
-            return latest_entry_in_s3.to_date_string()
+        #walk year=/month=/day= with delimiter listings, a partition only counts once its /0.csv exists
+        latest_entry_in_s3 = find_latest_partition(self.s3_client, self.bucket_name, path, marker='0.csv')
+        if latest_entry_in_s3:
+            return latest_entry_in_s3
         else:
             print("path doesn't existed, using default start_date:: 2024-07-02")
             return "2024-07-02"
+
+    def list_partition_dates(self, path, start_date=None, end_date=None):
+        from utils.s3_partition_utils import list_partition_dates
+        return list_partition_dates(self.s3_client, self.bucket_name, path, start_date, end_date, marker='0.csv')
 # Example usage
 # if __name__ == "__main__":
 #     # Create a sample DataFrame
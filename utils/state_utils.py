@@ -0,0 +1,151 @@
+import os
+import logging
+from io import BytesIO
+import numpy as np
+import pandas as pd
+
+class AwardedCardState:
+    """
+    AwardedCardState class for remembering which cards a campaign has already awarded.
+
+    The state is one small Parquet file, on local disk or at s3://bucket/key, holding every awarded card_no
+    (int64, sorted) with the transaction_id and partition_dt of its first qualifying transaction. The file's
+    metadata records through_date, the last partition_dt the state covers, so a day without winners still
+    moves it forward. With the state in place a daily run only has to rank the new partition and drop the
+    cards awarded on an earlier date, instead of re-ranking the whole campaign window.
+
+    Recording a date rewinds the state to it first: awards from that date onwards are replaced, so re-running
+    a date gives the same winners as the first run.
+
+    Attributes:
+        logger (logging.Logger): Logger instance for logging messages.
+        location (str): Local path or s3://bucket/key of the state file.
+        s3 (utils.s3_utils.S3): Client used for s3:// locations.
+        awarded (pandas.DataFrame): card_no, transaction_id and partition_dt of every awarded card.
+        through_date (str): Last partition_dt covered, 'YYYY-MM-DD', None before the first save.
+
+    Methods:
+        load(self):
+            Reads the state file, an empty state if it does not exist yet.
+
+        filter_new(self, df, observation_date, column):
+            Returns the rows of df whose card was not awarded before observation_date.
+
+        record(self, df, start_date, end_date):
+            Replaces the awards from start_date onwards with the first transaction per card in df.
+
+        save(self):
+            Writes the state file.
+
+    Sample usage:
+        state = AwardedCardState("s3://bl-data-staging/state/shell-500_awarded_cards.parquet", s3=s3).load()
+        winners = state.filter_new(first_transactions_of_the_day, "2024-08-02")
+        state.record(winners, "2024-08-02", "2024-08-02")
+        state.save()
+    """
+    columns = ["card_no", "transaction_id", "partition_dt"]
+
+    def __init__(self, location, s3=None, log_level=logging.INFO):
+        # Set up logger
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(log_level)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+
+        if location.startswith("s3://") and s3 is None:
+            raise ValueError("An utils.s3_utils.S3 instance is needed for s3:// state locations")
+        self.location = location
+        self.s3 = s3
+        self.awarded = pd.DataFrame({"card_no": pd.Series(dtype="int64"), "transaction_id": pd.Series(dtype="int64"),
+                                     "partition_dt": pd.Series(dtype="object")})
+        self.through_date = None
+
+    def _split_s3_location(self):
+        bucket_name, _, key = self.location[len("s3://"):].partition("/")
+        return bucket_name, key
+
+    def _read_bytes(self):
+        if self.s3 is None:
+            try:
+                with open(self.location, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        bucket_name, key = self._split_s3_location()
+        try:
+            return self.s3.s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+        except self.s3.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def load(self):
+        import pyarrow.parquet as pq
+
+        payload = self._read_bytes()
+        if payload is None:
+            self.logger.info(f"No state at {self.location} yet, starting empty")
+            return self
+        table = pq.read_table(BytesIO(payload))
+        metadata = table.schema.metadata or {}
+        self.through_date = metadata.get(b"through_date", b"").decode("utf-8") or None
+        self.awarded = table.to_pandas()[self.columns]
+        self.logger.info(f"Loaded state {self.location}: {len(self.awarded)} awarded cards through {self.through_date}")
+        return self
+
+    def _awarded_before(self, observation_date):
+        #sorted card numbers awarded on an earlier partition than observation_date
+        earlier = self.awarded["partition_dt"] < observation_date
+        return self.awarded["card_no"].to_numpy()[earlier.to_numpy()]
+
+    def filter_new(self, df, observation_date, column="card_no"):
+        awarded = self._awarded_before(observation_date)
+        cards = df[column].to_numpy(dtype="int64")
+        # Binary search in the sorted awarded cards, no hash table of the whole state is built
+        positions = np.searchsorted(awarded, cards).clip(max=max(len(awarded) - 1, 0))
+        already_awarded = awarded[positions] == cards if len(awarded) else np.zeros(len(cards), dtype=bool)
+        self.logger.info(f"{int(already_awarded.sum())} of {len(df)} cards were awarded before {observation_date}")
+        return df[~already_awarded]
+
+    def record(self, df, start_date, end_date):
+        """
+        Replaces every award on start_date or later (all of them if start_date is None) with the first transaction
+        per card in df (card_no, transaction_id, partition_dt columns) and moves through_date to end_date.
+        """
+        kept = self.awarded if start_date is None else self.awarded[self.awarded["partition_dt"] < start_date]
+        dropped = len(self.awarded) - len(kept)
+        if self.through_date is not None and start_date is not None and self.through_date >= start_date:
+            self.logger.info(f"Rewinding state from {self.through_date} to {start_date}, {dropped} awards replaced")
+
+        new = df[self.columns].copy()
+        new["card_no"] = new["card_no"].astype("int64")
+        new["transaction_id"] = new["transaction_id"].astype("int64")
+        new["partition_dt"] = new["partition_dt"].astype(str)
+        new = new.sort_values(["card_no", "transaction_id"]).drop_duplicates("card_no")
+        new = new[~new["card_no"].isin(kept["card_no"])]
+
+        self.awarded = pd.concat([kept, new], ignore_index=True).sort_values("card_no", ignore_index=True)
+        self.through_date = end_date
+        self.logger.info(f"Recorded {len(new)} awards through {end_date}, {len(self.awarded)} awarded cards in total")
+        return self
+
+    def save(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(self.awarded, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"through_date": (self.through_date or "").encode("utf-8")})
+        buffer = BytesIO()
+        pq.write_table(table, buffer, compression="zstd")
+        if self.s3 is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.location)), exist_ok=True)
+            tmp_path = f"{self.location}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, self.location)
+        else:
+            bucket_name, key = self._split_s3_location()
+            self.s3.s3_client.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue())
+        self.logger.info(f"Saved state {self.location}: {len(self.awarded)} awarded cards through {self.through_date}, {buffer.tell()} bytes")
+        return self
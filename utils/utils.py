@@ -1,3 +1,8 @@
+import os
+import re
+import hashlib
+import threading
+
 def test_bq_connection():
     from google.cloud import bigquery
     import pandas as pd
@@ -75,28 +80,184 @@ def bq_to_pd(query,cred = "/home/chunkit/codebase/blink-data-warehouse-fb84cc3e0
 #     results = query_job.result().to_dataframe(bqstorage_client=bqstorageclient)
 #     return results
 
-def bq_to_pd_v2(query, cred="/home/chunkit/codebase/blink-data-warehouse-fb84cc3e005f.json"):
+#BigQuery clients keyed by (credential path, project), shared by every bq_to_pd_v2 call in the process
+_bq_clients = {}
+_bq_clients_lock = threading.Lock()
+
+def _reset_bq_clients_after_fork():
+    #gRPC channels must not be shared across fork, a child process builds its own clients on first use
+    global _bq_clients, _bq_clients_lock
+    _bq_clients = {}
+    _bq_clients_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_bq_clients_after_fork)
+
+def _create_bq_clients(cred, project=None):
     from google.cloud import bigquery
     from google.cloud import bigquery_storage
-    import pandas as pd
     from google.oauth2 import service_account
 
     # Load the credentials from the service account file
     credentials = service_account.Credentials.from_service_account_file(cred)
 
     # Initialize a BigQuery client using the credentials
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+    client = bigquery.Client(credentials=credentials, project=project or credentials.project_id)
 
     # Initialize BigQuery Storage client using the same credentials
     bqstorageclient = bigquery_storage.BigQueryReadClient(credentials=credentials)
-
-    # Execute the query and download the results
-    query_job = client.query(query)
+    return client, bqstorageclient
+
+def get_bq_clients(cred="/home/chunkit/codebase/blink-data-warehouse-fb84cc3e005f.json", project=None):
+    #returns the (bigquery.Client, BigQueryReadClient) pair for cred/project, creating it on first use
+    key = (cred, project)
+    clients = _bq_clients.get(key)
+    if clients is None:
+        with _bq_clients_lock:
+            clients = _bq_clients.get(key)
+            if clients is None:
+                clients = _create_bq_clients(cred, project)
+                _bq_clients[key] = clients
+    return clients
+
+def reset_bq_clients():
+    #drop the shared clients, e.g. after rotating the service account key
+    with _bq_clients_lock:
+        for client, bqstorageclient in _bq_clients.values():
+            client.close()
+            bqstorageclient.transport.close()
+        _bq_clients.clear()
+
+#SQL functions whose result changes between runs, queries using them are never served from the result cache.
+#BigQuery also accepts the current_* functions without parentheses (e.g. DATE_SUB(CURRENT_DATE, INTERVAL 1 DAY))
+_VOLATILE_SQL = re.compile(
+    r"\b(current_date|current_datetime|current_time|current_timestamp)\b|\b(now|rand|generate_uuid|session_user)\s*\(",
+    re.IGNORECASE,
+)
+#quoted literals and identifiers, left untouched by normalize_query
+_SQL_QUOTED = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+#-- and /* */ comments, matched together with the quoted parts so comment markers inside literals are kept
+_SQL_COMMENT_OR_QUOTED = re.compile(r"(--[^\n]*|/\*.*?\*/)|" + _SQL_QUOTED.pattern, re.DOTALL)
+
+def normalize_query(query):
+    #drop comments and collapse whitespace outside quoted literals, so formatting changes hit the same cache entry
+    query = _SQL_COMMENT_OR_QUOTED.sub(lambda m: " " if m.group(1) else m.group(2), query)
+    parts = _SQL_QUOTED.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = " ".join(parts[i].split())
+    return "".join(parts).strip().rstrip(";").strip()
+
+def is_volatile_query(query):
+    #True if the query text depends on the time it runs (current_date() etc.) or is otherwise non-deterministic
+    parts = _SQL_QUOTED.split(normalize_query(query))
+    return any(_VOLATILE_SQL.search(part) for part in parts[0::2])
+
+def query_cache_key(query, project):
+    return hashlib.sha256(f"{project}\n{normalize_query(query)}".encode('utf-8')).hexdigest()
+
+def bq_to_pd_v2(query, cred="/home/chunkit/codebase/blink-data-warehouse-fb84cc3e005f.json", cache=None, refresh_cache=False, as_arrow=False, report=None):
+    #cache: optional utils.cache_utils.ParquetCache, results are stored under the hash of the normalized query and project
+    #refresh_cache: skip the lookup and re-run the query, the fresh result still replaces the cached one
+    #as_arrow: return a pyarrow.Table instead of a DataFrame, it can be passed straight to S3.upload_df_to_s3 / GCS.upload_df_to_gcs
+    #report: optional utils.metrics_utils.RunReport, the query job and the download are recorded as separate stages
+    from utils.metrics_utils import timed_stage
+    # Reuse the clients (and their gRPC channels) created by earlier calls with the same credentials
+    client, bqstorageclient = get_bq_clients(cred)
+
+    cache_key = None
+    if cache is not None:
+        if is_volatile_query(query):
+            cache.logger.info("Query uses volatile functions such as current_date(), not caching")
+        else:
+            cache_key = query_cache_key(query, client.project)
+            if not refresh_cache:
+                with timed_stage(report, "cache_read") as stage:
+                    results = cache.get("bq_results", cache_key, as_arrow=as_arrow)
+                    if results is not None:
+                        stage.rows_out = results.num_rows if as_arrow else len(results)
+                        stage.bytes = _result_nbytes(results, as_arrow) if report is not None else None
+                if results is not None:
+                    return results
+
+    # Execute the query and wait for it, result() returns once the job is done
+    total_rows = None
+    with timed_stage(report, "query") as stage:
+        query_job = client.query(query)
+        rows = query_job.result()
+        if report is not None:
+            total_rows = getattr(rows, 'total_rows', None)
+            stage.rows_out = total_rows
+            stage.bytes = getattr(query_job, 'total_bytes_processed', None)
 
     # Use the BigQuery Storage API to read the results
-    results = query_job.result().to_dataframe(bqstorage_client=bqstorageclient)
+    with timed_stage(report, "download", rows_in=total_rows) as stage:
+        if as_arrow:
+            results = rows.to_arrow(bqstorage_client=bqstorageclient)
+        else:
+            results = rows.to_dataframe(bqstorage_client=bqstorageclient)
+        stage.rows_out = results.num_rows if as_arrow else len(results)
+        stage.bytes = _result_nbytes(results, as_arrow) if report is not None else None
+    if cache_key is not None:
+        cache.put("bq_results", cache_key, results)
     return results
 
+def _result_nbytes(results, as_arrow):
+    #in-memory size of a query result, what the download stage of a report records
+    return results.nbytes if as_arrow else int(results.memory_usage(deep=True).sum())
+
+def _bq_types_mapper(arrow_type):
+    #same nullable dtypes to_dataframe uses for ints, bools and dates
+    import pyarrow as pa
+    import pandas as pd
+    if pa.types.is_integer(arrow_type):
+        return pd.Int64Dtype()
+    if pa.types.is_boolean(arrow_type):
+        return pd.BooleanDtype()
+    if pa.types.is_date32(arrow_type):
+        try:
+            import db_dtypes
+            return db_dtypes.DateDtype()
+        except ImportError:
+            return None
+    return None
+
+def bq_to_pd_stream(query, cred="/home/chunkit/codebase/blink-data-warehouse-fb84cc3e005f.json", chunk_rows=100000, as_arrow=False, max_queue_size=1):
+    """
+    Streaming counterpart of bq_to_pd_v2.
+
+    Yields the query result in chunks of chunk_rows rows (the last one may be smaller) read from the BigQuery
+    Storage Read API, as pandas DataFrames or, with as_arrow=True, pyarrow Tables. Only max_queue_size pages per
+    read stream are buffered ahead of the consumer, so memory stays bounded by the chunk size instead of the
+    result size.
+
+    Sample usage:
+        for chunk in bq_to_pd_stream(q, chunk_rows=200000):
+            s3.upload_df_to_s3(clean(chunk), bucket_name, f"{s3_path}/{i}.csv")
+    """
+    import pyarrow as pa
+
+    client, bqstorageclient = get_bq_clients(cred)
+    rows = client.query(query).result()
+
+    def to_chunk(table):
+        if as_arrow:
+            return table
+        return table.to_pandas(types_mapper=_bq_types_mapper)
+
+    pending = []
+    pending_rows = 0
+    for record_batch in rows.to_arrow_iterable(bqstorage_client=bqstorageclient, max_queue_size=max_queue_size):
+        pending.append(record_batch)
+        pending_rows += record_batch.num_rows
+        while pending_rows >= chunk_rows:
+            table = pa.Table.from_batches(pending)
+            yield to_chunk(table.slice(0, chunk_rows))
+            rest = table.slice(chunk_rows)
+            pending = rest.to_batches()
+            pending_rows = rest.num_rows
+    if pending_rows:
+        yield to_chunk(pa.Table.from_batches(pending))
+
 
 def generate_date_list(start_date_str, end_date_str, date_format="YYYY-MM-DD"):
     import pendulum